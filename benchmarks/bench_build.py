@@ -0,0 +1,33 @@
+import os
+import tempfile
+import time
+from pathlib import Path
+
+import pycc
+from benchmarks.sources import generate_units
+from pycc.utils import logger
+
+
+def main():
+    units = generate_units()
+    with tempfile.TemporaryDirectory() as directory:
+        sources = []
+        for i, source_code in enumerate(units):
+            path = Path(directory) / f"unit_{i}.c"
+            path.write_text(source_code)
+            sources.append(path)
+
+        expected = None
+        logger.info(f"{len(sources)} units, {os.cpu_count()} CPUs")
+        for workers in (1, 2, 4, 8):
+            start = time.perf_counter()
+            program = pycc.build(sources, workers=workers)
+            elapsed = time.perf_counter() - start
+            result = program.run()
+            assert expected is None or result == expected
+            expected = result
+            logger.info(f"workers={workers} {elapsed * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+import tempfile
+import time
+
+import pycc
+from benchmarks.sources import generate_program
+from pycc.cache import CompileCache
+from pycc.utils import logger
+
+
+def bench_compile(name: str, source_code: str, repeat: int = 5, **compile_kwargs):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        pycc.compile(source_code, **compile_kwargs)
+        best = min(best, time.perf_counter() - start)
+    logger.info(f"{name:<10} {best * 1000:.2f} ms")
+
+
+def main():
+    source_code = generate_program(num_funcs=15)
+    with tempfile.TemporaryDirectory() as directory:
+        cache = CompileCache(directory)
+        bench_compile("no-cache", source_code)
+        pycc.compile(source_code, cache=cache)
+        bench_compile("cache-hit", source_code, cache=cache)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+import tempfile
+import time
+
+import pycc
+from benchmarks.sources import generate_program
+from pycc.cache import CompileCache
+from pycc.parser import Parser
+from pycc.utils import logger
+
+
+def timed(name: str, source_code: str, cache: CompileCache):
+    start = time.perf_counter()
+    pycc.compile(source_code, stages=["image"], cache=cache)
+    logger.info(f"{name:<16} {(time.perf_counter() - start) * 1000:.1f} ms")
+
+
+def main():
+    source_code = generate_program(num_funcs=200)
+    # 每次只改动其中一个函数
+    first_edit = source_code.replace(
+        "int func_50(int a, int b) {\n  int x;", "int func_50(int a, int b) {\n  int x;\n  x = 1;"
+    )
+    edited = first_edit.replace(
+        "int func_100(int a, int b) {\n  int x;", "int func_100(int a, int b) {\n  int x;\n  x = 1;"
+    )
+    assert source_code != first_edit != edited
+
+    start = time.perf_counter()
+    Parser(edited, build_ast=False, poolsize=16 * 1024 * 1024).start()
+    logger.info(f"{'serial':<16} {(time.perf_counter() - start) * 1000:.1f} ms")
+    with tempfile.TemporaryDirectory() as directory:
+        cache = CompileCache(directory)
+        timed("cold cache", source_code, cache)
+        # 编译过的单元第一次改动时按函数编译并缓存各个函数
+        timed("first edit", first_edit, cache)
+        timed("one edited func", edited, cache)
+        timed("unchanged file", edited, cache)
+
+
+if __name__ == "__main__":
+    main()
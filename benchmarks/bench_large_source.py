@@ -0,0 +1,36 @@
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.sources import generate_program
+from pycc.lexer import Lexer
+from pycc.utils import logger
+from pycc.utils.memory import format_bytes, peak_rss
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lex a large generated source file through mmap.")
+    parser.add_argument("--size-mb", type=int, default=20, help="Approximate size of the generated file.")
+    args = parser.parse_args()
+
+    unit = generate_program(num_funcs=100)
+    with tempfile.NamedTemporaryFile("w", suffix=".c", delete=False) as f:
+        for _ in range(args.size_mb * 1024 * 1024 // len(unit) + 1):
+            f.write(unit)
+        path = f.name
+    try:
+        size = os.path.getsize(path)
+        rss_before = peak_rss()
+        start = time.perf_counter()
+        num_tokens = sum(1 for _ in Lexer.from_file(path).scan())
+        elapsed = time.perf_counter() - start
+        logger.info(f"{format_bytes(size)} source, {num_tokens} tokens in {elapsed:.1f} s")
+        if rss_before is not None:
+            logger.info(f"peak RSS: {format_bytes(peak_rss())} (before lexing: {format_bytes(rss_before)})")
+    finally:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
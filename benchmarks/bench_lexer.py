@@ -0,0 +1,68 @@
+import re
+import time
+from typing import Callable, Optional
+
+from benchmarks.sources import generate_program
+from pycc.lexer import Lexer, Token
+from pycc.utils import logger
+
+
+def legacy_tokenize(source_code: str) -> list[Token]:
+    """逐个 token 类尝试匹配的原实现，作为对照"""
+    token_stream: list[Token] = []
+    pos = 0
+    while pos < len(source_code):
+        if source_code.startswith("//", pos):
+            match_obj = re.compile(r"//[\s\S]*?(\n|$)").match(source_code, pos)
+        elif source_code.startswith("/*", pos):
+            match_obj = re.compile(r"/\*[\s\S]*?\*/").match(source_code, pos)
+        else:
+            match_obj = re.compile(r"[\s]+").match(source_code, pos)
+        if match_obj is not None:
+            pos = match_obj.end()
+            continue
+        token: Optional[Token] = None
+        for token_cls in Token.token_classes():
+            if match_obj := token_cls.match(source_code, pos):
+                pos = match_obj.end()
+                token = token_cls(match_obj.group()) if token_cls.has_value else token_cls()
+                break
+        if token is None:
+            raise Exception(f"Unexpected symbol: {source_code[pos]}")
+        token_stream.append(token)
+    return token_stream
+
+
+def bench(name: str, tokenize: Callable[[str], list[Token]], source_code: str, repeat: int = 3) -> float:
+    best = float("inf")
+    num_tokens = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        num_tokens = len(tokenize(source_code))
+        best = min(best, time.perf_counter() - start)
+    tokens_per_sec = num_tokens / best
+    logger.info(f"{name:<8} {num_tokens} tokens in {best * 1000:.1f} ms, {tokens_per_sec:,.0f} tokens/sec")
+    return tokens_per_sec
+
+
+def bench_trivia_scaling():
+    # 注释与空行占比很高时，耗时应随文件大小线性增长
+    for num_lines in (10000, 100000, 1000000):
+        source_code = "int a;\n" + "// comment\n" * num_lines + "\n" * num_lines + "int b;"
+        start = time.perf_counter()
+        Lexer(source_code).tokenize()
+        elapsed = time.perf_counter() - start
+        logger.info(f"trivia   {num_lines * 2} lines in {elapsed * 1000:.1f} ms")
+
+
+def main():
+    source_code = generate_program()
+    assert legacy_tokenize(source_code) == Lexer(source_code).tokenize()
+    before = bench("legacy", legacy_tokenize, source_code)
+    after = bench("master", lambda s: Lexer(s).tokenize(), source_code)
+    logger.info(f"speedup: {after / before:.2f}x")
+    bench_trivia_scaling()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+import os
+import time
+
+from benchmarks.sources import generate_program
+from pycc.image import Image
+from pycc.lexer import TokenBuffer
+from pycc.parallel import compile_functions_parallel
+from pycc.parser import Parser
+from pycc.utils import logger
+
+
+def main():
+    source_code = generate_program(num_funcs=200)
+    tokens = TokenBuffer.from_source(source_code)
+    logger.info(f"{len(tokens)} tokens, {os.cpu_count()} CPUs")
+
+    start = time.perf_counter()
+    parser = Parser(tokens, build_ast=False, poolsize=16 * 1024 * 1024)
+    parser.start()
+    serial = Image.from_parser(parser)
+    logger.info(f"serial    {(time.perf_counter() - start) * 1000:.1f} ms")
+    del parser
+
+    for workers in (1, 2, 4, 8):
+        start = time.perf_counter()
+        image = compile_functions_parallel(tokens, workers)
+        elapsed = time.perf_counter() - start
+        assert image.text == serial.text and image.data == serial.data
+        logger.info(f"workers={workers} {elapsed * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+import gc
+import time
+import tracemalloc
+
+from benchmarks.sources import generate_expressions, generate_program
+from pycc.lexer import TokenBuffer
+from pycc.parser import Parser
+from pycc.utils import logger
+
+
+def bench_parse(name: str, tokens: TokenBuffer, repeat: int = 3, **parser_kwargs: bool):
+    best = float("inf")
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        parser = Parser(tokens, **parser_kwargs)
+        parser.start()
+        best = min(best, time.perf_counter() - start)
+        del parser
+
+    # 统计一次语法分析过程中分配的内存块数
+    gc.collect()
+    tracemalloc.start()
+    parser = Parser(tokens, **parser_kwargs)
+    ast = parser.start()
+    num_blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics("filename"))
+    tracemalloc.stop()
+    del parser, ast
+    logger.info(
+        f"{name:<10} {len(tokens) / best:,.0f} tokens/sec, {best * 1000:.1f} ms, {num_blocks} live blocks after parse"
+    )
+
+
+def main():
+    tokens = TokenBuffer.from_source(generate_program(num_funcs=15))
+    bench_parse("ast", tokens, build_ast=True)
+    bench_parse("no-ast", tokens, build_ast=False)
+    # 表达式密集的代码
+    tokens = TokenBuffer.from_source(generate_expressions())
+    bench_parse("expr-ast", tokens, build_ast=True)
+    bench_parse("expr", tokens, build_ast=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import time
+from pathlib import Path
+
+import pycc
+from benchmarks.sources import (
+    generate_fibonacci_program,
+    generate_helper_program,
+    generate_induction_program,
+    generate_loop_program,
+    generate_program,
+    generate_propagation_program,
+    generate_tail_program,
+)
+from pycc.ir import DEFAULT_PASSES, run_passes
+from pycc.utils import logger
+
+
+def bench_cycles(name: str, source_code: str):
+    """分别只运行每一个遍与运行全部的遍时，-O2 代码执行的指令周期数"""
+    image = pycc.compile(source_code, stages=["image"], optimize=2).image
+    for passes in [(), *((name,) for name in DEFAULT_PASSES), DEFAULT_PASSES]:
+        program = pycc.compile(source_code, optimize=2, passes=passes)
+        start = time.perf_counter()
+        result = program.run()
+        elapsed = time.perf_counter() - start
+        _, report = run_passes(image, passes, superinstructions=True)  # type: ignore
+        label = ",".join(passes) or "none"
+        logger.info(
+            f"{name:<10} {label:<50} result {result:<8} {program.vm.cycle:>10,} cycles  "  # type: ignore
+            f"{elapsed * 1000:8.1f} ms  ({report})"
+        )
+
+
+# while 循环的各遍（旋转、不变量外提、强度削弱）
+LOOP_PASSES = ("copy-propagation", "loop-rotation", "licm", "strength-reduction", "dead-stores")
+INLINE_PASSES = ("inline", "copy-propagation", "dead-stores")
+
+
+def bench_speedup(name: str, source_code: str, passes: tuple[str, ...]):
+    """运行 passes 前后 -O2 代码执行的指令周期数"""
+    before = pycc.compile(source_code, optimize=2, passes=[])
+    after = pycc.compile(source_code, optimize=2, passes=passes)
+    result = before.run()
+    assert after.run() == result
+    cycles, optimized = before.vm.cycle, after.vm.cycle  # type: ignore
+    logger.info(
+        f"{name:<10} result {result:<10} {cycles:>10,} -> {optimized:>10,} cycles "
+        f"({(cycles - optimized) / cycles:.1%} fewer)  ({after.passes})"
+    )
+
+
+def bench_tail_recursion(depth: int = 1000000):
+    """消除尾调用后递归在固定大小的栈帧中执行"""
+    program = pycc.compile(generate_tail_program(depth), optimize=2, passes=["tail-calls"])
+    start = time.perf_counter()
+    result = program.run()
+    elapsed = time.perf_counter() - start
+    logger.info(
+        f"tail depth {depth:,}: result {result}  {program.vm.cycle:,} cycles  {elapsed * 1000:.1f} ms"  # type: ignore
+    )
+
+
+def bench_compile_time(num_funcs: int = 200):
+    """大源文件上构造中间表示、各遍与降级的耗时"""
+    image = pycc.compile(generate_program(num_funcs), stages=["image"], optimize=2, workers=1).image
+    _, report = run_passes(image, DEFAULT_PASSES, superinstructions=True)  # type: ignore
+    logger.info(f"{num_funcs} functions: {report}")
+
+
+def main():
+    bench_speedup("test.c", (Path(__file__).parent.parent / "test.c").read_text(), LOOP_PASSES)
+    bench_speedup("loop", generate_loop_program(), LOOP_PASSES)
+    bench_speedup("induction", generate_induction_program(), LOOP_PASSES)
+    bench_speedup("helpers", generate_helper_program(), INLINE_PASSES)
+    # 不消除尾调用时递归深度超出栈的大小，只比较不超出时的周期数
+    bench_speedup("tail", generate_tail_program(depth=1000), ("tail-calls",))
+    bench_tail_recursion()
+    bench_cycles("propagate", generate_propagation_program())
+    bench_cycles("loop", generate_loop_program())
+    bench_cycles("induction", generate_induction_program())
+    bench_cycles("helpers", generate_helper_program())
+    bench_cycles("fibonacci", generate_fibonacci_program())
+    bench_compile_time()
+
+
+if __name__ == "__main__":
+    main()
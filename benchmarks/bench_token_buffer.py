@@ -0,0 +1,36 @@
+import gc
+import time
+import tracemalloc
+from typing import Any, Callable
+
+from benchmarks.sources import generate_program
+from pycc.lexer import Lexer, TokenBuffer
+from pycc.utils import logger
+
+
+def measure(name: str, build: Callable[[], Any]) -> Any:
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    num_tokens = len(result)
+    logger.info(
+        f"{name:<12} {num_tokens} tokens, {size / num_tokens:.1f} bytes/token, "
+        f"{num_tokens / elapsed:,.0f} tokens/sec (traced)"
+    )
+    return result
+
+
+def main():
+    source_code = generate_program(num_funcs=500)
+    token_list = measure("list[Token]", lambda: Lexer(source_code).tokenize())
+    del token_list
+    buffer = measure("TokenBuffer", lambda: TokenBuffer.from_source(source_code))
+    logger.info(f"TokenBuffer arrays only: {buffer.nbytes() / len(buffer):.1f} bytes/token")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import time
+
+import pycc
+from benchmarks.sources import generate_fibonacci_program, generate_loop_program
+from pycc.parser import DEFAULT_POOLSIZE
+from pycc.trace import DEFAULT_TRACE_SIZE
+from pycc.utils import logger
+from pycc.vm import InstructionSet, VirtualMachine
+
+
+def bench_run(
+    name: str,
+    source_code: str,
+    optimize: int,
+    instruction_set: InstructionSet = InstructionSet.STACK,
+    repeat: int = 3,
+):
+    best = float("inf")
+    for _ in range(repeat):
+        program = pycc.compile(source_code, optimize=optimize, instruction_set=instruction_set)
+        start = time.perf_counter()
+        result = program.run()
+        best = min(best, time.perf_counter() - start)
+    cycles = program.vm.cycle  # type: ignore
+    logger.info(
+        f"{name:<10} {instruction_set.name.lower():<8} -O{optimize}  "
+        f"result {result:<8} {cycles:>10,} cycles  {best * 1000:8.1f} ms"
+    )
+
+
+def bench_throughput(n: int = 27, repeat: int = 3):
+    """test.c 中的递归斐波那契程序，统计不打印调试信息时虚拟机每秒执行的指令数"""
+    source_code = generate_fibonacci_program(n)
+    for instruction_set in InstructionSet:
+        for optimize in (0, 2):
+            best = float("inf")
+            for _ in range(repeat):
+                program = pycc.compile(source_code, optimize=optimize, instruction_set=instruction_set)
+                start = time.perf_counter()
+                program.run()
+                best = min(best, time.perf_counter() - start)
+            cycles = program.vm.cycle  # type: ignore
+            logger.info(
+                f"fibonacci({n}) {instruction_set.name.lower():<8} -O{optimize}  "
+                f"{cycles:>12,} instructions  {cycles / best / 1e6:8.1f} M instructions/s"
+            )
+
+
+def bench_trace(n: int = 22, capacity: int = DEFAULT_TRACE_SIZE):
+    """记录执行轨迹时逐条单步执行，每条指令写入环形缓冲区中的一条记录"""
+    program = pycc.compile(generate_fibonacci_program(n))
+    program.vm.set_trace(capacity)  # type: ignore
+    start = time.perf_counter()
+    program.run()
+    elapsed = time.perf_counter() - start
+    cycles = program.vm.cycle  # type: ignore
+    logger.info(
+        f"fibonacci({n}) traced  {cycles:>12,} instructions  {cycles / elapsed / 1e6:8.1f} M instructions/s  "
+        f"({len(program.vm.trace):,} records kept)"  # type: ignore
+    )
+
+
+def bench_lifecycle(repeat: int = 2000):
+    """大量短生命周期的虚拟机：构造、载入小程序运行与 reset 的平均耗时"""
+    image = pycc.compile(generate_loop_program(10), stages=["image"]).image
+    start = time.perf_counter()
+    for _ in range(repeat):
+        VirtualMachine(DEFAULT_POOLSIZE)
+    construct = (time.perf_counter() - start) / repeat
+    start = time.perf_counter()
+    for _ in range(repeat):
+        pycc.from_image(image).run()  # type: ignore
+    run = (time.perf_counter() - start) / repeat
+    vm = VirtualMachine(DEFAULT_POOLSIZE)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        vm.reset()
+    reset = (time.perf_counter() - start) / repeat
+    logger.info(f"construct {construct * 1e6:8.1f} us  load and run {run * 1e6:8.1f} us  reset {reset * 1e6:8.1f} us")
+
+
+def main():
+    programs = {
+        "loop": generate_loop_program(),
+        "fibonacci": generate_fibonacci_program(),
+    }
+    # 栈式与寄存器虚拟机分别在各优化级别下运行
+    for name, source_code in programs.items():
+        for instruction_set in InstructionSet:
+            for optimize in (0, 1, 2, 3):
+                bench_run(name, source_code, optimize, instruction_set)
+    bench_throughput()
+    bench_trace()
+    bench_lifecycle()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+def generate_program(num_funcs: int = 200, num_stmts: int = 20) -> str:
+    """生成用于基准测试的 C 源码，包含注释、全局变量、函数调用与各类表达式"""
+    lines: list[str] = ["// generated for benchmark", "int counter;", ""]
+    for i in range(num_funcs):
+        lines.append(f"/* function {i} */")
+        lines.append(f"int func_{i}(int a, int b) {{")
+        lines.append("  int x;")
+        lines.append("  int y;")
+        lines.append("  x = a + b * 2;")
+        lines.append("  y = 0;")
+        for j in range(num_stmts):
+            lines.append(f"  // statement {j}")
+            lines.append(f"  y = y + (x - {j}) * 3 / (b + 1) % 7;")
+            lines.append(f"  if (x >= {j} && y != 0 || a == b) {{ x = x - 1; }} else {{ y = y + 1; }}")
+        lines.append("  while (x > 0) { x = x - 1; counter = counter + 1; }")
+        lines.append("  return x + y;")
+        lines.append("}")
+        lines.append("")
+    lines.append("int main() {")
+    lines.append("  return func_0(1, 2);")
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+def generate_expressions(num_stmts: int = 200) -> str:
+    """生成由大量复杂表达式组成的函数，用于测试表达式解析的吞吐量"""
+    lines: list[str] = ["int g;", "int main() {", "  int a;", "  int b;", "  int c;", "  a = 1;", "  b = 2;"]
+    for i in range(num_stmts):
+        lines.append(
+            f"  c = a + b * {i} - (a - b) / 3 % 5 + (g | a ^ b & c) - (a < b) + (a >= {i}) * (b != c || a == 1 && b);"
+        )
+    lines.append("  return c;")
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+def generate_units(num_units: int = 16, num_funcs: int = 15, num_stmts: int = 20) -> list[str]:
+    """生成多个可分别编译后链接的 C 源文件，第一个文件中定义 main 与全局变量"""
+    units: list[str] = []
+    for unit in range(num_units):
+        program = generate_program(num_funcs, num_stmts)
+        # 函数名加上单元编号，避免链接时重复定义
+        program = program.replace("func_", f"func_{unit}_")
+        body, main = program.split("int main() {")
+        if unit == 0:
+            calls = " + ".join(f"func_{i}_0(1, 2)" for i in range(num_units))
+            prototypes = "".join(f"int func_{i}_0(int a, int b);\n" for i in range(1, num_units))
+            units.append(f"{prototypes}{body}int main() {{\n  return {calls};\n}}\n")
+        else:
+            units.append(body.replace("int counter;", "extern int counter;"))
+    return units
+
+
+def generate_loop_program(num_iterations: int = 100000) -> str:
+    """计数循环，循环体中读写局部变量与全局变量并加减常量"""
+    return f"""
+int total;
+int main() {{
+  int i;
+  int a;
+  i = 0;
+  a = 0;
+  while (i < {num_iterations}) {{
+    a = a + i % 7;
+    total = total + 1;
+    i = i + 1;
+  }}
+  return a + total;
+}}
+"""
+
+
+def generate_fibonacci_program(n: int = 20) -> str:
+    """递归求斐波那契数"""
+    return f"""
+int fibonacci(int i) {{
+  if (i <= 1) {{
+    return 1;
+  }}
+  return fibonacci(i - 1) + fibonacci(i - 2);
+}}
+
+int main() {{
+  return fibonacci({n});
+}}
+"""
+
+
+def generate_propagation_program(num_iterations: int = 100000) -> str:
+    """循环条件与循环体读取赋值为常量后不再改变的变量，并有从不读取的赋值"""
+    return f"""
+int main() {{
+  int i;
+  int a;
+  int step;
+  int limit;
+  int unused;
+  step = 3;
+  limit = {num_iterations};
+  i = 0;
+  a = 0;
+  while (i < limit) {{
+    unused = a * 2;
+    a = a + step * 2;
+    i = i + 1;
+  }}
+  return a;
+}}
+"""
+
+
+def generate_induction_program(num_iterations: int = 100000) -> str:
+    """循环体中有由参数与全局变量算出的不变表达式，以及循环变量与常量的乘积"""
+    return f"""
+int scale;
+int sum(int base) {{
+  int i;
+  int s;
+  i = 0;
+  s = 0;
+  while (i < {num_iterations}) {{
+    s = s + (i * 4 + (base * scale + 7)) % 1000;
+    i = i + 1;
+  }}
+  return s;
+}}
+int main() {{
+  scale = 3;
+  return sum(5);
+}}
+"""
+
+
+def generate_helper_program(num_iterations: int = 20000) -> str:
+    """循环中反复调用只有几条语句的小函数"""
+    return f"""
+int limit;
+int square(int x) {{
+  return x * x;
+}}
+int clamp(int v, int lo, int hi) {{
+  if (v < lo) {{
+    return lo;
+  }}
+  if (v > hi) {{
+    return hi;
+  }}
+  return v;
+}}
+int mix(int a, int b) {{
+  return a * 3 + b;
+}}
+int main() {{
+  int i;
+  int s;
+  limit = 5000;
+  i = 0;
+  s = 0;
+  while (i < {num_iterations}) {{
+    s = mix(s, clamp(square(i % 100) - 100, 0, limit)) % 65536;
+    i = i + 1;
+  }}
+  return s;
+}}
+"""
+
+
+def generate_tail_program(depth: int = 100000) -> str:
+    """尾递归求和，不消除尾调用时递归深度远超虚拟机的栈"""
+    return f"""
+int sum(int n, int acc) {{
+  if (n == 0) {{
+    return acc;
+  }}
+  return sum(n - 1, (acc + n) % 1000);
+}}
+int main() {{
+  return sum({depth}, 0) + sum(1000, 0);
+}}
+"""
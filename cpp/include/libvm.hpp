@@ -3,6 +3,7 @@
 #include <iomanip>
 #include <iostream>
 #include <memory>
+#include <vector>
 
 namespace logger {
 const std::string INFO_BADGE = "\x1b[94m INFO \x1b[0m";
@@ -34,9 +35,72 @@ enum {
   AND,  EQ,   NE,   LT,   GT,   LE,   GE,   SHL,
   SHR,  ADD,  SUB,  MUL,  DIV,  MOD,  OPEN, READ,
   CLOS, PRTF, MALC, FREE, MSET, MCMP, EXIT, PLAC,
+  // 融合指令（superinstruction），均带一个操作数：
+  // LLI k = LEA k; LI    LGI a = IMM a; LI
+  // ADDI c = PUSH; IMM c; ADD    SLI k = 以 LEA k; PUSH 开头、SI 结尾的赋值
+  LLI,  LGI,  ADDI, SLI,
 };
 // clang-format on
 
+// 指令之后是否紧跟一个操作数
+inline bool has_operand(int64 op) {
+  return op <= ADJ || (op >= LLI && op <= SLI);
+}
+
+// 寄存器虚拟机指令集：16 个通用寄存器，三地址指令。
+// 指令字低 8 位为操作码，其后每 8 位依次为寄存器 a、b、c（R_SYS 中为系统调用号与参数个数），
+// 带立即数或地址的指令之后紧跟一个操作数
+constexpr int NUM_REGISTERS = 16;
+
+// clang-format off
+enum {
+  R_MOV,  R_LI,   R_LEA,  R_LD,   R_LDC,  R_ST,   R_STC,  R_LDL,
+  R_STL,  R_LDG,  R_STG,  R_OR,   R_XOR,  R_AND,  R_EQ,   R_NE,
+  R_LT,   R_GT,   R_LE,   R_GE,   R_SHL,  R_SHR,  R_ADD,  R_SUB,
+  R_MUL,  R_DIV,  R_MOD,  R_ADDI, R_JMP,  R_JZ,   R_JNZ,  R_CALL,
+  R_ENT,  R_ADJ,  R_LEV,  R_PUSH, R_POP,  R_SYS,  R_EXIT,
+};
+// clang-format on
+
+inline bool register_has_operand(int64 op) {
+  switch (op & 0xff) {
+    case R_LI: case R_LEA: case R_LDL: case R_STL: case R_LDG: case R_STG:
+    case R_ADDI: case R_JMP: case R_JZ: case R_JNZ: case R_CALL: case R_ENT:
+    case R_ADJ:
+      return true;
+    default:
+      return false;
+  }
+}
+
+// 代码段中的指令集，决定 run/step 使用的解释器
+enum class InstructionSetCpp {
+  STACK = 0,
+  REGISTER = 1,
+};
+
+// 重定位类型：代码段中该位置保存的是代码段或数据段内的地址
+enum class RelocationCpp {
+  TEXT = 0,
+  DATA = 1,
+};
+
+// .pyco 镜像文件头，各段偏移均按 8 字节对齐，整数为本机字节序
+constexpr char IMAGE_MAGIC[4] = {'P', 'Y', 'C', 'O'};
+constexpr unsigned int IMAGE_VERSION = 3;
+
+struct ImageHeader {
+  char magic[4];
+  unsigned int version;
+  int64 entry;  // main 函数在代码段中的字节偏移，-1 表示没有 main
+  uint64 text_offset, text_size;
+  uint64 data_offset, data_size;
+  uint64 relocations_offset, num_relocations;
+  uint64 symbols_offset, symbols_size;  // 符号表与外部引用由 Python 端读取
+  uint64 num_externals;  // 未解析的外部引用数，不为 0 的目标单元需先链接
+};
+static_assert(sizeof(ImageHeader) == 88, "unexpected image header layout");
+
 enum class VMStatusCpp {
   INIT = 0,
   RUNNING = 1,
@@ -44,19 +108,39 @@ enum class VMStatusCpp {
   ERROR = 3,
 };
 
+// 执行轨迹中的一条记录，均为执行该指令之前的状态
+struct TraceRecordCpp {
+  int64 cycle;
+  int64 pc;       // 指令在代码段中的下标
+  int64 op;       // 寄存器虚拟机中为完整的指令字
+  int64 operand;  // 没有操作数的指令为 0
+  int64 ax;       // 寄存器虚拟机中为 r0
+  int64 sp;       // 栈中已使用的槽数
+};
+
+// 栈区的默认大小。各段均只预留地址空间，物理页在首次访问时才提交，较大的栈几乎没有额外开销
+constexpr int DEFAULT_STACK_SIZE = 8 * 1024 * 1024;
+
 class VirtualMachineCpp {
  private:
   int op_counter_;
   int64 result_;
+  std::vector<TraceRecordCpp> trace_;  // 环形缓冲区，为空时不记录执行轨迹
+  int64 trace_count_;                  // 已写入的记录数，超过容量后覆盖最早的记录
+  void record_trace(int64 op, bool operand, Register ax);
+  void reset_registers();
 
  public:
   AddressRegister pc;  // PC, 程序计数器
   AddressRegister bp;  // BP, 基址指针
   AddressRegister sp;  // SP, 堆栈指针
   Register ax;         // 通用寄存器
+  Register regs[NUM_REGISTERS];  // 寄存器虚拟机的通用寄存器，r0 保存返回值
   Register cycle;
-  int poolsize;
+  int poolsize;    // 代码段与数据段的字节数
+  int stack_size;  // 栈区的字节数
   VMStatusCpp status;
+  InstructionSetCpp instruction_set;
 
   int64 *text,        // 代码段
       *old_text,      // for dump text segment
@@ -65,15 +149,33 @@ class VirtualMachineCpp {
       *current_data;  // 当前数据指针
 
   VirtualMachineCpp();
-  VirtualMachineCpp(int poolsize);
+  VirtualMachineCpp(int poolsize,
+                    InstructionSetCpp instruction_set = InstructionSetCpp::STACK,
+                    int stack_size = DEFAULT_STACK_SIZE);
+  VirtualMachineCpp(const VirtualMachineCpp &) = delete;
+  VirtualMachineCpp &operator=(const VirtualMachineCpp &) = delete;
   ~VirtualMachineCpp();
-  Status _allocate_memory();
+  void _allocate_memory();
+  AddressRegister stack_top();
   void reset();
   void add_op(int64 op);
+  void truncate(int num_ops);
+  int num_ops();
+  int64 data_size();
+  void load(const int64 *text, int num_ops, const char *data, int64 data_size,
+            const int64 *relocations, int num_relocations);
+  int64 load_image(const char *path);
   int64 put_int_onto_data(int value);
   VMStatusCpp step(bool debug);
+  VMStatusCpp step_register(bool debug);
+  // 不打印调试信息的解释循环，run(false) 使用
+  int64 execute();
+  int64 execute_register();
   int64 run(bool debug);
   int64 run_all_ops(bool debug);
+  void set_trace(int64 capacity);
+  int64 trace_size();
+  const TraceRecordCpp *trace();
   int pc_offset();
   int64 get_op_pointer(int offset);
   void set_pc(int64 pc);
@@ -9,6 +9,23 @@ cdef extern from "include/libvm.hpp" namespace "vm":
     cdef int AND,  EQ,   NE,   LT,   GT,   LE,   GE,   SHL
     cdef int SHR,  ADD,  SUB,  MUL,  DIV,  MOD,  OPEN, READ
     cdef int CLOS, PRTF, MALC, FREE, MSET, MCMP, EXIT, PLAC
+    cdef int LLI,  LGI,  ADDI, SLI
+    cdef int NUM_REGISTERS
+    cdef int DEFAULT_STACK_SIZE
+    cdef int R_MOV,  R_LI,   R_LEA,  R_LD,   R_LDC,  R_ST,   R_STC,  R_LDL
+    cdef int R_STL,  R_LDG,  R_STG,  R_OR,   R_XOR,  R_AND,  R_EQ,   R_NE
+    cdef int R_LT,   R_GT,   R_LE,   R_GE,   R_SHL,  R_SHR,  R_ADD,  R_SUB
+    cdef int R_MUL,  R_DIV,  R_MOD,  R_ADDI, R_JMP,  R_JZ,   R_JNZ,  R_CALL
+    cdef int R_ENT,  R_ADJ,  R_LEV,  R_PUSH, R_POP,  R_SYS,  R_EXIT
+    cdef unsigned int IMAGE_VERSION
+
+    cdef enum RelocationCpp 'vm::RelocationCpp':
+        RELOC_TEXT 'vm::RelocationCpp::TEXT'
+        RELOC_DATA 'vm::RelocationCpp::DATA'
+
+    cdef enum InstructionSetCpp 'vm::InstructionSetCpp':
+        ISA_STACK 'vm::InstructionSetCpp::STACK'
+        ISA_REGISTER 'vm::InstructionSetCpp::REGISTER'
 
     cdef enum VMStatusCpp 'vm::VMStatusCpp':
         VM_INIT 'vm::VMStatusCpp::INIT'
@@ -16,28 +33,48 @@ cdef extern from "include/libvm.hpp" namespace "vm":
         VM_EXIT 'vm::VMStatusCpp::EXIT'
         VM_ERROR 'vm::VMStatusCpp::ERROR'
 
+    cdef struct TraceRecordCpp:
+        int64 cycle
+        int64 pc        # 指令在代码段中的下标
+        int64 op
+        int64 operand
+        int64 ax
+        int64 sp        # 栈中已使用的槽数
+
     cdef cppclass VirtualMachineCpp:
         VirtualMachineCpp() except +
-        VirtualMachineCpp(int poolsize) except +
+        VirtualMachineCpp(int poolsize, InstructionSetCpp instruction_set, int stack_size) except +
 
         AddressRegister pc   # PC, 程序计数器
         AddressRegister bp   # BP, 基址指针
         AddressRegister sp   # SP, 堆栈指针
         Register ax          # 通用寄存器
+        Register regs[16]    # 寄存器虚拟机的通用寄存器
         Register cycle
-        int poolsize
+        int poolsize         # 代码段与数据段的字节数
+        int stack_size       # 栈区的字节数
         VMStatusCpp status
+        InstructionSetCpp instruction_set
 
         int64 *text,        # 代码段
         int64 *old_text,    # for dump text segment
         int64 *stack        # 栈区
         char *data          # 数据段
         void reset()
-        void add_op(int64 op)
+        void add_op(int64 op) except +
+        void truncate(int num_ops) except +
+        int num_ops()
+        int64 data_size()
+        void load(const int64 *text, int num_ops, const char *data, int64 data_size,
+                  const int64 *relocations, int num_relocations) except +
+        int64 load_image(const char *path) except +
         int64 put_int_onto_data(int value)
         VMStatusCpp step(bool debug)
         int64 run(bool debug)
         int64 run_all_ops(bool debug)
+        void set_trace(int64 capacity) except +
+        int64 trace_size()
+        const TraceRecordCpp *trace()
         int pc_offset()
         int64 get_op_pointer(int offset)
         void set_pc(int64 pc)
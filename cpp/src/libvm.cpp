@@ -1,11 +1,15 @@
 #include "../include/libvm.hpp"
 
 #include <fcntl.h>
+#include <sys/mman.h>
 #include <sys/stat.h>
 #include <sys/types.h>
 #include <unistd.h>
 
+#include <algorithm>
+#include <functional>
 #include <iostream>
+#include <stdexcept>
 
 namespace vm {
 
@@ -38,65 +42,244 @@ const std::string instruction_name[] = {
     "AND",  "EQ",   "NE",   "LT",   "GT",   "LE",   "GE",   "SHL",
     "SHR",  "ADD",  "SUB",  "MUL",  "DIV",  "MOD",  "OPEN", "READ",
     "CLOS", "PRTF", "MALC", "FREE", "MSET", "MCMP", "EXIT", "PLAC",
+    "LLI",  "LGI",  "ADDI", "SLI",
 };
 
-VirtualMachineCpp::VirtualMachineCpp() {
+const std::string register_instruction_name[] = {
+    "MOV",  "LI",   "LEA",  "LD",   "LDC",  "ST",   "STC",  "LDL",
+    "STL",  "LDG",  "STG",  "OR",   "XOR",  "AND",  "EQ",   "NE",
+    "LT",   "GT",   "LE",   "GE",   "SHL",  "SHR",  "ADD",  "SUB",
+    "MUL",  "DIV",  "MOD",  "ADDI", "JMP",  "JZ",   "JNZ",  "CALL",
+    "ENT",  "ADJ",  "LEV",  "PUSH", "POP",  "SYS",  "EXIT",
+};
+
+// 栈式虚拟机指令的助记符，代码段中出现未知操作码时不越界访问
+static const std::string &stack_op_name(int64 op) {
+  static const std::string unknown = "???";
+  return op >= 0 && op <= SLI ? instruction_name[op] : unknown;
 }
 
-VirtualMachineCpp::VirtualMachineCpp(int poolsize) {
-  this->poolsize = poolsize;
-  if (this->_allocate_memory() == Status::OK) {
-    std::cout << logger::INFO_BADGE << " Init vm success." << std::endl;
+// 打印一条寄存器指令：操作码、三个寄存器字段与可选的操作数
+static void print_register_op(int64 op, const int64 *operand) {
+  std::cout << std::left << std::setw(4)
+            << ((op & 0xff) <= R_EXIT ? register_instruction_name[op & 0xff] : "???")
+            << " " << ((op >> 8) & 0xff) << ", " << ((op >> 16) & 0xff)
+            << ", " << ((op >> 24) & 0xff);
+  if (register_has_operand(op)) {
+    std::cout << " ; " << *operand;
   }
-  this->reset();
 }
 
-VirtualMachineCpp::~VirtualMachineCpp() {
-  std::free(this->text);
-  std::free(this->data);
-  std::free(this->stack);
-  std::cout << logger::INFO_BADGE << " Free vm success." << std::endl;
+#ifndef MAP_NORESERVE
+#define MAP_NORESERVE 0
+#endif
+
+// 以匿名映射预留 size 字节，物理页在首次访问时才提交，映射区初始全为 0
+static void *reserve_segment(size_t size) {
+  void *segment = mmap(nullptr, std::max<size_t>(size, 1), PROT_READ | PROT_WRITE,
+                       MAP_PRIVATE | MAP_ANONYMOUS | MAP_NORESERVE, -1, 0);
+  if (segment == MAP_FAILED) {
+    throw std::bad_alloc();
+  }
+  return segment;
+}
+
+static void release_segment(void *segment, size_t size) {
+  if (segment != nullptr) {
+    munmap(segment, std::max<size_t>(size, 1));
+  }
 }
 
-Status VirtualMachineCpp::_allocate_memory() {
-  if (!(this->text = old_text = (int64 *)std::malloc(poolsize))) {
-    std::cerr << logger::ERROR_BADGE << " Could not malloc for text area"
-              << std::endl;
-    return Status::MEMORY_ERROR;
+// 交还映射区中已提交的物理页，之后再访问时得到全 0 的页，开销只与访问过的页数有关
+static void discard_segment(void *segment, size_t size) {
+#ifdef __linux__
+  if (madvise(segment, size, MADV_DONTNEED) == 0) {
+    return;
   }
-  if (!(this->data = (char *)std::malloc(poolsize))) {
-    std::cerr << logger::ERROR_BADGE << " Could not malloc for data area"
-              << std::endl;
-    return Status::MEMORY_ERROR;
+#endif
+  // 其他系统上 MADV_DONTNEED 不保证清零，在原地址重新映射
+  if (mmap(segment, size, PROT_READ | PROT_WRITE,
+           MAP_PRIVATE | MAP_ANONYMOUS | MAP_FIXED | MAP_NORESERVE, -1,
+           0) == MAP_FAILED) {
+    std::memset(segment, 0, size);
   }
-  if (!(this->stack = (int64 *)std::malloc(poolsize))) {
-    std::cerr << logger::ERROR_BADGE << " Could not malloc for stack area"
-              << std::endl;
-    return Status::MEMORY_ERROR;
+}
+
+VirtualMachineCpp::VirtualMachineCpp()
+    : text(nullptr), old_text(nullptr), stack(nullptr), data(nullptr) {
+}
+
+VirtualMachineCpp::VirtualMachineCpp(int poolsize,
+                                     InstructionSetCpp instruction_set,
+                                     int stack_size)
+    : text(nullptr), old_text(nullptr), stack(nullptr), data(nullptr) {
+  if (poolsize < 0 || stack_size < (int)sizeof(int64)) {
+    throw std::invalid_argument("invalid segment size");
   }
-  return Status::OK;
+  this->poolsize = poolsize;
+  this->stack_size = stack_size;
+  this->instruction_set = instruction_set;
+  this->_allocate_memory();
+  // 新映射的各段全为 0，无需清零
+  this->op_counter_ = 0;
+  this->current_data = this->data;
+  this->reset_registers();
 }
 
+VirtualMachineCpp::~VirtualMachineCpp() {
+  release_segment(this->text, this->poolsize);
+  release_segment(this->data, this->poolsize);
+  release_segment(this->stack, this->stack_size);
+}
+
+void VirtualMachineCpp::_allocate_memory() {
+  try {
+    this->text = old_text = (int64 *)reserve_segment(poolsize);
+    this->data = (char *)reserve_segment(poolsize);
+    this->stack = (int64 *)reserve_segment(stack_size);
+  } catch (...) {
+    release_segment(this->text, this->poolsize);
+    release_segment(this->data, this->poolsize);
+    this->text = this->old_text = nullptr;
+    this->data = nullptr;
+    throw;
+  }
+}
+
+AddressRegister VirtualMachineCpp::stack_top() {
+  return this->stack + this->stack_size / sizeof(int64);
+}
+
+// 只清零用过的部分：代码段在 truncate 时已清零下标 num_ops() 之后的部分，
+// 数据段只在 data_size() 之内写入，栈区交还物理页
 void VirtualMachineCpp::reset() {
-  std::memset(this->text, 0, this->poolsize);
-  std::memset(this->data, 0, this->poolsize);
-  std::memset(this->stack, 0, this->poolsize);
+  std::memset(this->text, 0, this->op_counter_ * sizeof(int64));
+  std::memset(this->data, 0, this->data_size());
+  if (this->status != VMStatusCpp::INIT || this->sp != this->stack_top()) {
+    discard_segment(this->stack, this->stack_size);
+  }
 
   this->op_counter_ = 0;
-  this->status = VMStatusCpp::INIT;
-  this->bp = this->sp =
-      this->stack + poolsize / sizeof(int64);  // BP、SP 初始化为栈底
-  this->ax = 0;                                // 清空通用寄存器 AX
-  this->pc = text;                             // PC 指向代码段起始地址
   this->current_data = data;
+  this->reset_registers();
+}
+
+void VirtualMachineCpp::reset_registers() {
+  this->status = VMStatusCpp::INIT;
+  this->bp = this->sp = this->stack_top();  // BP、SP 初始化为栈底
+  this->ax = 0;                             // 清空通用寄存器 AX
+  std::memset(this->regs, 0, sizeof(this->regs));
+  this->pc = text;  // PC 指向代码段起始地址
   this->cycle = 0;  // 记录一共经历了多少指令周期
+  this->result_ = 0;
+  this->trace_count_ = 0;
 }
 
 void VirtualMachineCpp::add_op(int64 op) {
+  if (this->op_counter_ >= this->poolsize / (int)sizeof(int64)) {
+    throw std::overflow_error("text segment overflow");
+  }
   this->text[this->op_counter_++] = op;
-  if (this->op_counter_ > this->poolsize) {
-    std::cerr << "[ERROR] op counter overflow" << std::endl;
+}
+
+// 丢弃下标 num_ops 之后已写入的指令，用于编译期替换刚生成的代码
+void VirtualMachineCpp::truncate(int num_ops) {
+  if (num_ops < 0 || num_ops > this->op_counter_) {
+    throw std::invalid_argument("truncate beyond the end of the text segment");
   }
+  std::memset(this->text + num_ops, 0,
+              (this->op_counter_ - num_ops) * sizeof(int64));
+  this->op_counter_ = num_ops;
+}
+
+int VirtualMachineCpp::num_ops() {
+  return this->op_counter_;
+}
+
+int64 VirtualMachineCpp::data_size() {
+  return this->current_data - this->data;
+}
+
+// 载入段内地址均为相对偏移的代码段与数据段，并一次性完成重定位
+// 每个重定位项为 (代码段下标 << 1) | 重定位类型
+void VirtualMachineCpp::load(const int64 *text, int num_ops, const char *data,
+                             int64 data_size, const int64 *relocations,
+                             int num_relocations) {
+  if (num_ops > this->poolsize / (int)sizeof(int64)) {
+    throw std::overflow_error("text segment overflow");
+  }
+  if (data_size > this->poolsize) {
+    throw std::overflow_error("data segment overflow");
+  }
+  this->reset();
+  std::memcpy(this->text, text, num_ops * sizeof(int64));
+  std::memcpy(this->data, data, data_size);
+  this->op_counter_ = num_ops;
+  this->current_data = this->data + data_size;
+
+  const int64 bases[] = {(int64)this->text, (int64)this->data};
+  for (int i = 0; i < num_relocations; i++) {
+    int64 index = relocations[i] >> 1;
+    if (index < 0 || index >= num_ops) {
+      throw std::out_of_range("relocation out of text segment");
+    }
+    this->text[index] += bases[relocations[i] & 1];
+  }
+}
+
+// 映射 .pyco 文件，直接从映射区拷贝各段并完成重定位，返回 main 函数的偏移
+int64 VirtualMachineCpp::load_image(const char *path) {
+  int fd = ::open(path, O_RDONLY);
+  if (fd < 0) {
+    throw std::ios_base::failure(std::string("could not open ") + path);
+  }
+  struct stat st;
+  if (fstat(fd, &st) < 0) {
+    ::close(fd);
+    throw std::ios_base::failure(std::string("could not stat ") + path);
+  }
+  uint64 size = st.st_size;
+  if (size < sizeof(ImageHeader)) {
+    ::close(fd);
+    throw std::invalid_argument("truncated image");
+  }
+  void *map = mmap(nullptr, size, PROT_READ, MAP_PRIVATE, fd, 0);
+  ::close(fd);
+  if (map == MAP_FAILED) {
+    throw std::ios_base::failure(std::string("could not mmap ") + path);
+  }
+  // 离开作用域时解除映射，包括抛出异常的情况
+  std::unique_ptr<void, std::function<void(void *)>> guard(
+      map, [size](void *p) { munmap(p, size); });
+
+  const char *base = (const char *)map;
+  const ImageHeader *header = (const ImageHeader *)base;
+  auto in_file = [size](uint64 offset, uint64 length) {
+    return offset % sizeof(int64) == 0 && offset <= size &&
+           length <= size - offset;
+  };
+  if (std::memcmp(header->magic, IMAGE_MAGIC, sizeof(IMAGE_MAGIC)) != 0 ||
+      header->version != IMAGE_VERSION) {
+    throw std::invalid_argument("not a pycc image or unsupported version");
+  }
+  if (header->num_externals != 0) {
+    throw std::invalid_argument("image has unresolved external symbols");
+  }
+  if (header->text_size % sizeof(int64) != 0 ||
+      header->num_relocations > size / sizeof(int64) ||
+      !in_file(header->text_offset, header->text_size) ||
+      !in_file(header->data_offset, header->data_size) ||
+      !in_file(header->relocations_offset,
+               header->num_relocations * sizeof(int64)) ||
+      !in_file(header->symbols_offset, header->symbols_size)) {
+    throw std::invalid_argument("truncated image");
+  }
+  this->load((const int64 *)(base + header->text_offset),
+             header->text_size / sizeof(int64), base + header->data_offset,
+             header->data_size,
+             (const int64 *)(base + header->relocations_offset),
+             header->num_relocations);
+  return header->entry;
 }
 
 int64 VirtualMachineCpp::put_int_onto_data(int value) {
@@ -110,19 +293,25 @@ VMStatusCpp VirtualMachineCpp::step(bool debug = false) {
   Register op;
   AddressRegister tmp;
 
+  if (this->instruction_set == InstructionSetCpp::REGISTER) {
+    return this->step_register(debug);
+  }
   if (this->status == VMStatusCpp::INIT) {
     this->status = VMStatusCpp::RUNNING;
   }
   this->cycle++;
   op = *(pc++);  // 获取当前指令
 
+  if (!this->trace_.empty()) {
+    this->record_trace(op, has_operand(op), ax);
+  }
   if (debug) {
     std::cout << logger::DEBUG_BADGE << " " << cycle << "> " << std::left
-              << std::setw(4) << instruction_name[op];
-    if (op <= ADJ) {  // 含操作数指令，额外打印操作数
+              << std::setw(4) << stack_op_name(op);
+    if (has_operand(op)) {  // 含操作数指令，额外打印操作数
       std::cout << " " << *pc;
     }
-    std::cout << std::endl;
+    std::cout << '\n';
   }
 
   // clang-format off
@@ -153,6 +342,11 @@ VMStatusCpp VirtualMachineCpp::step(bool debug = false) {
     case SC: ax = *(char *)*sp++ = ax; break;         // 存储一个 char
     case PUSH: *--sp = ax; break;                     // AX 压栈
 
+    case LLI: ax = *(int *)(bp + *pc++); break;       // 加载局部变量或参数
+    case LGI: ax = *(int *)*pc++; break;              // 加载全局变量
+    case ADDI: ax += *pc++; break;                    // 加上立即数
+    case SLI: *(int *)(bp + *pc++) = ax; break;       // 存储局部变量或参数
+
     case OR:  ax = *sp++ |  ax; break;
     case XOR: ax = *sp++ ^  ax; break;
     case AND: ax = *sp++ &  ax; break;
@@ -195,19 +389,375 @@ VMStatusCpp VirtualMachineCpp::step(bool debug = false) {
   // clang-format on
 }
 
+VMStatusCpp VirtualMachineCpp::step_register(bool debug) {
+  Register op, a, b, c;
+  AddressRegister tmp;
+  Register *r = this->regs;
+
+  if (this->status == VMStatusCpp::INIT) {
+    this->status = VMStatusCpp::RUNNING;
+  }
+  this->cycle++;
+  op = *(pc++);
+  if (!this->trace_.empty()) {
+    this->record_trace(op, register_has_operand(op), r[0]);
+  }
+  if (debug) {
+    std::cout << logger::DEBUG_BADGE << " " << cycle << "> ";
+    print_register_op(op, pc);
+    std::cout << '\n';
+  }
+  a = (op >> 8) & 0xff;
+  b = (op >> 16) & 0xff;
+  c = (op >> 24) & 0xff;
+
+  // clang-format off
+  switch (op & 0xff) {
+    case R_MOV: r[a] = r[b]; break;
+    case R_LI:  r[a] = *pc++; break;                          // 立即数或地址
+    case R_LEA: r[a] = (int64)(bp + *pc++); break;            // 局部变量或参数的地址
+    case R_LD:  r[a] = *(int *)r[b]; break;
+    case R_LDC: r[a] = *(char *)r[b]; break;
+    case R_ST:  *(int *)r[a] = r[b]; break;
+    case R_STC: r[b] = *(char *)r[a] = r[b]; break;
+    case R_LDL: r[a] = *(int *)(bp + *pc++); break;           // 读取局部变量或参数
+    case R_STL: *(int *)(bp + *pc++) = r[a]; break;           // 写入局部变量或参数
+    case R_LDG: r[a] = *(int *)*pc++; break;                  // 读取全局变量
+    case R_STG: *(int *)*pc++ = r[a]; break;                  // 写入全局变量
+
+    case R_OR:  r[a] = r[b] |  r[c]; break;
+    case R_XOR: r[a] = r[b] ^  r[c]; break;
+    case R_AND: r[a] = r[b] &  r[c]; break;
+    case R_EQ:  r[a] = r[b] == r[c]; break;
+    case R_NE:  r[a] = r[b] != r[c]; break;
+    case R_LT:  r[a] = r[b] <  r[c]; break;
+    case R_GT:  r[a] = r[b] >  r[c]; break;
+    case R_LE:  r[a] = r[b] <= r[c]; break;
+    case R_GE:  r[a] = r[b] >= r[c]; break;
+    case R_SHL: r[a] = r[b] << r[c]; break;
+    case R_SHR: r[a] = r[b] >> r[c]; break;
+    case R_ADD: r[a] = r[b] +  r[c]; break;
+    case R_SUB: r[a] = r[b] -  r[c]; break;
+    case R_MUL: r[a] = r[b] *  r[c]; break;
+    case R_DIV: r[a] = r[b] /  r[c]; break;
+    case R_MOD: r[a] = r[b] %  r[c]; break;
+    case R_ADDI: r[a] = r[b] + *pc++; break;
+
+    case R_JMP: pc = (int64 *)*pc; break;
+    case R_JZ:  pc = r[a] ? pc + 1 : (int64 *)*pc; break;
+    case R_JNZ: pc = r[a] ? (int64 *)*pc : pc + 1; break;
+    case R_CALL:                  // 参数已压栈，返回值在 r0 中
+      *--sp = (int64)(pc + 1);
+      pc = (int64 *)*pc;
+      break;
+    case R_ENT:
+      *--sp = (int64)bp;
+      bp = sp;
+      sp -= *pc++;
+      break;
+    case R_ADJ: sp += *pc++; break;
+    case R_LEV:
+      sp = bp;
+      bp = (int64 *)*sp++;
+      pc = (int64 *)*sp++;
+      break;
+    case R_PUSH: *--sp = r[a]; break;
+    case R_POP:  r[a] = *sp++; break;
+    case R_SYS:                   // a 为系统调用号，b 为参数个数，参数已压栈
+      switch (a) {
+        case OPEN: r[0] = open((char *)sp[1], sp[0]); break;
+        case READ: r[0] = read(sp[2], (char *)sp[1], sp[0]); break;
+        case CLOS: r[0] = close(sp[0]); break;
+        case PRTF:
+          tmp = sp + b;
+          r[0] = printf((char *)tmp[-1], tmp[-2], tmp[-3], tmp[-4], tmp[-5], tmp[-6]);
+          break;
+        case MALC: r[0] = (int64)malloc(sp[0]); break;
+        case FREE: free((void *)sp[0]); break;
+        case MSET: r[0] = (int64)memset((char *)sp[2], sp[1], sp[0]); break;
+        case MCMP: r[0] = (int64)memcmp((char *)sp[2], (char *)sp[1], sp[0]); break;
+        default:
+          std::cerr << "[ERROR] Unknown system call: " << a << std::endl;
+          this->status = VMStatusCpp::ERROR;
+      }
+      break;
+    case R_EXIT:
+      std::cout << "exit(" << r[0] << ") cycle = " << this->cycle << std::endl;
+      this->status = VMStatusCpp::EXIT;
+      this->result_ = r[0];
+      break;
+    default:
+      std::cerr << "[ERROR] Unknown opcode: " << op << std::endl;
+      this->status = VMStatusCpp::ERROR;
+  }
+  // clang-format on
+
+  return this->status;
+}
+
+// 不输出调试信息时的解释循环：PC、SP、BP、AX 与周期计数保存在局部变量中，退出或出错时再写回。
+// GCC/Clang 下以标签地址表在每条指令末尾直接跳转到下一条指令（direct threading），
+// 其他编译器退化为循环中的 switch
+#if defined(__GNUC__)
+#define VM_THREADED 1
+#endif
+
+#ifdef VM_THREADED
+#define VM_CASE(name) L_##name:
+#define VM_DEFAULT L_UNKNOWN:
+#define VM_NEXT(table, index, limit)                        \
+  do {                                                      \
+    FETCH();                                                \
+    if (__builtin_expect((uint64)(index) > (limit), 0)) {   \
+      goto L_UNKNOWN;                                       \
+    }                                                       \
+    goto *table[index];                                     \
+  } while (0)
+#else
+#define VM_CASE(name) case name:
+#define VM_DEFAULT default:
+#define VM_NEXT(table, index, limit) continue
+#endif
+
+int64 VirtualMachineCpp::execute() {
+  AddressRegister pc = this->pc, bp = this->bp, sp = this->sp, tmp;
+  Register ax = this->ax, cycle = this->cycle, op;
+
+  this->status = VMStatusCpp::RUNNING;
+#define FETCH() (cycle++, op = *pc++)
+#define NEXT() VM_NEXT(labels, op, SLI)
+#ifdef VM_THREADED
+  // clang-format off
+  static const void *labels[] = {
+    &&L_LEA,  &&L_IMM,  &&L_JMP,  &&L_CALL, &&L_JZ,   &&L_JNZ,  &&L_ENT,  &&L_ADJ,
+    &&L_LEV,  &&L_LI,   &&L_LC,   &&L_SI,   &&L_SC,   &&L_PUSH, &&L_OR,   &&L_XOR,
+    &&L_AND,  &&L_EQ,   &&L_NE,   &&L_LT,   &&L_GT,   &&L_LE,   &&L_GE,   &&L_SHL,
+    &&L_SHR,  &&L_ADD,  &&L_SUB,  &&L_MUL,  &&L_DIV,  &&L_MOD,  &&L_OPEN, &&L_READ,
+    &&L_CLOS, &&L_PRTF, &&L_MALC, &&L_FREE, &&L_MSET, &&L_MCMP, &&L_EXIT, &&L_UNKNOWN,
+    &&L_LLI,  &&L_LGI,  &&L_ADDI, &&L_SLI,
+  };
+  // clang-format on
+  static_assert(sizeof(labels) / sizeof(*labels) == SLI + 1,
+                "dispatch table does not match the instruction set");
+  NEXT();
+#else
+  while (true) {
+    FETCH();
+    switch (op) {
+#endif
+
+  // clang-format off
+  VM_CASE(LEA) ax = (int64)(bp + *pc++); NEXT();
+  VM_CASE(IMM) ax = *pc++; NEXT();
+  VM_CASE(JMP) pc = (int64 *)*pc; NEXT();
+  VM_CASE(CALL) *--sp = (int64)(pc + 1); pc = (int64 *)*pc; NEXT();
+  VM_CASE(JZ)  pc = ax ? pc + 1 : (int64 *)*pc; NEXT();
+  VM_CASE(JNZ) pc = ax ? (int64 *)*pc : pc + 1; NEXT();
+  VM_CASE(ENT) *--sp = (int64)bp; bp = sp; sp -= *pc++; NEXT();
+  VM_CASE(ADJ) sp += *pc++; NEXT();
+  VM_CASE(LEV) sp = bp; bp = (int64 *)*sp++; pc = (int64 *)*sp++; NEXT();
+  VM_CASE(LI)  ax = *(int *)ax; NEXT();
+  VM_CASE(LC)  ax = *(char *)ax; NEXT();
+  VM_CASE(SI)  *(int *)*sp++ = ax; NEXT();
+  VM_CASE(SC)  ax = *(char *)*sp++ = ax; NEXT();
+  VM_CASE(PUSH) *--sp = ax; NEXT();
+
+  VM_CASE(LLI)  ax = *(int *)(bp + *pc++); NEXT();
+  VM_CASE(LGI)  ax = *(int *)*pc++; NEXT();
+  VM_CASE(ADDI) ax += *pc++; NEXT();
+  VM_CASE(SLI)  *(int *)(bp + *pc++) = ax; NEXT();
+
+  VM_CASE(OR)  ax = *sp++ |  ax; NEXT();
+  VM_CASE(XOR) ax = *sp++ ^  ax; NEXT();
+  VM_CASE(AND) ax = *sp++ &  ax; NEXT();
+  VM_CASE(EQ)  ax = *sp++ == ax; NEXT();
+  VM_CASE(NE)  ax = *sp++ != ax; NEXT();
+  VM_CASE(LT)  ax = *sp++ <  ax; NEXT();
+  VM_CASE(GT)  ax = *sp++ >  ax; NEXT();
+  VM_CASE(LE)  ax = *sp++ <= ax; NEXT();
+  VM_CASE(GE)  ax = *sp++ >= ax; NEXT();
+  VM_CASE(SHL) ax = *sp++ << ax; NEXT();
+  VM_CASE(SHR) ax = *sp++ >> ax; NEXT();
+  VM_CASE(ADD) ax = *sp++ +  ax; NEXT();
+  VM_CASE(SUB) ax = *sp++ -  ax; NEXT();
+  VM_CASE(MUL) ax = *sp++ *  ax; NEXT();
+  VM_CASE(DIV) ax = *sp++ /  ax; NEXT();
+  VM_CASE(MOD) ax = *sp++ %  ax; NEXT();
+
+  VM_CASE(OPEN) ax = open((char *)sp[1], sp[0]); NEXT();
+  VM_CASE(READ) ax = read(sp[2], (char *)sp[1], sp[0]); NEXT();
+  VM_CASE(CLOS) ax = close(sp[0]); NEXT();
+  VM_CASE(PRTF)
+    tmp = sp + pc[1];
+    ax = printf((char *)tmp[-1], tmp[-2], tmp[-3], tmp[-4], tmp[-5], tmp[-6]);
+    NEXT();
+  VM_CASE(MALC) ax = (int64)malloc(sp[0]); NEXT();
+  VM_CASE(FREE) free((void *)sp[0]); NEXT();
+  VM_CASE(MSET) ax = (int64)memset((char *)sp[2], sp[1], sp[0]); NEXT();
+  VM_CASE(MCMP) ax = (int64)memcmp((char *)sp[2], (char *)sp[1], sp[0]); NEXT();
+  VM_CASE(EXIT)
+    std::cout << "exit(" << *sp << ") cycle = " << cycle << std::endl;
+    this->status = VMStatusCpp::EXIT;
+    this->result_ = *sp;
+    goto done;
+  VM_DEFAULT
+    std::cerr << "[ERROR] Unknown opcode: " << op << std::endl;
+    this->status = VMStatusCpp::ERROR;
+    goto done;
+  // clang-format on
+
+#ifndef VM_THREADED
+    }
+  }
+#endif
+#undef NEXT
+#undef FETCH
+
+done:
+  this->pc = pc;
+  this->bp = bp;
+  this->sp = sp;
+  this->ax = ax;
+  this->cycle = cycle;
+  return this->result_;
+}
+
+// 寄存器虚拟机的非调试解释循环，通用寄存器也拷贝到局部数组中，取指时一并解出寄存器字段
+int64 VirtualMachineCpp::execute_register() {
+  AddressRegister pc = this->pc, bp = this->bp, sp = this->sp, tmp;
+  Register cycle = this->cycle, op, a, b, c;
+  Register r[NUM_REGISTERS];
+
+  std::memcpy(r, this->regs, sizeof(r));
+  this->status = VMStatusCpp::RUNNING;
+#define FETCH() \
+  (cycle++, op = *pc++, a = (op >> 8) & 0xff, b = (op >> 16) & 0xff, c = (op >> 24) & 0xff)
+#define NEXT() VM_NEXT(labels, op & 0xff, R_EXIT)
+#ifdef VM_THREADED
+  // clang-format off
+  static const void *labels[] = {
+    &&L_R_MOV,  &&L_R_LI,   &&L_R_LEA,  &&L_R_LD,   &&L_R_LDC,  &&L_R_ST,   &&L_R_STC,  &&L_R_LDL,
+    &&L_R_STL,  &&L_R_LDG,  &&L_R_STG,  &&L_R_OR,   &&L_R_XOR,  &&L_R_AND,  &&L_R_EQ,   &&L_R_NE,
+    &&L_R_LT,   &&L_R_GT,   &&L_R_LE,   &&L_R_GE,   &&L_R_SHL,  &&L_R_SHR,  &&L_R_ADD,  &&L_R_SUB,
+    &&L_R_MUL,  &&L_R_DIV,  &&L_R_MOD,  &&L_R_ADDI, &&L_R_JMP,  &&L_R_JZ,   &&L_R_JNZ,  &&L_R_CALL,
+    &&L_R_ENT,  &&L_R_ADJ,  &&L_R_LEV,  &&L_R_PUSH, &&L_R_POP,  &&L_R_SYS,  &&L_R_EXIT,
+  };
+  // clang-format on
+  static_assert(sizeof(labels) / sizeof(*labels) == R_EXIT + 1,
+                "dispatch table does not match the instruction set");
+  NEXT();
+#else
+  while (true) {
+    FETCH();
+    switch (op & 0xff) {
+#endif
+
+  // clang-format off
+  VM_CASE(R_MOV) r[a] = r[b]; NEXT();
+  VM_CASE(R_LI)  r[a] = *pc++; NEXT();
+  VM_CASE(R_LEA) r[a] = (int64)(bp + *pc++); NEXT();
+  VM_CASE(R_LD)  r[a] = *(int *)r[b]; NEXT();
+  VM_CASE(R_LDC) r[a] = *(char *)r[b]; NEXT();
+  VM_CASE(R_ST)  *(int *)r[a] = r[b]; NEXT();
+  VM_CASE(R_STC) r[b] = *(char *)r[a] = r[b]; NEXT();
+  VM_CASE(R_LDL) r[a] = *(int *)(bp + *pc++); NEXT();
+  VM_CASE(R_STL) *(int *)(bp + *pc++) = r[a]; NEXT();
+  VM_CASE(R_LDG) r[a] = *(int *)*pc++; NEXT();
+  VM_CASE(R_STG) *(int *)*pc++ = r[a]; NEXT();
+
+  VM_CASE(R_OR)  r[a] = r[b] |  r[c]; NEXT();
+  VM_CASE(R_XOR) r[a] = r[b] ^  r[c]; NEXT();
+  VM_CASE(R_AND) r[a] = r[b] &  r[c]; NEXT();
+  VM_CASE(R_EQ)  r[a] = r[b] == r[c]; NEXT();
+  VM_CASE(R_NE)  r[a] = r[b] != r[c]; NEXT();
+  VM_CASE(R_LT)  r[a] = r[b] <  r[c]; NEXT();
+  VM_CASE(R_GT)  r[a] = r[b] >  r[c]; NEXT();
+  VM_CASE(R_LE)  r[a] = r[b] <= r[c]; NEXT();
+  VM_CASE(R_GE)  r[a] = r[b] >= r[c]; NEXT();
+  VM_CASE(R_SHL) r[a] = r[b] << r[c]; NEXT();
+  VM_CASE(R_SHR) r[a] = r[b] >> r[c]; NEXT();
+  VM_CASE(R_ADD) r[a] = r[b] +  r[c]; NEXT();
+  VM_CASE(R_SUB) r[a] = r[b] -  r[c]; NEXT();
+  VM_CASE(R_MUL) r[a] = r[b] *  r[c]; NEXT();
+  VM_CASE(R_DIV) r[a] = r[b] /  r[c]; NEXT();
+  VM_CASE(R_MOD) r[a] = r[b] %  r[c]; NEXT();
+  VM_CASE(R_ADDI) r[a] = r[b] + *pc++; NEXT();
+
+  VM_CASE(R_JMP) pc = (int64 *)*pc; NEXT();
+  VM_CASE(R_JZ)  pc = r[a] ? pc + 1 : (int64 *)*pc; NEXT();
+  VM_CASE(R_JNZ) pc = r[a] ? (int64 *)*pc : pc + 1; NEXT();
+  VM_CASE(R_CALL) *--sp = (int64)(pc + 1); pc = (int64 *)*pc; NEXT();
+  VM_CASE(R_ENT) *--sp = (int64)bp; bp = sp; sp -= *pc++; NEXT();
+  VM_CASE(R_ADJ) sp += *pc++; NEXT();
+  VM_CASE(R_LEV) sp = bp; bp = (int64 *)*sp++; pc = (int64 *)*sp++; NEXT();
+  VM_CASE(R_PUSH) *--sp = r[a]; NEXT();
+  VM_CASE(R_POP)  r[a] = *sp++; NEXT();
+  VM_CASE(R_SYS)
+    switch (a) {
+      case OPEN: r[0] = open((char *)sp[1], sp[0]); break;
+      case READ: r[0] = read(sp[2], (char *)sp[1], sp[0]); break;
+      case CLOS: r[0] = close(sp[0]); break;
+      case PRTF:
+        tmp = sp + b;
+        r[0] = printf((char *)tmp[-1], tmp[-2], tmp[-3], tmp[-4], tmp[-5], tmp[-6]);
+        break;
+      case MALC: r[0] = (int64)malloc(sp[0]); break;
+      case FREE: free((void *)sp[0]); break;
+      case MSET: r[0] = (int64)memset((char *)sp[2], sp[1], sp[0]); break;
+      case MCMP: r[0] = (int64)memcmp((char *)sp[2], (char *)sp[1], sp[0]); break;
+      default:
+        std::cerr << "[ERROR] Unknown system call: " << a << std::endl;
+        this->status = VMStatusCpp::ERROR;
+        goto done;
+    }
+    NEXT();
+  VM_CASE(R_EXIT)
+    std::cout << "exit(" << r[0] << ") cycle = " << cycle << std::endl;
+    this->status = VMStatusCpp::EXIT;
+    this->result_ = r[0];
+    goto done;
+  VM_DEFAULT
+    std::cerr << "[ERROR] Unknown opcode: " << op << std::endl;
+    this->status = VMStatusCpp::ERROR;
+    goto done;
+  // clang-format on
+
+#ifndef VM_THREADED
+    }
+  }
+#endif
+#undef NEXT
+#undef FETCH
+
+done:
+  this->pc = pc;
+  this->bp = bp;
+  this->sp = sp;
+  std::memcpy(this->regs, r, sizeof(r));
+  this->cycle = cycle;
+  return this->result_;
+}
+
 int64 VirtualMachineCpp::run(bool debug = false) {
+  bool registers = this->instruction_set == InstructionSetCpp::REGISTER;
+  if (!debug && this->trace_.empty()) {
+    return registers ? this->execute_register() : this->execute();
+  }
+  // 逐条单步执行，打印或记录每条指令
   while (true) {
-    VMStatusCpp status = this->step(debug);
-    if (status == VMStatusCpp::EXIT) {
+    VMStatusCpp status = registers ? this->step_register(debug) : this->step(debug);
+    if (status == VMStatusCpp::EXIT || status == VMStatusCpp::ERROR) {
       return this->result_;
     }
   }
-  return 0;
 }
 
 int64 VirtualMachineCpp::run_all_ops(bool debug = false) {
   while (true) {
-    int oplen = *(this->pc) <= ADJ ? 2 : 1;
+    bool operand = this->instruction_set == InstructionSetCpp::REGISTER
+                       ? register_has_operand(*this->pc)
+                       : has_operand(*this->pc);
+    int oplen = operand ? 2 : 1;
     if (this->pc_offset() + oplen <= this->op_counter_) {
       VMStatusCpp status = this->step(debug);
       if (status == VMStatusCpp::EXIT) {
@@ -220,6 +770,44 @@ int64 VirtualMachineCpp::run_all_ops(bool debug = false) {
   return this->result_;
 }
 
+// 在取指之后调用，pc 指向操作数或下一条指令
+void VirtualMachineCpp::record_trace(int64 op, bool operand, Register ax) {
+  TraceRecordCpp &record = this->trace_[this->trace_count_++ % this->trace_.size()];
+  record.cycle = this->cycle;
+  record.pc = this->pc - 1 - this->text;
+  record.op = op;
+  record.operand = operand ? *this->pc : 0;
+  record.ax = ax;
+  record.sp = this->stack_top() - this->sp;
+}
+
+// 以容量为 capacity 条记录的环形缓冲区记录此后每条指令的执行轨迹，capacity 为 0 时关闭。
+// 记录轨迹时 run(false) 也逐条单步执行
+void VirtualMachineCpp::set_trace(int64 capacity) {
+  if (capacity < 0) {
+    throw std::invalid_argument("negative trace capacity");
+  }
+  this->trace_.assign(capacity, TraceRecordCpp{});
+  this->trace_.shrink_to_fit();
+  this->trace_count_ = 0;
+}
+
+int64 VirtualMachineCpp::trace_size() {
+  return std::min<int64>(this->trace_count_, this->trace_.size());
+}
+
+// 按执行顺序排列缓冲区中的记录，返回最早一条记录的地址，共 trace_size() 条
+const TraceRecordCpp *VirtualMachineCpp::trace() {
+  int64 capacity = this->trace_.size();
+  if (this->trace_count_ > capacity) {
+    std::rotate(this->trace_.begin(),
+                this->trace_.begin() + this->trace_count_ % capacity,
+                this->trace_.end());
+    this->trace_count_ = capacity;  // 之后从最早的记录开始继续覆盖
+  }
+  return this->trace_.data();
+}
+
 int VirtualMachineCpp::pc_offset() {
   return pc - text;
 }
@@ -237,9 +825,17 @@ void VirtualMachineCpp::show_ops() {
   int cycle = 0;
   while (op_pointer < (text + this->op_counter_)) {
     op = *op_pointer;
+    if (this->instruction_set == InstructionSetCpp::REGISTER) {
+      std::cout << logger::INFO_BADGE << " " << cycle << "> ";
+      print_register_op(op, op_pointer + 1);
+      std::cout << std::endl;
+      op_pointer += register_has_operand(op) ? 2 : 1;
+      cycle++;
+      continue;
+    }
     std::cout << logger::INFO_BADGE << " " << cycle << "> " << std::left
-              << std::setw(4) << instruction_name[op];
-    if (op <= ADJ) {  // 含操作数指令，额外打印操作数
+              << std::setw(4) << stack_op_name(op);
+    if (has_operand(op)) {  // 含操作数指令，额外打印操作数
       std::cout << " " << *++op_pointer;
     }
     std::cout << std::endl;
@@ -251,8 +847,13 @@ void VirtualMachineCpp::show_ops() {
 void VirtualMachineCpp::setup_main(int64 main_ptr, int argc, char **argv) {
   AddressRegister tmp;
   pc = (int64 *)main_ptr;
-  *--sp = EXIT;
-  *--sp = PUSH;
+  // main 返回到栈上的这段代码，以返回值退出
+  if (this->instruction_set == InstructionSetCpp::REGISTER) {
+    *--sp = R_EXIT;
+  } else {
+    *--sp = EXIT;
+    *--sp = PUSH;
+  }
   tmp = sp;
   *--sp = argc;
   *--sp = (int64)argv;
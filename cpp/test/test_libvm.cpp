@@ -279,6 +279,49 @@ void test_sum_function(int m, int n) {
             << std::endl;
 }
 
+void test_run_without_debug(int m, int n) {
+  // 不打印调试信息的解释循环与逐条单步执行的结果、周期数与栈指针一致
+  vm::int64 results[2], cycles[2], depths[2];
+  for (int debug = 0; debug < 2; debug++) {
+    vm::VirtualMachineCpp vmcpp = vm::VirtualMachineCpp(poolsize);
+    vm::int64 ptr_main = (vm::int64)(vmcpp.get_op_pointer(0));
+    vmcpp.add_op(vm::ENT);
+    vmcpp.add_op(1);
+    vmcpp.add_op(vm::IMM);
+    vmcpp.add_op(m);
+    vmcpp.add_op(vm::SLI);
+    vmcpp.add_op(-1);
+    vmcpp.add_op(vm::LLI);
+    vmcpp.add_op(-1);
+    vmcpp.add_op(vm::ADDI);
+    vmcpp.add_op(n);
+    vmcpp.add_op(vm::LEV);
+
+    vmcpp.setup_main(ptr_main);
+    results[debug] = vmcpp.run(debug);
+    cycles[debug] = vmcpp.cycle;
+    depths[debug] = vmcpp.stack_top() - vmcpp.sp;
+    assert(vmcpp.status == vm::VMStatusCpp::EXIT);
+  }
+  assert(results[0] == m + n && results[1] == m + n);
+  assert(cycles[0] == cycles[1] && depths[0] == depths[1]);
+  std::cout << logger::SCUESS_BADGE << " test run without debug success!"
+            << std::endl;
+}
+
+void test_unknown_opcode() {
+  vm::VirtualMachineCpp vmcpp = vm::VirtualMachineCpp(poolsize);
+
+  vmcpp.add_op(vm::IMM);
+  vmcpp.add_op(1);
+  vmcpp.add_op(1000);
+  vmcpp.run(false);
+  assert(vmcpp.status == vm::VMStatusCpp::ERROR);
+  assert(vmcpp.cycle == 2 && vmcpp.ax == 1);
+  std::cout << logger::SCUESS_BADGE << " test unknown opcode success!"
+            << std::endl;
+}
+
 int main() {
   test_add(10, 20);
   test_add(9, -10);
@@ -302,5 +345,7 @@ int main() {
 
   test_main_function(998877);
   test_sum_function(100, 500);
+  test_run_without_debug(7, 35);
+  test_unknown_opcode();
   return 0;
 }
@@ -6,10 +6,18 @@ cimport libvm
 from libvm cimport VirtualMachineCpp
 from libvm cimport int64
 from libvm cimport VMStatusCpp
+from libvm cimport RelocationCpp
+from libvm cimport InstructionSetCpp
+from libvm cimport TraceRecordCpp
 from libvm cimport _send_integer_to_pointer
 
+import os
 from enum import Enum
-from typing import Union
+from typing import Optional, Union
+
+IMAGE_VERSION = libvm.IMAGE_VERSION
+NUM_REGISTERS = libvm.NUM_REGISTERS
+DEFAULT_STACK_SIZE = libvm.DEFAULT_STACK_SIZE
 
 class Instruction(Enum):
     LEA = libvm.LEA
@@ -52,6 +60,60 @@ class Instruction(Enum):
     MCMP = libvm.MCMP
     EXIT = libvm.EXIT
     PLAC = libvm.PLAC
+    LLI = libvm.LLI
+    LGI = libvm.LGI
+    ADDI = libvm.ADDI
+    SLI = libvm.SLI
+
+class RegisterInstruction(Enum):
+    """寄存器虚拟机的指令，指令字低 8 位为操作码，其后每 8 位依次为寄存器 a、b、c"""
+    MOV = libvm.R_MOV
+    LI = libvm.R_LI
+    LEA = libvm.R_LEA
+    LD = libvm.R_LD
+    LDC = libvm.R_LDC
+    ST = libvm.R_ST
+    STC = libvm.R_STC
+    LDL = libvm.R_LDL
+    STL = libvm.R_STL
+    LDG = libvm.R_LDG
+    STG = libvm.R_STG
+    OR = libvm.R_OR
+    XOR = libvm.R_XOR
+    AND = libvm.R_AND
+    EQ = libvm.R_EQ
+    NE = libvm.R_NE
+    LT = libvm.R_LT
+    GT = libvm.R_GT
+    LE = libvm.R_LE
+    GE = libvm.R_GE
+    SHL = libvm.R_SHL
+    SHR = libvm.R_SHR
+    ADD = libvm.R_ADD
+    SUB = libvm.R_SUB
+    MUL = libvm.R_MUL
+    DIV = libvm.R_DIV
+    MOD = libvm.R_MOD
+    ADDI = libvm.R_ADDI
+    JMP = libvm.R_JMP
+    JZ = libvm.R_JZ
+    JNZ = libvm.R_JNZ
+    CALL = libvm.R_CALL
+    ENT = libvm.R_ENT
+    ADJ = libvm.R_ADJ
+    LEV = libvm.R_LEV
+    PUSH = libvm.R_PUSH
+    POP = libvm.R_POP
+    SYS = libvm.R_SYS
+    EXIT = libvm.R_EXIT
+
+class InstructionSet(Enum):
+    STACK = libvm.ISA_STACK
+    REGISTER = libvm.ISA_REGISTER
+
+class Relocation(Enum):
+    TEXT = libvm.RELOC_TEXT
+    DATA = libvm.RELOC_DATA
 
 class VMStatus(Enum):
     INIT = libvm.VM_INIT
@@ -61,13 +123,22 @@ class VMStatus(Enum):
 
 cdef class VirtualMachine:
     cdef VirtualMachineCpp* vmcpp
-    def __cinit__(self, int poolsize):
-        self.vmcpp = new VirtualMachineCpp(poolsize)
+    def __cinit__(
+        self,
+        int poolsize,
+        instruction_set: InstructionSet = InstructionSet.STACK,
+        int stack_size = DEFAULT_STACK_SIZE,
+    ):
+        """poolsize 为代码段与数据段的字节数，stack_size 为栈区的字节数，
+        各段只预留地址空间，物理页在首次访问时才提交"""
+        cdef int isa = instruction_set.value
+        self.vmcpp = new VirtualMachineCpp(poolsize, <InstructionSetCpp>isa, stack_size)
 
     def __dealloc__(self):
         del self.vmcpp
 
     def reset(self):
+        """清空用过的代码段、数据段与栈区，开销只与用过的部分有关"""
         self.vmcpp.reset()
 
     def step(self, debug: bool = False) -> VMStatus:
@@ -88,6 +159,39 @@ cdef class VirtualMachine:
             opcode = <int64>c_str
         self.vmcpp.add_op(opcode)
 
+    def truncate(self, num_ops: int) -> None:
+        """丢弃代码段中下标 num_ops 及之后的指令"""
+        self.vmcpp.truncate(num_ops)
+
+    def dump_text(self) -> bytes:
+        return (<char *>self.vmcpp.text)[:self.vmcpp.num_ops() * sizeof(int64)]
+
+    def dump_data(self) -> bytes:
+        return self.vmcpp.data[:self.vmcpp.data_size()]
+
+    def load(self, text, data, relocations) -> None:
+        """载入代码段与数据段（bytes 或任意连续缓冲区），relocations 为 int64 缓冲区，
+        每项为 (代码段下标 << 1) | Relocation，对应位置的段内偏移加上段基址"""
+        cdef const unsigned char[::1] text_view = text
+        cdef const unsigned char[::1] data_view = data
+        cdef const int64[::1] relocation_view = relocations
+        if text_view.shape[0] % sizeof(int64):
+            raise ValueError("text segment is not aligned to instructions")
+        self.vmcpp.load(
+            <const int64 *>_buffer_pointer(text_view),
+            text_view.shape[0] // sizeof(int64),
+            <const char *>_buffer_pointer(data_view),
+            data_view.shape[0],
+            &relocation_view[0] if relocation_view.shape[0] else NULL,
+            relocation_view.shape[0],
+        )
+
+    def load_image(self, path) -> Optional[int]:
+        """映射 .pyco 文件，载入代码段与数据段并在一次遍历中完成重定位，返回 main 函数地址"""
+        cdef bytes b_path = os.fsencode(path)
+        cdef int64 entry = self.vmcpp.load_image(b_path)
+        return None if entry < 0 else <int64>self.vmcpp.text + entry
+
     def put_int_onto_data(self, value: int) -> int:
         return self.vmcpp.put_int_onto_data(value)
 
@@ -97,6 +201,21 @@ cdef class VirtualMachine:
     def run_all_ops(self, debug: bool = False) -> int:
         return self.vmcpp.run_all_ops(debug)
 
+    def set_trace(self, capacity: int) -> None:
+        """用容量为 capacity 条的环形缓冲区记录此后执行的每条指令，只保留最近的记录，0 表示关闭"""
+        self.vmcpp.set_trace(capacity)
+
+    @property
+    def trace(self):
+        """按执行顺序排列的执行轨迹的拷贝：字段 cycle、pc、op、operand、ax、sp 均为 int64 的结构体数组，
+        支持缓冲区协议，可由 numpy.asarray 转为结构化数组"""
+        cdef int64 n = self.vmcpp.trace_size()
+        cdef TraceRecordCpp *records = <TraceRecordCpp *>self.vmcpp.trace()
+        cdef TraceRecordCpp empty
+        if n == 0:
+            return (<TraceRecordCpp[:1]>&empty).copy()[:0]
+        return (<TraceRecordCpp[:n]>records).copy()
+
     def pc_offset(self) -> int:
         return self.vmcpp.pc_offset()
 
@@ -113,10 +232,38 @@ cdef class VirtualMachine:
         # TODO: argc, argv
         self.vmcpp.setup_main(main_ptr)
 
+    @property
+    def instruction_set(self) -> InstructionSet:
+        return InstructionSet(<int>self.vmcpp.instruction_set)
+
+    @property
+    def registers(self) -> list[int]:
+        return [self.vmcpp.regs[i] for i in range(libvm.NUM_REGISTERS)]
+
     @property
     def poolsize(self) -> int:
         return self.vmcpp.poolsize
 
+    @property
+    def stack_size(self) -> int:
+        return self.vmcpp.stack_size
+
+    @property
+    def text_base(self) -> int:
+        return <int64>self.vmcpp.text
+
+    @property
+    def data_base(self) -> int:
+        return <int64>self.vmcpp.data
+
+    @property
+    def num_ops(self) -> int:
+        return self.vmcpp.num_ops()
+
+    @property
+    def data_size(self) -> int:
+        return self.vmcpp.data_size()
+
     @property
     def pc(self) -> int:
         return <int64>self.vmcpp.pc
@@ -141,6 +288,9 @@ cdef class VirtualMachine:
     def status(self) -> VMStatus:
         return VMStatus(self.vmcpp.status)
 
+cdef const unsigned char *_buffer_pointer(const unsigned char[::1] view):
+    return &view[0] if view.shape[0] else NULL
+
 cdef bytes _c_pointer_to_string(int64 s_ptr):
     cdef bytes b_str = <char *>s_ptr
     return b_str
@@ -1 +1,6 @@
 __version__ = '0.1.0'
+
+from pycc.compiler import Program, build, compile, compile_units, from_image, load
+from pycc.cache import CompileCache
+from pycc.lexer import CompileError
+from pycc.linker import LinkError, link
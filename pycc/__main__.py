@@ -1,49 +1,175 @@
 import argparse
 import sys
+from pathlib import Path
 
-from pycc.lexer import Lexer, Token
-from pycc.parser import Parser
+from pycc.cache import DEFAULT_MAX_SIZE, CompileCache
+from pycc.compiler import build, compile, load
+from pycc.image import IMAGE_SUFFIX
+from pycc.ir import INLINE_THRESHOLD, PASSES
+from pycc.linker import LinkError
+from pycc.trace import DEFAULT_TRACE_SIZE, save_trace
 from pycc.utils import logger
+from pycc.utils.memory import format_bytes, peak_rss
+from pycc.vm import InstructionSet
 
 
 def main():
     parser = argparse.ArgumentParser("pycc", description="A simple C compiler.")
     parser.add_argument("-s", dest="assembly", action="store_true", help="Compile to assembly.")
     parser.add_argument("-d", dest="debug", action="store_true", help="Enable debug mode.")
-    parser.add_argument("src", type=str, help="Path to source file")
+    parser.add_argument("-t", dest="tokens", action="store_true", help="Print the token stream.")
+    parser.add_argument("-a", dest="ast", type=str, default=None, help="Dump the AST to the given JSON file.")
+    parser.add_argument("--symbols", action="store_true", help="Print the symbol table.")
+    parser.add_argument(
+        "-o", dest="output", type=str, default=None, help="Write a relocatable .pyco image instead of running."
+    )
+    parser.add_argument(
+        "-j",
+        dest="jobs",
+        type=int,
+        default=None,
+        help="Number of processes compiling sources (or the functions of one source) in parallel.",
+    )
+    parser.add_argument(
+        "-O",
+        dest="optimize",
+        type=int,
+        choices=(0, 1, 2, 3),
+        default=0,
+        help="Optimization level (-O1: peephole optimizer, -O2: also fused superinstructions, "
+        "-O3: also optimization passes on a three-address IR).",
+    )
+    parser.add_argument(
+        "--passes",
+        type=str,
+        default=None,
+        help=f"Comma-separated IR passes to run instead of the -O3 default ({', '.join(PASSES)}).",
+    )
+    parser.add_argument(
+        "--inline-threshold",
+        type=int,
+        default=INLINE_THRESHOLD,
+        help="Largest function body (IR instructions plus basic blocks) the inline pass copies into its callers.",
+    )
+    parser.add_argument(
+        "--vm",
+        dest="instruction_set",
+        choices=("stack", "register"),
+        default="stack",
+        help="Target virtual machine (register: 16 registers with three-address instructions).",
+    )
+    parser.add_argument(
+        "--trace",
+        type=str,
+        default=None,
+        help="Record the executed instructions into a binary trace file (render it with python -m pycc.trace).",
+    )
+    parser.add_argument(
+        "--trace-size",
+        type=int,
+        default=DEFAULT_TRACE_SIZE,
+        help="Number of most recent instructions kept in the trace.",
+    )
+    parser.add_argument("--no-cache", dest="cache", action="store_false", help="Do not use the compilation cache.")
+    parser.add_argument("--cache-dir", type=str, default=None, help="Compilation cache directory.")
+    parser.add_argument(
+        "--cache-size", type=int, default=DEFAULT_MAX_SIZE, help="Maximum size of the compilation cache in bytes."
+    )
+    parser.add_argument("src", type=str, nargs="+", help="Paths to source files or .pyco images")
     args, extra_args = parser.parse_known_args()
     if extra_args:
         logger.info("Extra arguments: ", " ".join(extra_args))
 
-    # 读入源代码
-    with open(args.src, "r", encoding="utf-8") as f:
-        source_code = f.read()
-
-    # 词法分析
-    lexer = Lexer(source_code)
-    token_stream: list[Token] = []
-    # for token in lexer:
-    #     token_stream.append(token)
-    token_stream = lexer.tokenize()
-    print("词法分析结果：")
-    print(token_stream)
-    # 语法分析
-
-    print("语法分析中……")
-    parser = Parser(source_code, debug=True)
-    ast = parser.start()
-    ast.dump("ast.json")
-
-    print("符号表：")
-    for key in parser.symbols:
-        print(key, ": ", parser.symbols[key])
-
-    print("全部指令：")
-    main_ptr = parser.symbols.get_symbol("main").value
-    parser.vm.show_ops()
-    parser.vm.setup_main(main_ptr)
-    print("虚拟机运行中……")
-    result = parser.vm.run(True)
+    # 只执行需要的阶段，源文件通过 mmap 直接扫描，且只词法分析一次
+    # 写出镜像时不运行，允许存在留给链接时解析的外部符号
+    stages = {"image"} if args.output is not None else {"code"}
+    if args.tokens:
+        stages.add("tokens")
+    if args.ast is not None:
+        stages.add("ast")
+    if args.symbols:
+        stages.add("symbols")
+    srcs = [Path(src) for src in args.src]
+    # 源码与编译器版本不变时直接从缓存载入代码段与数据段
+    cache = CompileCache(args.cache_dir, args.cache_size) if args.cache else None
+    instruction_set = InstructionSet[args.instruction_set.upper()]
+    passes = None
+    if args.passes is not None:
+        passes = [name for name in args.passes.split(",") if name]
+        if unknown := [name for name in passes if name not in PASSES]:
+            parser.error(f"unknown passes: {', '.join(unknown)}")
+    try:
+        if len(srcs) > 1:
+            # 多个源文件分别编译后链接
+            if stages & {"tokens", "ast"}:
+                parser.error("-t and -a need a single source file")
+            program = build(
+                srcs,
+                stages=stages,
+                workers=args.jobs,
+                cache=cache,
+                optimize=args.optimize,
+                instruction_set=instruction_set,
+                passes=passes,
+                inline_threshold=args.inline_threshold,
+            )
+        elif srcs[0].suffix == IMAGE_SUFFIX:
+            # 已编译的镜像直接映射载入
+            program = load(srcs[0], stages=stages)
+        else:
+            if args.debug:
+                print("语法分析中……")
+            program = compile(
+                srcs[0],
+                stages=stages,
+                debug=args.debug,
+                cache=cache,
+                workers=args.jobs,
+                optimize=args.optimize,
+                instruction_set=instruction_set,
+                passes=passes,
+                inline_threshold=args.inline_threshold,
+            )
+    except LinkError as e:
+        for error in e.errors:
+            logger.error(error)
+        return 1
+
+    if program.passes is not None:
+        logger.info(program.passes)
+    if program.optimization is not None:
+        logger.info(program.optimization)
+
+    if program.tokens is not None:
+        print("词法分析结果：")
+        print(program.tokens)
+
+    if program.ast is not None:
+        program.ast.dump(args.ast)
+
+    if program.symbols is not None:
+        print("符号表：")
+        for key in program.symbols:
+            print(key, ": ", program.symbols[key])
+
+    if args.assembly and program.vm is not None:
+        print("全部指令：")
+        program.vm.show_ops()  # type: ignore
+
+    if program.image is not None:
+        program.image.save(args.output)
+        return 0
+
+    if args.debug:
+        print("虚拟机运行中……")
+    if args.trace is not None:
+        program.vm.set_trace(args.trace_size)  # type: ignore
+    result = program.run(args.debug)
+    if args.trace is not None:
+        num_records = save_trace(args.trace, program.vm.trace, program.vm.instruction_set)  # type: ignore
+        logger.info(f"执行轨迹：最近 {num_records} 条指令已写入 {args.trace}")
+    if (max_rss := peak_rss()) is not None:
+        logger.info(f"峰值内存占用：{format_bytes(max_rss)}")
     return result
 
 
@@ -0,0 +1,101 @@
+import hashlib
+import os
+from pathlib import Path
+from typing import Optional, Union
+
+from pycc import __version__
+from pycc.image import IMAGE_SUFFIX, Image
+from pycc.lexer import DEFAULT_CHUNK_SIZE
+from pycc.vm import IMAGE_VERSION
+
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+
+
+def default_cache_dir() -> Path:
+    """PYCC_CACHE_DIR，其次为 $XDG_CACHE_HOME/pycc 或 ~/.cache/pycc"""
+    if path := os.environ.get("PYCC_CACHE_DIR"):
+        return Path(path)
+    return Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "pycc"
+
+
+class CompileCache:
+    """按源码内容寻址的编译结果缓存，每个条目是一个 .pyco 镜像文件。
+    命中时更新文件的修改时间，总大小超过 max_size 时按修改时间淘汰最久未使用的条目"""
+
+    def __init__(self, directory: Union[str, "os.PathLike[str]", None] = None, max_size: int = DEFAULT_MAX_SIZE):
+        self.directory = Path(directory) if directory is not None else default_cache_dir()
+        self.max_size = max_size
+
+    @staticmethod
+    def key(source: bytes, options: str = "") -> str:
+        """源码与编译器版本、镜像格式版本以及影响代码生成的选项共同决定缓存键"""
+        digest = hashlib.sha256(f"pycc {__version__} image {IMAGE_VERSION} {options}\0".encode())
+        digest.update(source)
+        return digest.hexdigest()
+
+    @staticmethod
+    def key_file(path: Union[str, "os.PathLike[str]"], options: str = "") -> str:
+        """与 key 相同，但按块读取源文件计算摘要，不把整个文件读入内存"""
+        digest = hashlib.sha256(f"pycc {__version__} image {IMAGE_VERSION} {options}\0".encode())
+        with open(path, "rb") as f:
+            while chunk := f.read(DEFAULT_CHUNK_SIZE):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def path(self, key: str) -> Path:
+        return self.directory / f"{key}{IMAGE_SUFFIX}"
+
+    def get(self, key: str) -> Optional[Path]:
+        """命中时返回镜像文件路径"""
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def discard(self, key: str) -> None:
+        self.path(key).unlink(missing_ok=True)
+
+    def put(self, key: str, image: Image, evict: bool = True) -> None:
+        """写入条目，连续写入多个条目时可以只在最后淘汰一次"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.path(key)
+        # 先写临时文件再原子替换，并发的编译进程不会读到写了一半的条目
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        image.save(tmp_path)
+        os.replace(tmp_path, path)
+        if evict:
+            self.evict()
+
+    def mark(self, key: str) -> None:
+        """写入不含镜像的空条目，只用于记录某个键出现过，同样按最久未使用淘汰"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.path(key).touch()
+
+    def entries(self) -> list[tuple[float, int, Path]]:
+        """(修改时间, 大小, 路径)，最久未使用的在前"""
+        entries = []
+        for path in self.directory.glob(f"*{IMAGE_SUFFIX}"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return sorted(entries)
+
+    def size(self) -> int:
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self) -> None:
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+    def clear(self) -> None:
+        for _, _, path in self.entries():
+            path.unlink(missing_ok=True)
@@ -0,0 +1,293 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, Iterable, Optional, Sequence, Union
+
+from pycc.cache import CompileCache
+from pycc.image import IMAGE_SUFFIX, Image, read_image_info, symbol_table
+from pycc.ir import DEFAULT_PASSES, INLINE_THRESHOLD, PassReport, run_passes
+from pycc.lexer import CompileError, Lexer, TokenBuffer
+from pycc.linker import LinkError, link
+from pycc.optimizer import PeepholeReport, peephole
+from pycc.parallel import compile_functions_parallel, unit_signature
+from pycc.parser import Parser
+from pycc.registers import to_registers
+from pycc.tree import Node
+from pycc.symbols import SymbolTable
+from pycc.vm import InstructionSet, VirtualMachine
+
+# 各编译阶段，parse 阶段同时完成语法分析与代码生成，image 为与加载地址无关的镜像
+STAGES = ("tokens", "ast", "symbols", "code", "image")
+# 可以直接从镜像文件中得到的阶段
+IMAGE_STAGES = frozenset({"symbols", "code", "image"})
+# 可以按函数并行编译的阶段，并行编译的结果中不含局部符号
+PARALLEL_STAGES = frozenset({"code", "image"})
+Source = Union[str, bytes, "os.PathLike[str]", BinaryIO]
+
+
+@dataclass
+class Program:
+    tokens: Optional[TokenBuffer] = None
+    ast: Optional[Node] = None
+    symbols: Optional[SymbolTable] = None
+    vm: Optional[VirtualMachine] = None
+    entry: Optional[int] = None  # main 函数地址
+    image: Optional[Image] = None
+    optimization: Optional[PeepholeReport] = None  # 命中缓存时为 None
+    passes: Optional[PassReport] = None  # 中间表示上各遍的耗时与效果，命中缓存或未启用时为 None
+
+    def run(self, debug: bool = False) -> int:
+        assert self.vm is not None and self.entry is not None, "program has no code to run"
+        self.vm.setup_main(self.entry)
+        return self.vm.run(debug)
+
+
+def make_lexer(source: Source) -> Lexer:
+    # str 与 bytes 视为源代码，路径与二进制文件对象直接从文件中扫描
+    if isinstance(source, (str, bytes)):
+        return Lexer(source)
+    return Lexer.from_file(source)
+
+
+def read_source(source: Source) -> bytes:
+    if isinstance(source, str):
+        return source.encode()
+    if isinstance(source, bytes):
+        return source
+    if hasattr(source, "read"):
+        return source.read()  # type: ignore
+    with open(source, "rb") as f:  # type: ignore
+        return f.read()
+
+
+def load(path: Union[str, "os.PathLike[str]"], *, stages: Iterable[str] = ("code",)) -> Program:
+    """载入 .pyco 镜像文件，各段由虚拟机直接映射载入并完成重定位"""
+    stages = set(stages)
+    assert stages <= IMAGE_STAGES, f"stages not available from an image: {stages - IMAGE_STAGES}"
+    program = Program()
+    if "image" in stages:
+        with open(path, "rb") as f:
+            program.image = Image.from_bytes(f.read())
+    if not stages & {"symbols", "code"}:
+        return program
+
+    header, records, instruction_set = read_image_info(path)
+    vm = VirtualMachine(header.poolsize, instruction_set)
+    entry = vm.load_image(path)
+    if "symbols" in stages:
+        program.symbols = symbol_table(records, vm)
+    if "code" in stages:
+        program.vm = vm
+        program.entry = entry
+    return program
+
+
+def select_passes(optimize: int, passes: Optional[Sequence[str]] = None) -> tuple[str, ...]:
+    """中间表示上运行的遍：未给出时 -O3 运行全部默认的遍"""
+    if passes is not None:
+        return tuple(passes)
+    return DEFAULT_PASSES if optimize >= 3 else ()
+
+
+def finish_image(
+    image: Image,
+    optimize: int,
+    instruction_set: InstructionSet = InstructionSet.STACK,
+    passes: Sequence[str] = (),
+    inline_threshold: int = INLINE_THRESHOLD,
+) -> tuple[Image, Optional[PeepholeReport], Optional[PassReport]]:
+    """给出 passes 时先在中间表示上运行各遍，optimize 不为 0 时做窥孔优化，
+    目标为寄存器虚拟机时再翻译为寄存器指令"""
+    report = pass_report = None
+    if passes:
+        image, pass_report = run_passes(image, passes, optimize >= 2, inline_threshold)
+    if optimize:
+        image, report = peephole(image)
+    if instruction_set == InstructionSet.REGISTER:
+        image = to_registers(image)
+    return image, report, pass_report
+
+
+def compile_options(
+    optimize: int,
+    instruction_set: InstructionSet,
+    passes: Sequence[str] = (),
+    inline_threshold: int = INLINE_THRESHOLD,
+) -> str:
+    """影响代码生成的选项，作为缓存键的一部分"""
+    options = [f"-O{optimize}"] if optimize else []
+    if instruction_set != InstructionSet.STACK:
+        options.append(f"--vm {instruction_set.name.lower()}")
+    if passes:
+        options.append(f"--passes {','.join(passes)}")
+    if "inline" in passes and inline_threshold != INLINE_THRESHOLD:
+        options.append(f"--inline-threshold {inline_threshold}")
+    return " ".join(options)
+
+
+def from_image(
+    image: Image,
+    *,
+    stages: Iterable[str] = ("code",),
+    optimization: Optional[PeepholeReport] = None,
+    passes: Optional[PassReport] = None,
+) -> Program:
+    """载入内存中的镜像"""
+    stages = set(stages)
+    assert stages <= IMAGE_STAGES, f"stages not available from an image: {stages - IMAGE_STAGES}"
+    program = Program(image=image if "image" in stages else None, optimization=optimization, passes=passes)
+    if not stages & {"symbols", "code"}:
+        return program
+
+    vm = VirtualMachine(image.poolsize, image.instruction_set)
+    entry, symbols = image.load(vm)
+    if "symbols" in stages:
+        program.symbols = symbols
+    if "code" in stages:
+        program.vm = vm
+        program.entry = entry
+    return program
+
+
+def compile(
+    source: Source,
+    *,
+    stages: Iterable[str] = ("code",),
+    debug: bool = False,
+    cache: Optional[CompileCache] = None,
+    workers: Optional[int] = None,
+    optimize: int = 0,
+    instruction_set: InstructionSet = InstructionSet.STACK,
+    passes: Optional[Sequence[str]] = None,
+    inline_threshold: int = INLINE_THRESHOLD,
+) -> Program:
+    """按需执行编译的各个阶段，每个阶段至多执行一次，结果保存在 Program 中。
+    给出 cache 且只需要符号表、代码与镜像时，命中缓存则直接载入镜像文件，跳过词法与语法分析。
+    给出 workers 且只需要代码与镜像时，在 workers 个进程中按函数并行编译；
+    同时给出 cache 时，源码改动后只重新编译改动过的函数。
+    optimize 为 1 时对代码做窥孔优化，函数地址随之改变，符号表中只有全局符号；
+    为 2 时还使用融合指令生成代码。
+    为 3 时还在三地址中间表示上内联小函数、做常量与复写传播、循环优化、死存储与不可达块删除，
+    passes 给出时只运行其中的遍，inline_threshold 为内联的函数体大小上限。
+    instruction_set 为 REGISTER 时把栈式代码翻译为寄存器虚拟机的代码，函数地址同样改变"""
+    stages = set(stages)
+    assert stages <= set(STAGES), f"unknown stages: {stages - set(STAGES)}"
+    passes = select_passes(optimize, passes)
+    cache_key = None
+    if cache is not None and not debug and stages and stages <= IMAGE_STAGES:
+        options = compile_options(optimize, instruction_set, passes, inline_threshold)
+        if isinstance(source, (str, bytes)) or hasattr(source, "read"):
+            source = read_source(source)
+            cache_key = cache.key(source, options)
+        else:
+            # 路径按块计算摘要，未命中时仍由词法分析器映射文件扫描
+            cache_key = cache.key_file(source, options)
+        if (path := cache.get(cache_key)) is not None:
+            try:
+                return load(path, stages=stages)
+            except (OSError, ValueError):
+                # 条目损坏或已被其他进程淘汰
+                cache.discard(cache_key)
+    program = Program()
+
+    if "tokens" in stages:
+        program.tokens = TokenBuffer.from_lexer(make_lexer(source))
+    if not stages & {"ast", "symbols", "code", "image"}:
+        return program
+
+    # 已有 token 流时直接在其上语法分析，避免再次词法分析
+    # 不需要语法树时只生成代码
+    tokens: Union[Lexer, TokenBuffer] = program.tokens if program.tokens is not None else make_lexer(source)
+    # 给出缓存时按函数增量编译，只重新编译改动过的函数
+    parallel = False
+    unit_key = None
+    if (workers is not None or cache_key is not None) and not debug and stages <= PARALLEL_STAGES:
+        tokens = TokenBuffer.from_lexer(tokens)  # type: ignore
+        parallel = workers is not None
+        if not parallel:
+            # 冷缓存时按函数编译比串行编译慢，只有这个编译单元此前编译过时才增量编译，
+            # 否则串行编译并记下这个单元，下次改动后再按函数编译并缓存各个函数
+            unit_key = cache.key(unit_signature(tokens), options)  # type: ignore
+            parallel = cache.get(unit_key) is not None  # type: ignore
+    if parallel:
+        try:
+            image = compile_functions_parallel(tokens, workers or 1, cache, superinstructions=optimize >= 2)
+        except (CompileError, LinkError):
+            # 源码有误时串行编译，报告与串行编译相同的错误
+            pass
+        else:
+            image, report, pass_report = finish_image(image, optimize, instruction_set, passes, inline_threshold)
+            if cache_key is not None:
+                cache.put(cache_key, image)  # type: ignore
+            return from_image(image, stages=stages, optimization=report, passes=pass_report)
+    parser = Parser(tokens, debug=debug, build_ast="ast" in stages, superinstructions=optimize >= 2)
+    program.ast = parser.start()
+    if "code" in stages and parser.externals:
+        # 单独运行时不能有未定义的外部符号，需要与其他单元链接
+        names = dict.fromkeys(name for _, name in parser.externals)
+        raise LinkError([f"undefined symbol '{name}'" for name in names])
+    if unit_key is not None:
+        cache.mark(unit_key)  # type: ignore
+    if optimize or instruction_set != InstructionSet.STACK or passes:
+        # 优化或翻译后函数地址改变，代码与符号表从最终的镜像中载入
+        image, report, pass_report = finish_image(
+            Image.from_parser(parser), optimize, instruction_set, passes, inline_threshold
+        )
+        if cache_key is not None:
+            cache.put(cache_key, image)  # type: ignore
+        optimized = from_image(image, stages=stages & IMAGE_STAGES, optimization=report, passes=pass_report)
+        optimized.tokens, optimized.ast = program.tokens, program.ast
+        return optimized
+    if "symbols" in stages:
+        program.symbols = parser.symbols
+    if "code" in stages:
+        program.vm = parser.vm
+        program.entry = parser.symbols.get_symbol("main").value
+    if "image" in stages or cache_key is not None:
+        image = Image.from_parser(parser)
+        if "image" in stages:
+            program.image = image
+        if cache_key is not None:
+            cache.put(cache_key, image)  # type: ignore
+    return program
+
+
+def compile_unit(source: Source, cache: Optional[CompileCache] = None) -> Image:
+    """将一个源文件编译为目标单元，.pyco 文件直接读取"""
+    path = None if isinstance(source, (str, bytes)) or hasattr(source, "read") else Path(source)  # type: ignore
+    if path is None or path.suffix != IMAGE_SUFFIX:
+        return compile(source, stages=["image"], cache=cache).image  # type: ignore
+    with open(path, "rb") as f:
+        return Image.from_bytes(f.read())
+
+
+def compile_units(
+    sources: Sequence[Source], *, workers: Optional[int] = None, cache: Optional[CompileCache] = None
+) -> list[Image]:
+    """在进程池中分别编译各个源文件，workers 为 1 时在当前进程中依次编译"""
+    if workers == 1 or len(sources) <= 1:
+        return [compile_unit(source, cache) for source in sources]
+    with ProcessPoolExecutor(workers) as executor:
+        return list(executor.map(compile_unit, sources, [cache] * len(sources)))
+
+
+def build(
+    sources: Sequence[Source],
+    *,
+    stages: Iterable[str] = ("code",),
+    workers: Optional[int] = None,
+    cache: Optional[CompileCache] = None,
+    optimize: int = 0,
+    instruction_set: InstructionSet = InstructionSet.STACK,
+    passes: Optional[Sequence[str]] = None,
+    inline_threshold: int = INLINE_THRESHOLD,
+) -> Program:
+    """分别编译各个源文件后链接为一个程序，optimize 为 1 时对链接结果做窥孔优化，
+    为 3 时先在中间表示上运行 passes（默认为全部的遍），内联可以跨越源文件，
+    instruction_set 为 REGISTER 时再把链接结果翻译为寄存器虚拟机的代码"""
+    names = [f"<unit {i}>" if isinstance(source, (str, bytes)) else str(source) for i, source in enumerate(sources)]
+    image = link(compile_units(sources, workers=workers, cache=cache), names)
+    passes = select_passes(optimize, passes)
+    image, report, pass_report = finish_image(image, optimize, instruction_set, passes, inline_threshold)
+    return from_image(image, stages=stages, optimization=report, passes=pass_report)
@@ -0,0 +1,133 @@
+"""栈式代码的控制流与数据流分析，供寄存器代码生成与中间表示的构造使用。
+
+从函数入口（ENT）、函数符号与 main 出发沿跳转与顺序执行遍历可达的指令，
+得到各条指令执行前表达式栈的深度与跳转目标；再逆向分析各条指令执行前 ax 的值之后是否仍会被读取。
+"""
+from bisect import bisect_left
+from typing import Optional
+
+from pycc.image import Image
+from pycc.optimizer import BARRIER_OPCODES, SLOT_BYTES, Op, decode
+from pycc.vm import Instruction, Relocation
+
+# 栈式二元运算指令
+BINARY_OPCODES = frozenset(range(Instruction.OR.value, Instruction.MOD.value + 1))
+SYSTEM_OPCODES = frozenset(range(Instruction.OPEN.value, Instruction.MCMP.value + 1))
+# 读取 ax 的指令
+AX_USES = BINARY_OPCODES | {
+    Instruction.PUSH.value,
+    Instruction.LI.value,
+    Instruction.LC.value,
+    Instruction.SI.value,
+    Instruction.SC.value,
+    Instruction.SLI.value,
+    Instruction.ADDI.value,
+    Instruction.JZ.value,
+    Instruction.JNZ.value,
+    Instruction.LEV.value,
+}
+# 不读取而直接覆盖 ax 的指令
+AX_DEFS = SYSTEM_OPCODES | {
+    Instruction.LEA.value,
+    Instruction.IMM.value,
+    Instruction.LLI.value,
+    Instruction.LGI.value,
+    Instruction.CALL.value,
+    Instruction.ENT.value,
+}
+
+
+def stack_effect(op: Op) -> int:
+    """指令执行后表达式栈深度的变化"""
+    if op.opcode == Instruction.PUSH.value:
+        return 1
+    if op.opcode in BINARY_OPCODES or op.opcode in (Instruction.SI.value, Instruction.SC.value):
+        return -1
+    if op.opcode == Instruction.ADJ.value:
+        return -op.operand  # type: ignore
+    return 0
+
+
+class StackFlow:
+    def __init__(self, image: Image):
+        self.image = image
+        self.ops = decode(image)
+        self.positions = {op.index: i for i, op in enumerate(self.ops)}
+        self.depths: dict[int, int] = {}  # 各指令执行前的栈深，不可达的指令没有
+        self.live: list[bool] = [False] * len(self.ops)  # 各指令执行前 ax 是否仍会被读取
+        self.labels: set[int] = set()  # 跳转目标与函数入口
+        self.analyze()
+
+    def successors(self, position: int) -> list[int]:
+        op = self.ops[position]
+        successors = []
+        if op.opcode not in BARRIER_OPCODES and position + 1 < len(self.ops):
+            successors.append(position + 1)
+        if (target := op.target) is not None:
+            if target not in self.positions:
+                raise ValueError(f"jump into the middle of an instruction at {op.index}")
+            successors.append(self.positions[target])
+        return successors
+
+    def target(self, position: int) -> int:
+        """跳转指令的目标位置"""
+        return self.positions[self.ops[position].target]  # type: ignore
+
+    def num_args(self, position: int) -> Optional[int]:
+        """调用之后紧跟的 ADJ 弹出的实参个数，没有 ADJ 时为 None"""
+        following = position + 1
+        if (
+            following < len(self.ops)
+            and self.ops[following].opcode == Instruction.ADJ.value
+            and following not in self.labels
+        ):
+            return self.ops[following].operand
+        return None
+
+    def analyze(self):
+        # 函数入口（ENT）与 main 处表达式栈为空
+        roots = [i for i, op in enumerate(self.ops) if op.opcode == Instruction.ENT.value]
+        offsets = [value for *_, value, relocation in self.image.symbols if relocation == Relocation.TEXT.value]
+        if self.image.entry is not None:
+            offsets.append(self.image.entry)
+        indices = [op.index for op in self.ops]
+        for offset in offsets:
+            if (i := bisect_left(indices, offset // SLOT_BYTES)) < len(indices):
+                roots.append(i)
+        self.labels = set(roots)
+        worklist = []
+        for root in roots:
+            self.depths[root] = 0
+            worklist.append(root)
+        while worklist:
+            position = worklist.pop()
+            op = self.ops[position]
+            depth = self.depths[position] + stack_effect(op)
+            if depth < 0:
+                raise ValueError(f"stack underflow at {op.index}")
+            if op.target is not None:
+                self.labels.add(self.positions[op.target])
+            for successor in self.successors(position):
+                if self.ops[successor].opcode == Instruction.ENT.value:
+                    continue
+                if successor not in self.depths:
+                    self.depths[successor] = depth
+                    worklist.append(successor)
+                elif self.depths[successor] != depth:
+                    raise ValueError(f"inconsistent stack depth at {self.ops[successor].index}")
+
+        # ax 的活跃性：逆向数据流分析直到不动点，读取 ax 的指令总是活跃，覆盖 ax 的指令总是不活跃
+        undecided = []
+        for position in sorted(self.depths, reverse=True):
+            opcode = self.ops[position].opcode
+            if opcode in AX_USES:
+                self.live[position] = True
+            elif opcode not in AX_DEFS:
+                undecided.append((position, self.successors(position)))
+        changed = True
+        while changed:
+            changed = False
+            for position, successors in undecided:
+                if not self.live[position] and any(self.live[successor] for successor in successors):
+                    self.live[position] = True
+                    changed = True
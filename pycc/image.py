@@ -0,0 +1,226 @@
+import json
+import os
+import struct
+from array import array
+from dataclasses import dataclass, field
+from typing import Any, NamedTuple, Optional, Union
+
+from pycc.symbols import IdClass, IdLevel, IdType, Symbol, SymbolTable
+from pycc.vm import IMAGE_VERSION, InstructionSet, Relocation, VirtualMachine
+
+# .pyco 镜像文件：文件头之后依次是代码段、数据段、重定位表与元数据（符号表、外部引用与指令集），
+# 各段按 8 字节对齐，整数均为本机字节序，布局与 libvm.hpp 中的 ImageHeader 一致
+IMAGE_MAGIC = b"PYCO"
+IMAGE_SUFFIX = ".pyco"
+IMAGE_HEADER = struct.Struct("=4sIq9Q")
+IMAGE_ALIGNMENT = 8
+
+# 符号记录：(key, name, cls, data_type, level, value, relocation)，
+# relocation 不为 None 时 value 为段内偏移
+SymbolRecord = tuple[str, str, Optional[int], Optional[int], Optional[int], Any, Optional[int]]
+# 外部引用：(代码段下标, 符号名)，该位置的值在链接时回填为符号地址
+External = tuple[int, str]
+PathLike = Union[str, "os.PathLike[str]"]
+
+
+class ImageHeader(NamedTuple):
+    magic: bytes
+    version: int
+    entry: int
+    text_offset: int
+    text_size: int
+    data_offset: int
+    data_size: int
+    relocations_offset: int
+    num_relocations: int
+    symbols_offset: int
+    symbols_size: int
+    num_externals: int
+
+    @classmethod
+    def unpack(cls, buffer: bytes) -> "ImageHeader":
+        if len(buffer) < IMAGE_HEADER.size:
+            raise ValueError("truncated image")
+        header = cls(*IMAGE_HEADER.unpack_from(buffer))
+        if header.magic != IMAGE_MAGIC or header.version != IMAGE_VERSION:
+            raise ValueError("not a pycc image or unsupported version")
+        return header
+
+    @property
+    def poolsize(self) -> int:
+        """装下各段所需的最小 poolsize"""
+        return max(self.text_size, self.data_size)
+
+
+def symbol_relocation(symbol: Symbol) -> Optional[Relocation]:
+    """函数与全局变量的值是段内地址，需要重定位"""
+    if symbol.cls == IdClass.Func:
+        return Relocation.TEXT
+    if symbol.cls == IdClass.Var and symbol.level is not None and IdLevel(symbol.level) == IdLevel.Global:
+        return Relocation.DATA
+    return None
+
+
+def symbol_table(records: list[SymbolRecord], vm: VirtualMachine) -> SymbolTable:
+    """由符号记录重建符号表，段内偏移加上虚拟机的段基址"""
+    bases = {Relocation.TEXT.value: vm.text_base, Relocation.DATA.value: vm.data_base}
+    symbols = SymbolTable()
+    for key, name, cls, data_type, level, value, relocation in records:
+        symbols[key] = Symbol(
+            name=name,
+            cls=None if cls is None else IdClass(cls),
+            data_type=None if data_type is None else IdType(data_type),
+            level=None if level is None else IdLevel(level),
+            value=value if relocation is None else value + bases[relocation],
+        )
+    return symbols
+
+
+def align(offset: int) -> int:
+    return -offset % IMAGE_ALIGNMENT
+
+
+@dataclass
+class Image:
+    """与加载地址无关的编译结果，段内地址均保存为相对段基址的偏移"""
+
+    text: bytes = b""
+    data: bytes = b""
+    relocations: array = field(default_factory=lambda: array("q"))  # (代码段下标 << 1) | Relocation
+    entry: Optional[int] = None  # main 函数在代码段中的字节偏移
+    symbols: list[SymbolRecord] = field(default_factory=list)
+    externals: list[External] = field(default_factory=list)  # 不为空时是需要链接的目标单元
+    instruction_set: InstructionSet = InstructionSet.STACK  # 代码段的指令集
+
+    @classmethod
+    def from_parser(cls, parser: Any) -> "Image":
+        """从完成代码生成的 Parser 中导出镜像"""
+        vm = parser.vm
+        bases = {Relocation.TEXT.value: vm.text_base, Relocation.DATA.value: vm.data_base}
+        text = array("q", vm.dump_text())
+        for item in parser.relocations:
+            text[item >> 1] -= bases[item & 1]
+
+        symbols: list[SymbolRecord] = []
+        entry = None
+        for key, symbol in parser.symbols.items():
+            # 仅声明未定义的符号没有地址
+            relocation = symbol_relocation(symbol) if symbol.value is not None else None
+            value = symbol.value if relocation is None else symbol.value - bases[relocation.value]
+            if symbol.name == "main" and relocation is Relocation.TEXT:
+                entry = value
+            symbols.append(
+                (
+                    key,
+                    symbol.name,
+                    None if symbol.cls is None else symbol.cls.value,
+                    None if symbol.data_type is None else symbol.data_type.value,
+                    None if symbol.level is None else IdLevel(symbol.level).value,
+                    value,
+                    None if relocation is None else relocation.value,
+                )
+            )
+        return cls(
+            text.tobytes(),
+            vm.dump_data(),
+            array("q", parser.relocations),
+            entry,
+            symbols,
+            list(parser.externals),
+        )
+
+    @property
+    def poolsize(self) -> int:
+        return max(len(self.text), len(self.data))
+
+    def load(self, vm: VirtualMachine) -> tuple[Optional[int], SymbolTable]:
+        """载入到虚拟机并完成重定位，返回 main 函数地址与重定位后的符号表"""
+        if self.externals:
+            raise ValueError("image has unresolved external symbols")
+        if vm.instruction_set != self.instruction_set:
+            raise ValueError(
+                f"{self.instruction_set.name.lower()} machine code cannot run on a "
+                f"{vm.instruction_set.name.lower()} machine"
+            )
+        vm.load(self.text, self.data, self.relocations)
+        entry = None if self.entry is None else self.entry + vm.text_base
+        return entry, symbol_table(self.symbols, vm)
+
+    def to_bytes(self) -> bytes:
+        metadata = {"symbols": self.symbols, "externals": self.externals, "instruction_set": self.instruction_set.value}
+        symbols = json.dumps(metadata, ensure_ascii=False, separators=(",", ":")).encode()
+        relocations = self.relocations.tobytes()
+        sections = []
+        offsets = []
+        offset = IMAGE_HEADER.size
+        for section in (self.text, self.data, relocations, symbols):
+            offsets.append(offset)
+            padding = b"\0" * align(len(section))
+            sections += [section, padding]
+            offset += len(section) + len(padding)
+        header = IMAGE_HEADER.pack(
+            IMAGE_MAGIC,
+            IMAGE_VERSION,
+            -1 if self.entry is None else self.entry,
+            offsets[0],
+            len(self.text),
+            offsets[1],
+            len(self.data),
+            offsets[2],
+            len(self.relocations),
+            offsets[3],
+            len(symbols),
+            len(self.externals),
+        )
+        return b"".join([header, *sections])
+
+    @classmethod
+    def from_bytes(cls, buffer: bytes) -> "Image":
+        header = ImageHeader.unpack(buffer)
+        relocations_size = header.num_relocations * array("q").itemsize
+        for offset, size in (
+            (header.text_offset, header.text_size),
+            (header.data_offset, header.data_size),
+            (header.relocations_offset, relocations_size),
+            (header.symbols_offset, header.symbols_size),
+        ):
+            if offset + size > len(buffer):
+                raise ValueError("truncated image")
+
+        def section(offset: int, size: int) -> bytes:
+            return bytes(buffer[offset : offset + size])
+
+        symbols, externals, instruction_set = parse_metadata(section(header.symbols_offset, header.symbols_size))
+        return cls(
+            section(header.text_offset, header.text_size),
+            section(header.data_offset, header.data_size),
+            array("q", section(header.relocations_offset, relocations_size)),
+            None if header.entry < 0 else header.entry,
+            symbols,
+            externals,
+            instruction_set,
+        )
+
+    def save(self, path: PathLike) -> None:
+        with open(path, "wb") as f:
+            f.write(self.to_bytes())
+
+
+def parse_metadata(buffer: bytes) -> tuple[list[SymbolRecord], list[External], InstructionSet]:
+    metadata = json.loads(buffer)
+    symbols = [tuple(record) for record in metadata["symbols"]]
+    externals = [(index, name) for index, name in metadata["externals"]]
+    instruction_set = InstructionSet(metadata.get("instruction_set", InstructionSet.STACK.value))
+    return symbols, externals, instruction_set  # type: ignore
+
+
+def read_image_info(path: PathLike) -> tuple[ImageHeader, list[SymbolRecord], InstructionSet]:
+    """只读取文件头与元数据，各段交给 VirtualMachine.load_image 直接映射载入"""
+    with open(path, "rb") as f:
+        header = ImageHeader.unpack(f.read(IMAGE_HEADER.size))
+        f.seek(header.symbols_offset)
+        buffer = f.read(header.symbols_size)
+    if len(buffer) != header.symbols_size:
+        raise ValueError("truncated image")
+    symbols, _, instruction_set = parse_metadata(buffer)
+    return header, symbols, instruction_set
@@ -0,0 +1,1845 @@
+"""三地址中间表示与其上的优化遍（-O3）。
+
+语法分析时直接生成的栈式代码按函数还原为由基本块组成的控制流图：
+表达式栈在构造时模拟，每个运算的结果是一个临时变量，变量的读写是显式的 load/store，
+跳转目标处仍会被读取的 ax 由各前驱块在离开前写入同一个临时变量，
+跨越基本块边界的表达式栈项（短路求值的 || 与 && 出现在表达式中间时）仍通过 push 留在虚拟机栈上。
+各遍可以单独开关并分别计时，最后再降级为栈式指令：只在同一基本块中紧接着使用一次的临时变量
+按原来的求值顺序重新拼回表达式树，由各前驱最后算出、在块开头最先读取的临时变量留在 ax 中传递，
+其余的存入函数栈帧中新增的 int 槽位。
+
+语言中没有取地址运算，局部变量与参数只能通过名字读写，因此不会与其他内存别名；
+全局变量可能被调用的函数修改，调用之后不再假定其值。
+"""
+import time
+from array import array
+from dataclasses import dataclass, field
+from typing import Callable, Iterator, Optional, Sequence, Union
+
+from pycc.flow import BINARY_OPCODES, SYSTEM_OPCODES, StackFlow
+from pycc.image import Image, SymbolRecord
+from pycc.optimizer import SLOT_BYTES
+from pycc.parser import CONSTANT_OPERATIONS, fold_constant, wrap_int64
+from pycc.vm import Instruction, InstructionSet, Relocation
+
+
+@dataclass(frozen=True)
+class Temp:
+    id: int
+
+    def __str__(self) -> str:
+        return f"t{self.id}"
+
+
+@dataclass(frozen=True)
+class Const:
+    """立即数，relocation 或 external 不为 None 时是段内地址或外部符号的地址"""
+
+    value: int
+    relocation: Optional[int] = None
+    external: Optional[str] = None
+
+    @property
+    def plain(self) -> bool:
+        return self.relocation is None and self.external is None
+
+    def __str__(self) -> str:
+        if self.external is not None:
+            return f"&{self.external}"
+        if self.relocation == Relocation.TEXT.value:
+            return f"text+{self.value}"
+        if self.relocation == Relocation.DATA.value:
+            return f"data+{self.value}"
+        return str(self.value)
+
+
+@dataclass(frozen=True)
+class Frame:
+    """局部变量或参数的地址 bp + offset"""
+
+    offset: int
+
+    def __str__(self) -> str:
+        return f"&bp[{self.offset}]"
+
+
+@dataclass(frozen=True)
+class Stacked:
+    """由之前的 push 留在虚拟机栈上的值，读取时出栈"""
+
+    def __str__(self) -> str:
+        return "pop"
+
+
+STACKED = Stacked()
+Operand = Union[Temp, Const, Frame, Stacked]
+# 表达式栈中的一项：(值, 压栈的序号)
+Entry = tuple[Operand, int]
+
+
+@dataclass(frozen=True)
+class Var:
+    """局部变量或参数（offset 为相对 bp 的槽位），或全局变量（数据段偏移或外部符号）"""
+
+    local: bool
+    offset: int
+    external: Optional[str] = None
+    char: bool = False  # 按 char 读写（LC/SC）
+
+    def wrap(self, value: int) -> int:
+        """存入该变量后再读出的值"""
+        bits = 8 if self.char else 32
+        return (value + (1 << (bits - 1))) % (1 << bits) - (1 << (bits - 1))
+
+    def address(self) -> Operand:
+        if self.local:
+            return Frame(self.offset)
+        return Const(self.offset, None if self.external is not None else Relocation.DATA.value, self.external)
+
+    def __str__(self) -> str:
+        if self.local:
+            return f"bp[{self.offset}]"
+        return self.external if self.external is not None else f"data[{self.offset}]"
+
+
+@dataclass
+class Quad:
+    """三地址指令：
+
+    - move dest, args[0]
+    - load dest, var
+    - store var, args[0]，args[1] 为 STACKED 时变量地址已在栈上
+    - push args[0]
+    - binary dest, args[0] opcode args[1]，opcode 为栈式运算指令
+    - call dest, target(args...)
+    - sys dest, opcode(args...)，opcode 为栈式系统调用指令
+
+    操作数为 STACKED 时从虚拟机栈上弹出，与 push 按后进先出配对
+    """
+
+    kind: str
+    dest: Optional[Temp] = None
+    args: list[Operand] = field(default_factory=list)
+    opcode: Optional[int] = None
+    var: Optional[Var] = None
+    target: Optional[Const] = None
+
+    @property
+    def pure(self) -> bool:
+        """没有副作用，结果不被使用时可以删除"""
+        return self.kind in ("move", "load", "binary") and STACKED not in self.args
+
+    def __str__(self) -> str:
+        args = ", ".join(map(str, self.args))
+        if self.kind == "store":
+            return f"{self.var} = {self.args[0]}" + (" (address: pop)" if len(self.args) > 1 else "")
+        if self.kind == "push":
+            return f"push {args}"
+        if self.kind == "move":
+            rhs = args
+        elif self.kind == "load":
+            rhs = f"load {self.var}"
+        elif self.kind == "binary":
+            rhs = f"{self.args[0]} {Instruction(self.opcode).name.lower()} {self.args[1]}"
+        elif self.kind == "call":
+            rhs = f"call {self.target}({args})"
+        else:
+            rhs = f"{Instruction(self.opcode).name.lower()}({args})"
+        return f"{self.dest} = {rhs}"
+
+
+@dataclass
+class Terminator:
+    """基本块的出口：jump 跳到 targets[0]；branch 在 value 不为 0 时跳到 targets[0]，否则跳到 targets[1]；
+    return 以 value 为返回值离开函数，value 为 None 时返回值不确定"""
+
+    kind: str
+    value: Optional[Operand] = None
+    targets: list[int] = field(default_factory=list)
+
+    def __str__(self) -> str:
+        if self.kind == "jump":
+            return f"jump b{self.targets[0]}"
+        if self.kind == "branch":
+            return f"branch {self.value} ? b{self.targets[0]} : b{self.targets[1]}"
+        return "return" if self.value is None else f"return {self.value}"
+
+
+@dataclass
+class Block:
+    id: int  # 第一条指令在栈式代码中的位置；各遍新增的块取更大的编号
+    quads: list[Quad] = field(default_factory=list)
+    terminator: Terminator = field(default_factory=lambda: Terminator("return"))
+
+    @property
+    def successors(self) -> list[int]:
+        return self.terminator.targets
+
+
+@dataclass
+class Function:
+    start: int  # ENT 在栈式代码段中的下标
+    num_locals: int
+    name: Optional[str] = None
+    blocks: dict[int, Block] = field(default_factory=dict)  # 按代码顺序排列，第一个是入口
+    num_temps: int = 0
+
+    @property
+    def entry(self) -> int:
+        return next(iter(self.blocks))
+
+    def new_temp(self) -> Temp:
+        self.num_temps += 1
+        return Temp(self.num_temps - 1)
+
+    def new_block(self, before: int) -> Block:
+        """在 before 之前新增一个跳到 before 的空块"""
+        block = Block(max(self.blocks) + 1, terminator=Terminator("jump", targets=[before]))
+        blocks = {}
+        for block_id, other in self.blocks.items():
+            if block_id == before:
+                blocks[block.id] = block
+            blocks[block_id] = other
+        self.blocks = blocks
+        return block
+
+    def new_local(self, char: bool = False) -> Var:
+        """新增一个局部变量"""
+        self.num_locals += 1
+        return Var(True, -self.num_locals, char=char)
+
+    def predecessors(self) -> dict[int, list[int]]:
+        predecessors: dict[int, list[int]] = {block_id: [] for block_id in self.blocks}
+        for block in self.blocks.values():
+            for successor in block.successors:
+                if successor in predecessors:
+                    predecessors[successor].append(block.id)
+        return predecessors
+
+    def uses(self) -> dict[Temp, int]:
+        """各临时变量被读取的次数"""
+        counts: dict[Temp, int] = {}
+        for block in self.blocks.values():
+            for operand in block_operands(block):
+                if isinstance(operand, Temp):
+                    counts[operand] = counts.get(operand, 0) + 1
+        return counts
+
+    def definitions(self) -> dict[Temp, int]:
+        counts: dict[Temp, int] = {}
+        for block in self.blocks.values():
+            for quad in block.quads:
+                if quad.dest is not None:
+                    counts[quad.dest] = counts.get(quad.dest, 0) + 1
+        return counts
+
+    def __str__(self) -> str:
+        lines = [f"function {self.name or self.start} (locals: {self.num_locals})"]
+        for block in self.blocks.values():
+            lines.append(f"  b{block.id}:")
+            lines += [f"    {quad}" for quad in block.quads]
+            lines.append(f"    {block.terminator}")
+        return "\n".join(lines)
+
+
+def block_operands(block: Block) -> Iterator[Operand]:
+    for quad in block.quads:
+        yield from quad.args
+    if block.terminator.value is not None:
+        yield block.terminator.value
+
+
+def replace_operands(block: Block, mapping: dict[Temp, Operand]) -> int:
+    """按 mapping 替换块中读取的临时变量，返回替换的次数"""
+    replaced = 0
+    for quad in block.quads:
+        for i, operand in enumerate(quad.args):
+            if isinstance(operand, Temp) and operand in mapping:
+                quad.args[i] = mapping[operand]
+                replaced += 1
+    value = block.terminator.value
+    if isinstance(value, Temp) and value in mapping:
+        block.terminator.value = mapping[value]
+        replaced += 1
+    return replaced
+
+
+# 默认内联的函数体大小上限：中间表示的指令数与基本块数之和
+INLINE_THRESHOLD = 24
+
+
+@dataclass
+class Module:
+    image: Image  # 构造中间表示的栈式镜像，提供数据段、符号表与入口
+    functions: list[Function] = field(default_factory=list)
+    inline_threshold: int = INLINE_THRESHOLD
+
+    def __str__(self) -> str:
+        return "\n".join(map(str, self.functions))
+
+
+# 按操作码查找指令，比构造枚举快
+INSTRUCTIONS = {instruction.value: instruction for instruction in Instruction}
+LOAD_OPCODES = frozenset({Instruction.LI.value, Instruction.LC.value, Instruction.LLI.value, Instruction.LGI.value})
+STORE_OPCODES = frozenset({Instruction.SI.value, Instruction.SC.value, Instruction.SLI.value})
+
+
+class Builder:
+    """模拟表达式栈，把栈式代码还原为各函数的基本块。
+
+    表达式栈中的每一项记录压栈的位置与读取它的指令。只在同一基本块中使用的项直接作为操作数；
+    跨越基本块边界的项（如 a + (b || c) 中的 a）仍留在虚拟机的栈上，在压栈处插入 push，
+    读取处的操作数改为 STACKED
+    """
+
+    def __init__(self, image: Image):
+        if image.instruction_set != InstructionSet.STACK:
+            raise ValueError("image is not stack machine code")
+        self.image = image
+        self.flow = StackFlow(image)
+        self.module = Module(image)
+        self.names = {
+            value // SLOT_BYTES: name
+            for _, name, _, _, _, value, relocation in image.symbols
+            if relocation == Relocation.TEXT.value
+        }
+        # 跳转目标处的表达式栈与传递 ax 的临时变量
+        self.snapshots: dict[int, list[Entry]] = {}
+        self.merges: dict[int, Temp] = {}
+        self.merge_temps: set[Temp] = set()
+        # 各次压栈插入 push 的位置 (块, 指令下标) 与读取处 (指令, 操作数下标)
+        self.pushes: list[tuple[Block, int]] = []
+        self.consumers: dict[int, tuple[Quad, int]] = {}
+        self.stacked: set[int] = set()  # 跨越基本块边界的压栈
+
+    def variable(self, address: Optional[Operand], index: int, char: bool = False) -> Var:
+        if isinstance(address, Frame):
+            return Var(True, address.offset, char=char)
+        if isinstance(address, Const) and (address.relocation == Relocation.DATA.value or address.external is not None):
+            return Var(False, address.value, address.external, char)
+        raise ValueError(f"unsupported memory access at {index}")
+
+    def end_block(self, entries: list[Entry]):
+        self.stacked.update(push for _, push in entries)
+
+    def pop(self, entries: list[Entry], quad: Quad, arg: int) -> Operand:
+        operand, push = entries.pop()
+        self.consumers[push] = (quad, arg)
+        return operand
+
+    def leave(
+        self, function: Function, block: Block, position: int, entries: list[Entry], ax: Optional[Operand]
+    ) -> Optional[Operand]:
+        """从 block 跳到 position 处的块：记录表达式栈，ax 仍会被读取时写入传递用的临时变量，返回此后 ax 中的值"""
+        snapshot = self.snapshots.setdefault(position, list(entries))
+        if snapshot != entries:
+            raise ValueError(f"different expression stacks reach {self.flow.ops[position].index}")
+        self.end_block(entries)
+        if not self.flow.live[position]:
+            return ax
+        if ax is None:
+            raise ValueError(f"ax is read before it is set at {self.flow.ops[position].index}")
+        if position not in self.merges:
+            self.merges[position] = function.new_temp()
+            self.merge_temps.add(self.merges[position])
+        merge = self.merges[position]
+        last = block.quads[-1] if block.quads else None
+        if (
+            last is not None
+            and last.dest == ax
+            and all(operand != ax for operand, _ in entries)
+            and ax not in self.merge_temps
+        ):
+            # ax 刚由块中最后一条指令算出，直接改为写入传递用的临时变量
+            last.dest = merge
+        else:
+            block.quads.append(Quad("move", merge, [ax]))
+        return merge
+
+    def insert_pushes(self):
+        """在跨越基本块边界的压栈处插入 push，读取处改为 STACKED"""
+        for push in sorted(self.stacked, reverse=True):
+            block, index = self.pushes[push]
+            quad, arg = self.consumers[push]
+            operand = quad.args[arg] if arg < len(quad.args) else quad.var.address()  # type: ignore
+            block.quads.insert(index, Quad("push", args=[operand]))
+            if arg < len(quad.args):
+                quad.args[arg] = STACKED
+            else:
+                quad.args.append(STACKED)
+
+    def build(self) -> Module:
+        flow = self.flow
+        ops = flow.ops
+        function: Optional[Function] = None
+        block: Optional[Block] = None
+        entries: list[Entry] = []
+        ax: Optional[Operand] = None
+        consumed = set()
+        for position in sorted(flow.depths):
+            if position in consumed:
+                continue
+            op = ops[position]
+            opcode = op.opcode
+            instruction = INSTRUCTIONS[opcode]
+            if instruction is Instruction.ENT:
+                function = Function(op.index, op.operand, self.names.get(op.index))  # type: ignore
+                self.module.functions.append(function)
+                block = function.blocks[position] = Block(position)
+                entries, ax = [], None
+                continue
+            if function is None:
+                raise ValueError(f"code outside of a function at {op.index}")
+            if block is not None and position in flow.labels:
+                # 顺序执行进入跳转目标
+                self.leave(function, block, position, entries, ax)
+                block.terminator = Terminator("jump", targets=[position])
+                block = None
+            if block is None:
+                if position in flow.labels:
+                    if position not in self.snapshots and flow.depths[position] > 0:
+                        raise ValueError(f"expression stack at {op.index} is unknown")
+                    entries = list(self.snapshots.get(position, []))
+                    if flow.live[position]:
+                        if position not in self.merges:
+                            self.merges[position] = function.new_temp()
+                            self.merge_temps.add(self.merges[position])
+                        ax = self.merges[position]
+                    else:
+                        ax = None
+                block = function.blocks[position] = Block(position)
+
+            if instruction is Instruction.LEA:
+                ax = Frame(op.operand)  # type: ignore
+            elif instruction is Instruction.IMM:
+                ax = Const(op.operand, op.relocation, op.external)  # type: ignore
+            elif opcode in LOAD_OPCODES:
+                if instruction in (Instruction.LI, Instruction.LC):
+                    var = self.variable(ax, op.index, instruction is Instruction.LC)
+                elif instruction is Instruction.LLI:
+                    var = Var(True, op.operand)  # type: ignore
+                else:
+                    var = self.variable(Const(op.operand, op.relocation, op.external), op.index)  # type: ignore
+                ax = function.new_temp()
+                block.quads.append(Quad("load", ax, var=var))
+            elif instruction is Instruction.PUSH:
+                if ax is None:
+                    raise ValueError(f"ax is read before it is set at {op.index}")
+                entries.append((ax, len(self.pushes)))
+                self.pushes.append((block, len(block.quads)))
+            elif opcode in STORE_OPCODES:
+                if ax is None:
+                    raise ValueError(f"ax is read before it is set at {op.index}")
+                quad = Quad("store", args=[ax])
+                if instruction is Instruction.SLI:
+                    quad.var = Var(True, op.operand)  # type: ignore
+                else:
+                    # 地址跨越基本块边界时作为第二个操作数
+                    quad.var = self.variable(self.pop(entries, quad, 1), op.index, instruction is Instruction.SC)
+                block.quads.append(quad)
+                if quad.var.char:
+                    # SC 之后 ax 为截断后的值，即该变量的新值
+                    ax = function.new_temp()
+                    block.quads.append(Quad("load", ax, var=quad.var))
+            elif instruction is Instruction.ADDI or opcode in BINARY_OPCODES:
+                if ax is None:
+                    raise ValueError(f"ax is read before it is set at {op.index}")
+                quad = Quad("binary", function.new_temp(), [ax, ax], opcode)
+                if instruction is Instruction.ADDI:
+                    quad.opcode = Instruction.ADD.value
+                    quad.args[1] = Const(op.operand, op.relocation, op.external)  # type: ignore
+                else:
+                    quad.args[0] = self.pop(entries, quad, 0)
+                block.quads.append(quad)
+                ax = quad.dest
+            elif instruction is Instruction.CALL or opcode in SYSTEM_OPCODES:
+                num_args = flow.num_args(position)
+                if num_args is not None:
+                    consumed.add(position + 1)
+                num_args = num_args or 0
+                if num_args > len(entries):
+                    raise ValueError(f"stack underflow at {op.index}")
+                if instruction is Instruction.CALL:
+                    target = Const(op.operand, op.relocation, op.external)  # type: ignore
+                    quad = Quad("call", function.new_temp(), [None] * num_args, target=target)  # type: ignore
+                else:
+                    quad = Quad("sys", function.new_temp(), [None] * num_args, opcode)  # type: ignore
+                for i in reversed(range(num_args)):
+                    quad.args[i] = self.pop(entries, quad, i)
+                block.quads.append(quad)
+                ax = quad.dest
+            elif instruction is Instruction.LEV:
+                block.terminator = Terminator("return", ax)
+                self.end_block(entries)
+                block = None
+            elif instruction is Instruction.JMP:
+                target = flow.target(position)
+                self.leave(function, block, target, entries, ax)
+                block.terminator = Terminator("jump", targets=[target])
+                block = None
+            elif instruction is Instruction.JZ or instruction is Instruction.JNZ:
+                if ax is None:
+                    raise ValueError(f"ax is read before it is set at {op.index}")
+                target = flow.target(position)
+                following = position + 1
+                ax = self.leave(function, block, target, entries, ax)
+                if following in flow.labels:
+                    ax = self.leave(function, block, following, entries, ax)
+                targets = [following, target] if instruction is Instruction.JZ else [target, following]
+                block.terminator = Terminator("branch", ax, targets)
+                # 不跳转时带着当前的表达式栈与 ax 进入下一个块
+                self.end_block(entries)
+                block = None
+            else:
+                # 除调用之后的 ADJ 外，代码生成不会单独弹出表达式栈
+                raise ValueError(f"cannot build IR for {instruction.name} at {op.index}")
+        self.insert_pushes()
+        return self.module
+
+
+def build_module(image: Image) -> Module:
+    """由栈式镜像构造中间表示"""
+    return Builder(image).build()
+
+
+def reachable_blocks(function: Function) -> set[int]:
+    reachable = set()
+    worklist = [function.entry]
+    while worklist:
+        block_id = worklist.pop()
+        if block_id in reachable or block_id not in function.blocks:
+            continue
+        reachable.add(block_id)
+        worklist += function.blocks[block_id].successors
+    return reachable
+
+
+def remove_unreachable_blocks(function: Function) -> int:
+    reachable = reachable_blocks(function)
+    removed = [block_id for block_id in function.blocks if block_id not in reachable]
+    for block_id in removed:
+        del function.blocks[block_id]
+    return len(removed)
+
+
+# 变量的已知值：常量，或与另一个变量的当前值相等
+Fact = Union[Const, Var]
+
+
+def fold_binary(quad: Quad, lhs: Operand, rhs: Operand) -> Optional[Const]:
+    """两个操作数都是普通常量时在编译期计算二元运算，不能折叠时返回 None"""
+    if not (isinstance(lhs, Const) and isinstance(rhs, Const) and lhs.plain and rhs.plain):
+        return None
+    instruction = Instruction(quad.opcode)
+    if instruction not in CONSTANT_OPERATIONS and instruction not in (Instruction.DIV, Instruction.MOD):
+        return None
+    value = fold_constant(instruction, lhs.value, rhs.value)
+    return None if value is None else Const(value)
+
+
+class CopyPropagation:
+    """常量与复写传播：
+
+    - 变量赋值为常量或另一个变量的值后，沿所有路径都成立时读取该变量改为使用常量或读取另一个变量
+    - 常量之间的运算在编译期折叠，赋值为常量的临时变量直接替换为常量
+    - 条件为常量的分支改为无条件跳转
+    """
+
+    def __init__(self, function: Function):
+        self.function = function
+        self.changes = 0
+
+    @staticmethod
+    def kill(facts: dict[Var, Fact], var: Var):
+        facts.pop(var, None)
+        for key in [key for key, value in facts.items() if value == var]:
+            del facts[key]
+
+    @staticmethod
+    def kill_globals(facts: dict[Var, Fact]):
+        """调用可能改写全局变量"""
+        for key, value in list(facts.items()):
+            if not key.local or (isinstance(value, Var) and not value.local):
+                del facts[key]
+
+    def transfer(self, block: Block, facts: dict[Var, Fact], rewrite: bool) -> dict[Var, Fact]:
+        facts = dict(facts)
+        # 读取自变量且该变量此后未被改写的临时变量
+        sources: dict[Temp, Var] = {}
+        # 块内已知为常量的临时变量，常量运算的结果随之折叠，一遍即可传播整条常量赋值链
+        constants: dict[Temp, Const] = {}
+        for i, quad in enumerate(block.quads):
+            if quad.dest is not None:
+                constants.pop(quad.dest, None)
+            if quad.kind == "load":
+                known = facts.get(quad.var)  # type: ignore
+                if isinstance(known, Const):
+                    if rewrite:
+                        block.quads[i] = Quad("move", quad.dest, [known])
+                        self.changes += 1
+                    constants[quad.dest] = known  # type: ignore
+                    continue
+                if isinstance(known, Var):
+                    if rewrite:
+                        quad.var = known
+                        self.changes += 1
+                    sources[quad.dest] = known  # type: ignore
+                else:
+                    sources[quad.dest] = quad.var  # type: ignore
+            elif quad.kind == "store":
+                var = quad.var
+                assert var is not None
+                self.kill(facts, var)
+                for temp in [temp for temp, source in sources.items() if source == var]:
+                    del sources[temp]
+                value = quad.args[0]
+                value = constants.get(value, value) if isinstance(value, Temp) else value
+                if isinstance(value, Const) and value.plain:
+                    facts[var] = Const(var.wrap(value.value))
+                elif isinstance(value, Temp) and value in sources and sources[value] != var:
+                    facts[var] = sources[value]
+            elif quad.kind in ("call", "sys"):
+                self.kill_globals(facts)
+                for temp in [temp for temp, source in sources.items() if not source.local]:
+                    del sources[temp]
+            elif quad.kind == "move":
+                value = quad.args[0]
+                if isinstance(value, Temp) and value in sources:
+                    sources[quad.dest] = sources[value]  # type: ignore
+                value = constants.get(value, value) if isinstance(value, Temp) else value
+                if isinstance(value, Const) and value.plain:
+                    constants[quad.dest] = value  # type: ignore
+            elif quad.kind == "binary":
+                lhs, rhs = (constants.get(arg, arg) if isinstance(arg, Temp) else arg for arg in quad.args)
+                if (value := fold_binary(quad, lhs, rhs)) is not None:
+                    constants[quad.dest] = value  # type: ignore
+        return facts
+
+    def propagate_facts(self):
+        function = self.function
+        predecessors = function.predecessors()
+        # 条件已折叠的分支不再到达的块不参与合并
+        reachable = reachable_blocks(function)
+        facts_in: dict[int, dict[Var, Fact]] = {}
+        facts_out: dict[int, Optional[dict[Var, Fact]]] = {block_id: None for block_id in function.blocks}
+        changed = True
+        while changed:
+            changed = False
+            for block_id, block in function.blocks.items():
+                if block_id not in reachable:
+                    continue
+                if block_id == function.entry:
+                    facts: dict[Var, Fact] = {}
+                else:
+                    # 沿所有已分析的前驱都成立的事实，尚未分析的前驱视为不加限制
+                    known = [facts_out[p] for p in predecessors[block_id] if facts_out[p] is not None]
+                    facts = dict(known[0]) if known else {}
+                    for other in known[1:]:
+                        facts = {key: value for key, value in facts.items() if other.get(key) == value}  # type: ignore
+                facts_in[block_id] = facts
+                out = self.transfer(block, facts, rewrite=False)
+                if out != facts_out[block_id]:
+                    facts_out[block_id] = out
+                    changed = True
+        for block_id in reachable:
+            self.transfer(function.blocks[block_id], facts_in[block_id], rewrite=True)
+
+    def fold(self) -> bool:
+        """折叠常量运算并替换只赋值一次的常量临时变量，返回是否有变化"""
+        function = self.function
+        definitions = function.definitions()
+        constants: dict[Temp, Operand] = {}
+        for block in function.blocks.values():
+            for i, quad in enumerate(block.quads):
+                if quad.kind == "binary" and (value := fold_binary(quad, *quad.args)) is not None:
+                    block.quads[i] = quad = Quad("move", quad.dest, [value])
+                    self.changes += 1
+                if (
+                    quad.kind == "move"
+                    and definitions.get(quad.dest) == 1  # type: ignore
+                    and isinstance(quad.args[0], (Const, Frame))
+                ):
+                    constants[quad.dest] = quad.args[0]  # type: ignore
+        changed = False
+        for block in function.blocks.values():
+            if replace_operands(block, constants):
+                changed = True
+            block.quads = [quad for quad in block.quads if not (quad.kind == "move" and quad.dest in constants)]
+            terminator = block.terminator
+            if terminator.kind == "branch" and isinstance(terminator.value, Const) and terminator.value.plain:
+                target = terminator.targets[0] if terminator.value.value != 0 else terminator.targets[1]
+                block.terminator = Terminator("jump", targets=[target])
+                self.changes += 1
+                changed = True
+        self.changes += len(constants)
+        return changed or bool(constants)
+
+    def run(self) -> int:
+        changed = True
+        while changed:
+            self.propagate_facts()
+            changed = self.fold()
+        return self.changes
+
+
+def propagate_copies(function: Function) -> int:
+    return CopyPropagation(function).run()
+
+
+def live_locals(function: Function) -> dict[int, set[Var]]:
+    """各块入口处之后还会被读取的局部变量：逆向数据流分析直到不动点，函数返回后局部变量都不再被读取"""
+    live_in: dict[int, set[Var]] = {block_id: set() for block_id in function.blocks}
+    blocks = list(function.blocks.values())
+    changed = True
+    while changed:
+        changed = False
+        for block in reversed(blocks):
+            live = set().union(*(live_in.get(successor, set()) for successor in block.successors))
+            for quad in reversed(block.quads):
+                if quad.kind == "store" and quad.var.local:  # type: ignore
+                    live.discard(quad.var)  # type: ignore
+                elif quad.kind == "load" and quad.var.local:  # type: ignore
+                    live.add(quad.var)  # type: ignore
+            if live != live_in[block.id]:
+                live_in[block.id] = live
+                changed = True
+    return live_in
+
+
+def eliminate_dead_stores(function: Function) -> int:
+    """删除之后不会再被读取的局部变量赋值，以及结果不被使用且没有副作用的指令"""
+    removed = 0
+    live_in = live_locals(function)
+    blocks = list(function.blocks.values())
+    for block in blocks:
+        live = set().union(*(live_in.get(successor, set()) for successor in block.successors))
+        quads = []
+        for quad in reversed(block.quads):
+            if quad.kind == "store" and quad.var.local:  # type: ignore
+                if quad.var not in live and STACKED not in quad.args:
+                    removed += 1
+                    continue
+                live.discard(quad.var)  # type: ignore
+            elif quad.kind == "load" and quad.var.local:  # type: ignore
+                live.add(quad.var)  # type: ignore
+            quads.append(quad)
+        block.quads = quads[::-1]
+
+    # 结果不被使用的临时变量，删除后其操作数可能也不再被使用
+    changed = True
+    while changed:
+        uses = function.uses()
+        changed = False
+        for block in blocks:
+            quads = [quad for quad in block.quads if not (quad.pure and uses.get(quad.dest, 0) == 0)]  # type: ignore
+            if len(quads) != len(block.quads):
+                removed += len(block.quads) - len(quads)
+                block.quads = quads
+                changed = True
+    return removed
+
+
+def immediate_dominators(function: Function) -> dict[int, int]:
+    """各可达块的直接支配者（入口为其自身），按逆后序排列；
+    按逆后序迭代直到不动点（Cooper、Harvey 与 Kennedy 的算法）"""
+    entry = function.entry
+    postorder: list[int] = []
+    visited = {entry}
+    stack = [(entry, iter(function.blocks[entry].successors))]
+    while stack:
+        block_id, successors = stack[-1]
+        successor = next(successors, None)
+        if successor is None:
+            postorder.append(block_id)
+            stack.pop()
+        elif successor not in visited and successor in function.blocks:
+            visited.add(successor)
+            stack.append((successor, iter(function.blocks[successor].successors)))
+    index = {block_id: i for i, block_id in enumerate(postorder)}
+    predecessors = function.predecessors()
+    idom = {entry: entry}
+
+    def intersect(a: int, b: int) -> int:
+        while a != b:
+            while index[a] < index[b]:
+                a = idom[a]
+            while index[b] < index[a]:
+                b = idom[b]
+        return a
+
+    changed = True
+    while changed:
+        changed = False
+        for block_id in reversed(postorder[:-1]):
+            dominator = None
+            for p in predecessors[block_id]:
+                if p in idom:
+                    dominator = p if dominator is None else intersect(p, dominator)
+            if idom.get(block_id) != dominator:
+                idom[block_id] = dominator  # type: ignore
+                changed = True
+    return idom
+
+
+@dataclass
+class Loop:
+    """自然循环：header 支配循环中的所有块，latches 为跳回 header 的块"""
+
+    header: int
+    blocks: set[int]
+    latches: list[int]
+
+
+def find_loops(function: Function) -> list[Loop]:
+    """找出各自然循环，同一 header 的回边合并为一个循环，块数少的（内层循环）在前"""
+    idom = immediate_dominators(function)
+    rank = {block_id: i for i, block_id in enumerate(idom)}
+    predecessors = function.predecessors()
+    loops: dict[int, Loop] = {}
+    for block_id in idom:
+        for header in function.blocks[block_id].successors:
+            # 跳到支配自身的块是回边，回边在逆后序中不会向后跳
+            if header not in rank or rank[header] > rank[block_id]:
+                continue
+            dominator = block_id
+            while dominator != header and idom[dominator] != dominator:
+                dominator = idom[dominator]
+            if dominator != header:
+                continue
+            loop = loops.setdefault(header, Loop(header, {header}, []))
+            if block_id in loop.latches:
+                continue
+            loop.latches.append(block_id)
+            worklist = [block_id]
+            while worklist:
+                member = worklist.pop()
+                if member not in loop.blocks:
+                    loop.blocks.add(member)
+                    worklist += [p for p in predecessors[member] if p in idom]
+    return sorted(loops.values(), key=lambda loop: len(loop.blocks))
+
+
+def loop_preheader(function: Function, loop: Loop) -> Block:
+    """循环外进入 header 的唯一前驱，没有时在 header 之前新增一个"""
+    outside = [p for p in function.predecessors()[loop.header] if p not in loop.blocks]
+    if len(outside) == 1 and function.blocks[outside[0]].terminator.kind == "jump":
+        return function.blocks[outside[0]]
+    preheader = function.new_block(loop.header)
+    for block_id in outside:
+        targets = function.blocks[block_id].terminator.targets
+        targets[:] = [preheader.id if target == loop.header else target for target in targets]
+    return preheader
+
+
+def transform_loops(function: Function, transform: Callable[[Function, Loop], int]) -> int:
+    """由内向外对每个循环各调用一次 transform，有改动时重新找出循环"""
+    changes = 0
+    done: set[int] = set()
+    loops = find_loops(function)
+    while True:
+        loop = next((loop for loop in loops if loop.header not in done), None)
+        if loop is None:
+            return changes
+        # 旋转后循环体的第一个块成为新的 header，同样不再处理
+        done |= loop.blocks
+        changed = transform(function, loop)
+        if changed:
+            changes += changed
+            loops = find_loops(function)
+
+
+# 循环头中可以复制到各回边的指令数上限
+ROTATION_LIMIT = 8
+
+
+def rotate_loop(function: Function, loop: Loop) -> int:
+    """把 while 循环头中的条件判断复制到各回边末尾：回边直接按条件跳回循环体，
+    每次迭代省去一次跳回循环头的 JMP，原来的循环头只在进入循环前判断一次"""
+    header = function.blocks[loop.header]
+    terminator = header.terminator
+    if header.id == function.entry or terminator.kind != "branch" or len(header.quads) > ROTATION_LIMIT:
+        return 0
+    if sum(target in loop.blocks for target in terminator.targets) != 1:
+        return 0
+    if any(quad.kind not in ("move", "load", "binary") or STACKED in quad.args for quad in header.quads):
+        return 0
+    latches = [function.blocks[block_id] for block_id in loop.latches]
+    if any(latch.terminator.kind != "jump" for latch in latches):
+        return 0
+    # 循环头中算出的临时变量只在循环头中使用
+    local_uses: dict[Temp, int] = {}
+    for operand in block_operands(header):
+        if isinstance(operand, Temp):
+            local_uses[operand] = local_uses.get(operand, 0) + 1
+    uses = function.uses()
+    if any(uses.get(quad.dest, 0) != local_uses.get(quad.dest, 0) for quad in header.quads):  # type: ignore
+        return 0
+
+    for latch in latches:
+        renamed: dict[Temp, Operand] = {}
+        for quad in header.quads:
+            args = [renamed.get(arg, arg) if isinstance(arg, Temp) else arg for arg in quad.args]
+            copy = Quad(quad.kind, function.new_temp(), args, quad.opcode, quad.var, quad.target)
+            renamed[quad.dest] = copy.dest  # type: ignore
+            latch.quads.append(copy)
+        value = terminator.value
+        if isinstance(value, Temp):
+            value = renamed.get(value, value)
+        latch.terminator = Terminator("branch", value, list(terminator.targets))
+    return 1
+
+
+def rotate_loops(function: Function) -> int:
+    return transform_loops(function, rotate_loop)
+
+
+def hoist_loop_invariants(function: Function, loop: Loop) -> int:
+    """把每次迭代结果都相同的运算移到循环之前的前置块中计算一次"""
+    blocks = [block for block_id, block in function.blocks.items() if block_id in loop.blocks]
+    quads = [quad for block in blocks for quad in block.quads]
+    stored = {quad.var for quad in quads if quad.kind == "store"}
+    calls = any(quad.kind in ("call", "sys") for quad in quads)
+    defined = {quad.dest for quad in quads if quad.dest is not None}
+    definitions = function.definitions()
+    invariant: dict[Temp, Quad] = {}
+
+    def is_invariant(quad: Quad) -> bool:
+        if quad.dest is None or quad.dest in invariant or definitions[quad.dest] != 1:
+            return False
+        if quad.kind == "load":
+            # 被调用的函数可能改写全局变量
+            return quad.var not in stored and (quad.var.local or not calls)  # type: ignore
+        if quad.kind != "binary" or STACKED in quad.args:
+            return False
+        rhs = quad.args[1]
+        if quad.opcode in (Instruction.DIV.value, Instruction.MOD.value) and not (
+            isinstance(rhs, Const) and rhs.plain and rhs.value not in (0, -1)
+        ):
+            # 提到循环之前后即使循环体不执行也会计算，不能引入除零
+            return False
+        return all(not isinstance(arg, Temp) or arg not in defined or arg in invariant for arg in quad.args)
+
+    changed = True
+    while changed:
+        changed = False
+        for quad in quads:
+            if is_invariant(quad):
+                invariant[quad.dest] = quad  # type: ignore
+                changed = True
+
+    # 单独的变量读取移出循环后仍要从槽位读回，没有收益，只移动运算及其操作数
+    hoisted: dict[Temp, Quad] = {}
+
+    def hoist(quad: Quad):
+        hoisted[quad.dest] = quad  # type: ignore
+        for arg in quad.args:
+            if arg in invariant and arg not in hoisted:
+                hoist(invariant[arg])  # type: ignore
+
+    for temp, quad in invariant.items():
+        if quad.kind == "binary" and temp not in hoisted:
+            hoist(quad)
+    if not hoisted:
+        return 0
+
+    preheader = loop_preheader(function, loop)
+    for block in blocks:
+        block.quads = [quad for quad in block.quads if quad.dest not in hoisted]
+    emitted: set[Temp] = set()
+
+    def emit(quad: Quad):
+        # 先算出操作数
+        for arg in quad.args:
+            if arg in hoisted and arg not in emitted:
+                emit(hoisted[arg])  # type: ignore
+        emitted.add(quad.dest)  # type: ignore
+        preheader.quads.append(quad)
+
+    for quad in quads:
+        if quad.dest in hoisted and quad.dest not in emitted:
+            emit(quad)
+    return len(hoisted)
+
+
+def hoist_invariants(function: Function) -> int:
+    return transform_loops(function, hoist_loop_invariants)
+
+
+INT_MIN, INT_MAX = -(1 << 31), (1 << 31) - 1
+# 交换比较的两侧，以及条件取反后对应的比较
+SWAPPED_COMPARISONS = {
+    Instruction.LT.value: Instruction.GT.value,
+    Instruction.GT.value: Instruction.LT.value,
+    Instruction.LE.value: Instruction.GE.value,
+    Instruction.GE.value: Instruction.LE.value,
+}
+NEGATED_COMPARISONS = {
+    Instruction.LT.value: Instruction.GE.value,
+    Instruction.GE.value: Instruction.LT.value,
+    Instruction.LE.value: Instruction.GT.value,
+    Instruction.GT.value: Instruction.LE.value,
+}
+COMPARISONS = {
+    Instruction.EQ.value,
+    Instruction.NE.value,
+    Instruction.LT.value,
+    Instruction.GT.value,
+    Instruction.LE.value,
+    Instruction.GE.value,
+}
+
+
+def reduce_loop_strength(function: Function, loop: Loop) -> int:
+    """把归纳变量 i（循环中只有 i = i ± c 形式的赋值）与常量 k 的乘积 i * k 改为读取新增的局部变量 j，
+    j 在循环之前初始化为 i * k，每次改写 i 之后加上 c * k。
+
+    若 i 在循环中此外只与常量比较且循环结束后不再被读取，比较改为 j 与常量乘以 k 比较，
+    i 的赋值随之删除（归纳变量消除）。
+    j 与 i 一样是 int 局部变量，而乘积按 int64 计算，只有由 i 的初值、增量与循环出口的比较
+    能证明每个 i * k 都在 int 范围内时才削弱。
+    """
+    blocks = [block for block_id, block in function.blocks.items() if block_id in loop.blocks]
+    definitions = function.definitions()
+    uses = function.uses()
+    defs: dict[Temp, Quad] = {}
+    users: dict[Temp, Union[Quad, Terminator]] = {}
+    for block in blocks:
+        for quad in block.quads:
+            if quad.dest is not None:
+                defs[quad.dest] = quad
+            for arg in quad.args:
+                if isinstance(arg, Temp):
+                    users[arg] = quad
+        if isinstance(block.terminator.value, Temp):
+            users[block.terminator.value] = block.terminator
+
+    def loaded(operand: Operand, var: Var) -> bool:
+        """operand 是循环中只赋值、使用一次的对 var 的读取"""
+        quad = defs.get(operand) if isinstance(operand, Temp) else None
+        return (
+            quad is not None
+            and quad.kind == "load"
+            and quad.var == var
+            and definitions[operand] == 1  # type: ignore
+            and uses.get(operand) == 1  # type: ignore
+        )
+
+    def steps(var: Var) -> Optional[dict[int, int]]:
+        """var 在循环中每次赋值（按 id）的增量，不是归纳变量时返回 None"""
+        found = {}
+        for block in blocks:
+            current: set[Operand] = set()  # 本块中上一次赋值之后读取 var 的临时变量
+            for quad in block.quads:
+                if quad.kind == "load" and quad.var == var:
+                    current.add(quad.dest)  # type: ignore
+                if quad.kind != "store" or quad.var != var:
+                    continue
+                value = quad.args[0] if len(quad.args) == 1 else None
+                update = defs.get(value) if isinstance(value, Temp) else None
+                if update is None or update.kind != "binary":
+                    return None
+                if (definitions[value], uses[value]) != (1, 1):  # type: ignore
+                    return None
+                lhs, rhs = update.args
+                if update.opcode == Instruction.ADD.value and isinstance(lhs, Const):
+                    lhs, rhs = rhs, lhs
+                if update.opcode not in (Instruction.ADD.value, Instruction.SUB.value):
+                    return None
+                if lhs not in current or not loaded(lhs, var) or not isinstance(rhs, Const) or not rhs.plain:
+                    return None
+                found[id(quad)] = rhs.value if update.opcode == Instruction.ADD.value else -rhs.value
+                current = set()
+        return found or None
+
+    predecessors = function.predecessors()
+    inner_blocks: Optional[set[int]] = None
+
+    def initial(var: Var) -> Optional[int]:
+        """进入循环时 var 的值：沿循环外唯一的前驱链向前找到的最后一次常量赋值"""
+        outside = [p for p in predecessors[loop.header] if p not in loop.blocks]
+        seen: set[int] = set()
+        while len(outside) == 1 and outside[0] not in seen:
+            block = function.blocks[outside[0]]
+            seen.add(block.id)
+            for i in reversed(range(len(block.quads))):
+                quad = block.quads[i]
+                if quad.kind != "store" or quad.var != var:
+                    continue
+                value = quad.args[0] if len(quad.args) == 1 else None
+                if isinstance(value, Temp):
+                    # 同一块中先复制到临时变量的常量
+                    moves = [q for q in block.quads[:i] if q.dest == value]
+                    value = moves[-1].args[0] if moves and moves[-1].kind == "move" else None
+                return value.value if isinstance(value, Const) and value.plain else None
+            outside = predecessors[block.id]
+        return None
+
+    def exit_bound(var: Var) -> tuple[Optional[int], Optional[int]]:
+        """每轮循环都经过的出口比较（循环头或唯一的回边块中 var 与常量的比较）
+        给出的留在循环中时 var 的下界与上界"""
+        checks = [loop.header] + loop.latches if len(loop.latches) == 1 else [loop.header]
+        for block_id in checks:
+            block = function.blocks[block_id]
+            terminator = block.terminator
+            if terminator.kind != "branch" or not isinstance(terminator.value, Temp):
+                continue
+            inside = [target in loop.blocks for target in terminator.targets]
+            compare = next((quad for quad in block.quads if quad.dest == terminator.value), None)
+            if inside.count(True) != 1 or compare is None or compare.kind != "binary":
+                continue
+            lhs, rhs = compare.args
+            opcode: int = compare.opcode  # type: ignore
+            if opcode not in SWAPPED_COMPARISONS:
+                continue
+            if isinstance(lhs, Const):
+                lhs, rhs = rhs, lhs
+                opcode = SWAPPED_COMPARISONS[opcode]
+            loads = [i for i, quad in enumerate(block.quads) if quad.dest == lhs]
+            if len(loads) != 1 or block.quads[loads[0]].kind != "load" or block.quads[loads[0]].var != var:
+                continue
+            if not isinstance(rhs, Const) or not rhs.plain:
+                continue
+            # 比较读取的是本块中最后一次改写之后的 var
+            if any(quad.kind == "store" and quad.var == var for quad in block.quads[loads[0] :]):
+                continue
+            if not inside[0]:
+                opcode = NEGATED_COMPARISONS[opcode]
+            value = rhs.value
+            if opcode == Instruction.LT.value:
+                return None, value - 1
+            if opcode == Instruction.LE.value:
+                return None, value
+            if opcode == Instruction.GT.value:
+                return value + 1, None
+            return value, None
+        return None, None
+
+    def value_range(var: Var, stores: dict[int, int]) -> Optional[tuple[int, int]]:
+        """var 在循环中可能取到的值的范围，不能确定时返回 None"""
+        nonlocal inner_blocks
+        if inner_blocks is None:
+            # 内层循环中的赋值每轮可能执行多次
+            inner_blocks = set().union(*(other.blocks for other in find_loops(function) if other.blocks < loop.blocks))
+        for block in blocks:
+            if block.id in inner_blocks and any(id(quad) in stores for quad in block.quads):
+                return None
+        start = initial(var)
+        if start is None:
+            return None
+        lower, upper = exit_bound(var)
+        steps = list(stores.values())
+        # 每轮循环中每个赋值至多执行一次
+        if all(step > 0 for step in steps) and upper is not None:
+            return start, max(start, upper + sum(steps))
+        if all(step < 0 for step in steps) and lower is not None:
+            return min(start, lower + sum(steps)), start
+        return None
+
+    # 归纳变量与常量的乘积 (乘法, 读取归纳变量的临时变量, 乘数)，按变量分组
+    products: dict[Var, list[tuple[Quad, Temp, int]]] = {}
+    induction: dict[Var, Optional[dict[int, int]]] = {}
+    for block in blocks:
+        for quad in block.quads:
+            if quad.kind != "binary" or quad.opcode != Instruction.MUL.value:
+                continue
+            lhs, rhs = quad.args
+            if isinstance(lhs, Const):
+                lhs, rhs = rhs, lhs
+            if not isinstance(lhs, Temp) or lhs not in defs or not isinstance(rhs, Const) or not rhs.plain:
+                continue
+            var = defs[lhs].var
+            if var is None or not var.local or var.char or not loaded(lhs, var) or rhs.value == 0:
+                continue
+            if var not in induction:
+                induction[var] = steps(var)
+            if induction[var] is not None:
+                products.setdefault(var, []).append((quad, lhs, rhs.value))
+
+    live_in: Optional[dict[int, set[Var]]] = None
+    exits = {target for block in blocks for target in block.successors if target not in loop.blocks}
+    changes = 0
+    for var, found in products.items():
+        stores: dict[int, int] = induction[var]  # type: ignore
+        span = value_range(var, stores)
+        if span is None:
+            continue
+        # j 只能保存 int 范围内的乘积
+        found = [product for product in found if all(INT_MIN <= value * product[2] <= INT_MAX for value in span)]
+        if not found:
+            continue
+        factors = sorted({factor for _, _, factor in found})
+        # 只有一种正的乘数时尝试消除 i：i 的每次读取都是乘积、自身的增量或与常量的比较
+        comparisons: list[tuple[Quad, Temp]] = []
+        increments: set[int] = set()
+        eliminate = len(factors) == 1 and factors[0] > 0
+        multiplied = {temp for _, temp, _ in found}
+        for block in blocks:
+            for quad in block.quads:
+                if not eliminate or quad.kind != "load" or quad.var != var or quad.dest in multiplied:
+                    continue
+                user = users.get(quad.dest)  # type: ignore
+                if not loaded(quad.dest, var) or not isinstance(user, Quad):  # type: ignore
+                    eliminate = False
+                elif user.kind == "binary" and id(users.get(user.dest)) in stores:  # type: ignore
+                    increments |= {id(quad), id(user)}
+                elif (
+                    user.kind == "binary"
+                    and user.opcode in COMPARISONS
+                    and any(isinstance(arg, Const) for arg in user.args)
+                    and all(
+                        arg.plain and abs(arg.value * factors[0]) < 1 << 31
+                        for arg in user.args
+                        if isinstance(arg, Const)
+                    )
+                ):
+                    comparisons.append((user, quad.dest))  # type: ignore
+                else:
+                    eliminate = False
+        if eliminate:
+            if live_in is None:
+                live_in = live_locals(function)
+            eliminate = all(var not in live_in[target] for target in exits)
+        if not eliminate:
+            # 不能消除 i 时每次改写 i 都要同时更新 j，只削弱乘积多于赋值的乘数
+            counts = {factor: sum(other == factor for _, _, other in found) for factor in factors}
+            factors = [factor for factor in factors if counts[factor] > len(stores)]
+            found = [product for product in found if product[2] in factors]
+            comparisons = []
+            if not factors:
+                continue
+
+        preheader = loop_preheader(function, loop)
+        reduced: dict[int, Var] = {}
+        for factor in factors:
+            reduced[factor] = function.new_local()
+            start, product = function.new_temp(), function.new_temp()
+            preheader.quads += [
+                Quad("load", start, var=var),
+                Quad("binary", product, [start, Const(factor)], Instruction.MUL.value),
+                Quad("store", args=[product], var=reduced[factor]),
+            ]
+        # 读取 i 改为读取 j，乘积改为复制
+        rewritten: dict[int, Quad] = {}
+        for quad, temp, factor in found:
+            rewritten[id(defs[temp])] = Quad("load", temp, var=reduced[factor])
+            rewritten[id(quad)] = Quad("move", quad.dest, [temp])
+            changes += 1
+        for quad, temp in comparisons:
+            rewritten[id(defs[temp])] = Quad("load", temp, var=reduced[factors[0]])
+            quad.args = [Const(arg.value * factors[0]) if isinstance(arg, Const) else arg for arg in quad.args]
+            changes += 1
+        for block in blocks:
+            quads = []
+            for quad in block.quads:
+                if eliminate and id(quad) in increments:
+                    continue
+                if id(quad) not in stores:
+                    quads.append(rewritten.get(id(quad), quad))
+                    continue
+                if not eliminate:
+                    quads.append(quad)
+                for factor, local in reduced.items():
+                    current, updated = function.new_temp(), function.new_temp()
+                    step = Const(wrap_int64(stores[id(quad)] * factor))
+                    quads += [
+                        Quad("load", current, var=local),
+                        Quad("binary", updated, [current, step], Instruction.ADD.value),
+                        Quad("store", args=[updated], var=local),
+                    ]
+            block.quads = quads
+    return changes
+
+
+def reduce_strength(function: Function) -> int:
+    return transform_loops(function, reduce_loop_strength)
+
+
+def parameter(index: int, num_args: int) -> Var:
+    """n 个实参中第 index 个对应的参数：实参依次压栈，之后是返回地址与调用者的 bp"""
+    return Var(True, num_args + 1 - index)
+
+
+def takes_arguments(function: Function, num_args: int) -> bool:
+    """函数读写的参数都在 num_args 个实参之内"""
+    for block in function.blocks.values():
+        for operand in block_operands(block):
+            if isinstance(operand, Frame) and operand.offset > num_args + 1:
+                return False
+        for quad in block.quads:
+            if quad.var is not None and quad.var.local and quad.var.offset > num_args + 1:
+                return False
+    return True
+
+
+def eliminate_tail_calls(function: Function) -> int:
+    """把 return f(...) 中对自身的调用改为把实参存入参数后跳回入口块（在 ENT 之后），
+    复用当前的栈帧，递归变为循环"""
+    start = Const(function.start * SLOT_BYTES, Relocation.TEXT.value)
+    uses: Optional[dict[Temp, int]] = None
+    eliminated = 0
+    for block in function.blocks.values():
+        call = block.quads[-1] if block.quads else None
+        terminator = block.terminator
+        if call is None or call.kind != "call" or call.target != start or STACKED in call.args:
+            continue
+        if terminator.kind != "return" or terminator.value != call.dest:
+            continue
+        if uses is None:
+            uses = function.uses()
+        if uses[call.dest] != 1:  # type: ignore
+            continue
+        num_args = len(call.args)
+        if not takes_arguments(function, num_args):
+            continue
+        quads = block.quads[:-1]
+        # 实参算出后若之后不再读写对应的参数，紧接着存入，降级时与实参的表达式拼在一起
+        stores = [Quad("store", args=[arg], var=parameter(i, num_args)) for i, arg in enumerate(call.args)]
+        defined = {quad.dest: position for position, quad in enumerate(quads) if quad.dest is not None}
+        placed: dict[int, Quad] = {}
+        for store in stores:
+            position = defined.get(store.args[0], -1)  # type: ignore
+            if position >= 0 and all(quad.var != store.var for quad in quads[position + 1 :]):
+                placed[position] = store
+        block.quads = []
+        for position, quad in enumerate(quads):
+            block.quads.append(quad)
+            if position in placed:
+                block.quads.append(placed[position])
+        late = {id(store) for store in stores} - {id(store) for store in placed.values()}
+        block.quads += [store for store in stores if id(store) in late]
+        block.terminator = Terminator("jump", targets=[function.entry])
+        eliminated += 1
+    return eliminated
+
+
+class Inliner:
+    """把对小的非递归函数的调用替换为函数体的副本：参数与局部变量改为调用者栈帧中新增的局部变量，
+    实参在调用处存入参数，return 改为把返回值赋给调用结果后跳到调用之后继续执行"""
+
+    def __init__(self, module: Module):
+        self.module = module
+        self.functions = {function.start * SLOT_BYTES: function for function in module.functions}
+        # 调用图中能回到自身的函数
+        callees = {function.start: {callee.start for callee in self.callees(function)} for function in module.functions}
+        self.recursive = set()
+        for start in callees:
+            seen: set[int] = set()
+            worklist = list(callees[start])
+            while worklist:
+                callee = worklist.pop()
+                if callee not in seen:
+                    seen.add(callee)
+                    worklist += callees.get(callee, ())
+            if start in seen:
+                self.recursive.add(start)
+
+    def callee(self, quad: Quad) -> Optional[Function]:
+        target = quad.target
+        if quad.kind != "call" or target is None or target.external is not None:
+            return None
+        if target.relocation != Relocation.TEXT.value:
+            return None
+        return self.functions.get(target.value)
+
+    def callees(self, function: Function) -> Iterator[Function]:
+        for block in function.blocks.values():
+            for quad in block.quads:
+                callee = self.callee(quad)
+                if callee is not None:
+                    yield callee
+
+    def inlinable(self, callee: Function, quad: Quad) -> bool:
+        if callee.start in self.recursive or STACKED in quad.args:
+            return False
+        if sum(len(block.quads) + 1 for block in callee.blocks.values()) > self.module.inline_threshold:
+            return False
+        return takes_arguments(callee, len(quad.args))
+
+    def inline(self, function: Function, block: Block, index: int, callee: Function) -> list[int]:
+        """把 block 中第 index 条指令的调用替换为 callee 的副本，返回新增的块"""
+        call = block.quads[index]
+        block_ids = iter(range(max(function.blocks) + 1, max(function.blocks) + len(callee.blocks) + 2))
+        copies = {block_id: next(block_ids) for block_id in callee.blocks}
+        after = Block(next(block_ids), block.quads[index + 1 :], block.terminator)
+        temps: dict[Temp, Temp] = {}
+        offsets: dict[int, int] = {}
+
+        def offset(value: int) -> int:
+            if value not in offsets:
+                offsets[value] = function.new_local().offset
+            return offsets[value]
+
+        def rename(operand: Operand) -> Operand:
+            if isinstance(operand, Temp):
+                if operand not in temps:
+                    temps[operand] = function.new_temp()
+                return temps[operand]
+            if isinstance(operand, Frame):
+                return Frame(offset(operand.offset))
+            return operand
+
+        def variable(var: Optional[Var]) -> Optional[Var]:
+            if var is None or not var.local:
+                return var
+            return Var(True, offset(var.offset), char=var.char)
+
+        num_args = len(call.args)
+        block.quads = block.quads[:index] + [
+            Quad("store", args=[arg], var=variable(parameter(i, num_args))) for i, arg in enumerate(call.args)
+        ]
+        block.terminator = Terminator("jump", targets=[copies[callee.entry]])
+        inlined = []
+        for original in callee.blocks.values():
+            copy = Block(copies[original.id])
+            for quad in original.quads:
+                dest = rename(quad.dest) if quad.dest is not None else None
+                args = [rename(arg) for arg in quad.args]
+                var = variable(quad.var)
+                copy.quads.append(Quad(quad.kind, dest, args, quad.opcode, var, quad.target))  # type: ignore
+            terminator = original.terminator
+            value = rename(terminator.value) if terminator.value is not None else None
+            if terminator.kind == "return":
+                if value is not None:
+                    copy.quads.append(Quad("move", call.dest, [value]))
+                copy.terminator = Terminator("jump", targets=[after.id])
+            else:
+                copy.terminator = Terminator(terminator.kind, value, [copies[target] for target in terminator.targets])
+            inlined.append(copy)
+        inlined.append(after)
+
+        blocks = {}
+        for block_id, other in function.blocks.items():
+            blocks[block_id] = other
+            if block_id == block.id:
+                blocks.update((new.id, new) for new in inlined)
+        function.blocks = blocks
+        return [new.id for new in inlined]
+
+    def run(self) -> int:
+        inlined = 0
+        for function in self.module.functions:
+            worklist = list(function.blocks)
+            while worklist:
+                block = function.blocks[worklist.pop(0)]
+                for index, quad in enumerate(block.quads):
+                    callee = self.callee(quad)
+                    if callee is not None and callee is not function and self.inlinable(callee, quad):
+                        # 调用之后的指令移到新的块中，与内联的函数体一起继续检查
+                        worklist[:0] = self.inline(function, block, index, callee)
+                        inlined += 1
+                        break
+        return inlined
+
+
+def inline_functions(module: Module) -> int:
+    return Inliner(module).run()
+
+
+def function_pass(transform: Callable[[Function], int]) -> Callable[[Module], int]:
+    """对每个函数分别运行的遍"""
+
+    def run(module: Module) -> int:
+        return sum(transform(function) for function in module.functions)
+
+    return run
+
+
+PASSES: dict[str, Callable[[Module], int]] = {
+    "tail-calls": function_pass(eliminate_tail_calls),
+    "inline": inline_functions,
+    "copy-propagation": function_pass(propagate_copies),
+    "loop-rotation": function_pass(rotate_loops),
+    "licm": function_pass(hoist_invariants),
+    "strength-reduction": function_pass(reduce_strength),
+    "dead-stores": function_pass(eliminate_dead_stores),
+    "unreachable-blocks": function_pass(remove_unreachable_blocks),
+}
+DEFAULT_PASSES = tuple(PASSES)
+
+
+@dataclass
+class LoweredOp:
+    opcode: int
+    operand: Optional[int] = None
+    relocation: Optional[int] = None
+    external: Optional[str] = None
+    block: Optional[tuple[int, int]] = None  # 跳转目标块：(函数在原代码段中的下标, 块)
+    function: Optional[int] = None  # 操作数为函数地址时，函数在原代码段中的下标
+
+    @property
+    def size(self) -> int:
+        return 1 if self.operand is None else 2
+
+
+# 不改变 ax 的指令
+AX_PRESERVING_OPCODES = frozenset(
+    {
+        Instruction.PUSH.value,
+        Instruction.SI.value,
+        Instruction.SLI.value,
+        Instruction.ADJ.value,
+        Instruction.JZ.value,
+        Instruction.JNZ.value,
+        Instruction.JMP.value,
+    }
+)
+
+
+class Lowering:
+    """把中间表示降级为栈式指令"""
+
+    def __init__(self, module: Module, superinstructions: bool = False):
+        self.module = module
+        self.superinstructions = superinstructions
+        self.out: list[LoweredOp] = []
+        self.function_starts: dict[int, int] = {}  # 函数在原代码段中的下标 -> 在 out 中的位置
+        self.block_starts: dict[tuple[int, int], int] = {}
+        self.ax: set[Operand] = set()  # 当前 ax 中的值
+
+    def emit(self, opcode: Instruction, operand: Optional[int] = None, **kwargs):
+        if opcode.value not in AX_PRESERVING_OPCODES:
+            self.ax = set()
+        self.out.append(LoweredOp(opcode.value, operand, **kwargs))
+
+    def jump(self, opcode: Instruction, block_id: int):
+        self.emit(opcode, 0, relocation=Relocation.TEXT.value, block=(self.function.start, block_id))
+
+    def lower_function(self, function: Function):
+        self.function = function
+        definitions = function.definitions()
+        uses = function.uses()
+        # 同一块中紧接着使用一次的临时变量拼回表达式树
+        self.trees: dict[Temp, Quad] = {}
+        self.roots: dict[int, list[Quad]] = {}
+        for block in function.blocks.values():
+            self.roots[block.id] = self.match_trees(block, definitions, uses)
+
+        # 块中最先求值的临时变量若由每个前驱在离开前最后算出，且此外只作为这些前驱的分支条件，
+        # 则留在 ax 中传递
+        block_ids = list(function.blocks)
+        predecessors = {block_id: set(blocks) for block_id, blocks in function.predecessors().items()}
+        self.carried: dict[int, Temp] = {}
+        carried_temps = set()
+        for block_id in block_ids:
+            first = self.first_leaf(function.blocks[block_id], uses)
+            preds = [function.blocks[p] for p in predecessors[block_id]]
+            if not isinstance(first, Temp) or first in self.trees or not preds:
+                continue
+            if not all(self.leaves_with(block, first) for block in preds):
+                continue
+            branches = sum(block.terminator.value == first for block in preds)
+            if definitions[first] == len(preds) and uses[first] == 1 + branches:
+                self.carried[block_id] = first
+                carried_temps.add(first)
+
+        # 其余的临时变量存入新增的局部变量槽位
+        self.slots: dict[Temp, int] = {}
+        for temp in sorted(set(definitions) | set(uses), key=lambda temp: temp.id):
+            if temp not in self.trees and temp not in carried_temps and uses.get(temp, 0) > 0:
+                self.slots[temp] = -(function.num_locals + len(self.slots) + 1)
+
+        self.function_starts[function.start] = len(self.out)
+        for i, block in enumerate(function.blocks.values()):
+            if i == 0:
+                self.emit(Instruction.ENT, function.num_locals + len(self.slots))
+            # 跳转到入口块时不再执行 ENT
+            self.block_starts[(function.start, block.id)] = len(self.out)
+            if block.id in self.carried:
+                self.ax = {self.carried[block.id]}
+            elif i == 0 or predecessors[block.id] != {block_ids[i - 1]}:
+                # 只从上一个块顺序执行到达时 ax 不变
+                self.ax = set()
+            for quad in self.roots[block.id]:
+                self.lower_root(quad, carried_temps)
+            following = block_ids[i + 1] if i + 1 < len(block_ids) else None
+            self.lower_terminator(block.terminator, following)
+
+    @staticmethod
+    def leaves_with(block: Block, temp: Temp) -> bool:
+        """块的最后一条指令算出 temp，之后 ax 不变地离开该块"""
+        if not block.quads or block.quads[-1].dest != temp:
+            return False
+        last = block.quads[-1]
+        terminator = block.terminator
+        if terminator.kind == "branch":
+            return terminator.value == temp or (last.kind == "move" and terminator.value == last.args[0])
+        return terminator.kind == "jump"
+
+    def first_leaf(self, block: Block, uses: dict[Temp, int]) -> Optional[Operand]:
+        """块中最先求值的操作数"""
+        roots = self.roots[block.id]
+        value = block.terminator.value
+        if roots or value in self.trees:
+            quad = roots[0] if roots else self.trees[value]  # type: ignore
+            if roots and quad.dest is not None and uses.get(quad.dest, 0) > 0 and not self.superinstructions:
+                # 结果可能存入槽位，先用 LEA 算出槽位地址
+                return None
+            while True:
+                if quad.kind == "store" and len(quad.args) == 1 and not self.stores_directly(quad.var):  # type: ignore
+                    return None
+                first = next((arg for arg in quad.args if arg != STACKED), None)
+                if quad.kind == "load" or first is None:
+                    return None
+                if isinstance(first, Temp) and first in self.trees:
+                    quad = self.trees[first]
+                    continue
+                return first
+        return value
+
+    def match_trees(self, block: Block, definitions: dict[Temp, int], uses: dict[Temp, int]) -> list[Quad]:
+        """从块尾逆序匹配：操作数恰好由紧邻其前的指令算出且只使用一次时作为子树，返回各棵树的根"""
+        quads = block.quads
+
+        def claim(operands: list[Operand], cursor: int) -> int:
+            for operand in reversed(operands):
+                if (
+                    isinstance(operand, Temp)
+                    and cursor >= 0
+                    and quads[cursor].dest == operand
+                    and quads[cursor].kind != "store"
+                    and definitions.get(operand) == 1
+                    and uses.get(operand) == 1
+                ):
+                    self.trees[operand] = quads[cursor]
+                    cursor = claim(quads[cursor].args, cursor - 1)
+            return cursor
+
+        value = block.terminator.value
+        cursor = claim([] if value is None else [value], len(quads) - 1)
+        roots = []
+        while cursor >= 0:
+            roots.append(quads[cursor])
+            cursor = claim(quads[cursor].args, cursor - 1)
+        return roots[::-1]
+
+    def stores_directly(self, var: Var) -> bool:
+        """不必先把地址压栈，用 SLI 直接存入"""
+        return var.local and not var.char and self.superinstructions
+
+    def lower_root(self, quad: Quad, carried: set[Temp]):
+        if quad.kind == "push":
+            self.lower_operand(quad.args[0])
+            self.emit(Instruction.PUSH)
+            return
+        if quad.kind == "store":
+            var = quad.var
+            assert var is not None
+            if len(quad.args) > 1:
+                self.lower_operand(quad.args[0])
+                self.emit(Instruction.SC if var.char else Instruction.SI)
+            elif self.stores_directly(var):
+                self.lower_operand(quad.args[0])
+                self.emit(Instruction.SLI, var.offset)
+            else:
+                self.lower_operand(var.address())
+                self.emit(Instruction.PUSH)
+                self.lower_operand(quad.args[0])
+                self.emit(Instruction.SC if var.char else Instruction.SI)
+            return
+        dest = quad.dest
+        if dest in self.slots:
+            slot = self.slots[dest]  # type: ignore
+            if self.superinstructions:
+                self.lower_expression(quad)
+                self.emit(Instruction.SLI, slot)
+            else:
+                self.emit(Instruction.LEA, slot)
+                self.emit(Instruction.PUSH)
+                self.lower_expression(quad)
+                self.emit(Instruction.SI)
+            self.ax = {dest}  # type: ignore
+        else:
+            self.lower_expression(quad)
+            if dest in carried:
+                self.ax = {dest, *quad.args[:1]} if quad.kind == "move" else {dest}  # type: ignore
+
+    def lower_expression(self, quad: Quad):
+        """求值 quad，结果留在 ax 中"""
+        if quad.kind == "move":
+            self.lower_operand(quad.args[0])
+        elif quad.kind == "load":
+            var = quad.var
+            assert var is not None
+            if var.char or not self.superinstructions:
+                self.lower_operand(var.address())
+                self.emit(Instruction.LC if var.char else Instruction.LI)
+            elif var.local:
+                self.emit(Instruction.LLI, var.offset)
+            else:
+                address: Const = var.address()  # type: ignore
+                self.emit(Instruction.LGI, address.value, relocation=address.relocation, external=address.external)
+        elif quad.kind == "binary":
+            lhs, rhs = quad.args
+            if lhs == STACKED:
+                self.lower_operand(rhs)
+                self.emit(Instruction(quad.opcode))
+                return
+            self.lower_operand(lhs)
+            if (
+                self.superinstructions
+                and quad.opcode in (Instruction.ADD.value, Instruction.SUB.value)
+                and isinstance(rhs, Const)
+                and rhs.plain
+            ):
+                value = rhs.value if quad.opcode == Instruction.ADD.value else wrap_int64(-rhs.value)
+                self.emit(Instruction.ADDI, value)
+                return
+            self.emit(Instruction.PUSH)
+            self.lower_operand(rhs)
+            self.emit(Instruction(quad.opcode))
+        else:
+            for arg in quad.args:
+                if arg != STACKED:
+                    self.lower_operand(arg)
+                    self.emit(Instruction.PUSH)
+            if quad.kind == "call":
+                target = quad.target
+                assert target is not None
+                self.lower_constant(Instruction.CALL, target)
+            else:
+                self.emit(Instruction(quad.opcode))
+            if quad.args:
+                self.emit(Instruction.ADJ, len(quad.args))
+
+    def lower_constant(self, opcode: Instruction, constant: Const):
+        function = None
+        if constant.relocation == Relocation.TEXT.value and constant.external is None:
+            function = constant.value // SLOT_BYTES
+        self.emit(opcode, constant.value, relocation=constant.relocation, external=constant.external, function=function)
+
+    def lower_operand(self, operand: Operand):
+        if operand in self.ax:
+            return
+        if isinstance(operand, Const):
+            self.lower_constant(Instruction.IMM, operand)
+        elif isinstance(operand, Frame):
+            self.emit(Instruction.LEA, operand.offset)
+        elif operand in self.trees:
+            self.lower_expression(self.trees[operand])
+        elif operand in self.slots:
+            slot = self.slots[operand]
+            if self.superinstructions:
+                self.emit(Instruction.LLI, slot)
+            else:
+                self.emit(Instruction.LEA, slot)
+                self.emit(Instruction.LI)
+        else:
+            raise ValueError(f"{operand} is not available in {self.function.name or self.function.start}")
+        self.ax = {operand}
+
+    def lower_terminator(self, terminator: Terminator, following: Optional[int]):
+        if terminator.kind == "jump":
+            if terminator.targets[0] != following:
+                self.jump(Instruction.JMP, terminator.targets[0])
+        elif terminator.kind == "branch":
+            nonzero, zero = terminator.targets
+            self.lower_operand(terminator.value)  # type: ignore
+            if zero == following:
+                self.jump(Instruction.JNZ, nonzero)
+            else:
+                self.jump(Instruction.JZ, zero)
+                if nonzero != following:
+                    self.jump(Instruction.JMP, nonzero)
+        else:
+            if terminator.value is not None:
+                self.lower_operand(terminator.value)
+            self.emit(Instruction.LEV)
+
+    def run(self) -> Image:
+        for function in self.module.functions:
+            self.lower_function(function)
+        return self.encode()
+
+    def encode(self) -> Image:
+        slots = []
+        num_slots = 0
+        for op in self.out:
+            slots.append(num_slots)
+            num_slots += op.size
+        function_offsets = {start: slots[i] * SLOT_BYTES for start, i in self.function_starts.items()}
+        starts = sorted(function_offsets)
+
+        def remap(offset: int) -> int:
+            """原代码段中的函数地址"""
+            index = offset // SLOT_BYTES
+            if index in function_offsets:
+                return function_offsets[index]
+            # 不是函数入口时映射到其后第一个函数
+            later = [start for start in starts if start >= index]
+            return function_offsets[later[0]] if later else num_slots * SLOT_BYTES
+
+        text = array("q")
+        relocations = array("q")
+        externals = []
+        for op in self.out:
+            text.append(op.opcode)
+            if op.operand is None:
+                continue
+            if op.relocation is not None:
+                relocations.append(len(text) << 1 | op.relocation)
+            if op.external is not None:
+                externals.append((len(text), op.external))
+            if op.block is not None:
+                text.append(slots[self.block_starts[op.block]] * SLOT_BYTES)
+            elif op.function is not None:
+                text.append(remap(op.operand))
+            else:
+                text.append(op.operand)
+
+        image = self.module.image
+        symbols: list[SymbolRecord] = [
+            (key, name, cls, data_type, level, remap(value), relocation)
+            if relocation == Relocation.TEXT.value
+            else (key, name, cls, data_type, level, value, relocation)
+            for key, name, cls, data_type, level, value, relocation in image.symbols
+        ]
+        entry = None if image.entry is None else remap(image.entry)
+        return Image(text.tobytes(), image.data, relocations, entry, symbols, externals)
+
+
+def lower_module(module: Module, superinstructions: bool = False) -> Image:
+    """把中间表示降级为栈式镜像，superinstructions 为 True 时使用融合指令"""
+    return Lowering(module, superinstructions).run()
+
+
+@dataclass
+class PassReport:
+    """构造、各遍与降级的耗时（秒）与各遍的改动次数"""
+
+    timings: dict[str, float] = field(default_factory=dict)
+    changes: dict[str, int] = field(default_factory=dict)
+
+    def __str__(self) -> str:
+        items = [
+            f"{name}: {self.changes[name]} in {seconds * 1000:.2f} ms"
+            if name in self.changes
+            else f"{name}: {seconds * 1000:.2f} ms"
+            for name, seconds in self.timings.items()
+        ]
+        return "IR passes (" + ", ".join(items) + ")"
+
+
+def run_passes(
+    image: Image,
+    passes: Sequence[str] = DEFAULT_PASSES,
+    superinstructions: bool = False,
+    inline_threshold: int = INLINE_THRESHOLD,
+) -> tuple[Image, PassReport]:
+    """在中间表示上依次运行 passes 中的各遍，返回降级后的镜像与报告，
+    inline_threshold 为内联的函数体大小上限"""
+    unknown = [name for name in passes if name not in PASSES]
+    if unknown:
+        raise ValueError(f"unknown passes: {', '.join(unknown)}")
+    report = PassReport()
+    start = time.perf_counter()
+    module = build_module(image)
+    module.inline_threshold = inline_threshold
+    report.timings["build"] = time.perf_counter() - start
+    for name in passes:
+        start = time.perf_counter()
+        report.changes[name] = PASSES[name](module)
+        report.timings[name] = time.perf_counter() - start
+    start = time.perf_counter()
+    image = lower_module(module, superinstructions)
+    report.timings["lower"] = time.perf_counter() - start
+    return image, report
@@ -1,19 +1,38 @@
+import io
+import mmap
+import os
 import re
+from array import array
 from dataclasses import dataclass
-from typing import Any, Optional, Union
+from typing import Any, BinaryIO, ClassVar, Iterator, Optional, Type, Union
 
 from pycc.utils import logger
 
 
+class CompileError(Exception):
+    """源码中的词法、语法或语义错误"""
+
+
 @dataclass
 class Token:
     value: Any = None
     regexp = re.compile(r"")
     has_value = False
-    result_group: Union[str, int] = 0
+    keyword: ClassVar[Optional[str]] = None  # 关键字由 Id 经查表得到，不参与总正则
+    kind: ClassVar[int] = -1  # 类型编码，即在 TOKEN_CLASSES 中的序号
 
     def __init__(self, string: str = ""):
-        self.value = None
+        self.value = self.parse_value(string) if self.has_value else None
+
+    @classmethod
+    def parse_value(cls, string: str) -> Any:
+        return None
+
+    @classmethod
+    def from_value(cls, value: Any) -> "Token":
+        token = cls.__new__(cls)
+        token.value = value
+        return token
 
     @classmethod
     def match(cls, string: str, pos: int):
@@ -31,13 +50,13 @@ class Token:
 
 class Num(Token):
     value: int
-    regexp = re.compile(r"(?P<match>0|[1-9][0-9]*)[^a-zA-Z]")
-    result_group = "match"
+    regexp = re.compile(r"(?:0|[1-9][0-9]*)(?=[^a-zA-Z])")
     has_value = True
 
-    def __init__(self, string: str):
+    @classmethod
+    def parse_value(cls, string: str) -> int:
         # TODO: 二进制、八进制、浮点数支持
-        self.value = eval(string)
+        return int(string)
 
 
 class Chr(Token):
@@ -45,68 +64,69 @@ class Chr(Token):
     regexp = re.compile(r"'[\s\S]'")
     has_value = True
 
-    def __init__(self, string: str):
-        self.value = string[1:-1]
+    @classmethod
+    def parse_value(cls, string: str) -> str:
+        return string[1:-1]
 
 
 class Enum(Token):
     value: None
-    result_group = "match"
-    regexp = re.compile(r"(?P<match>enum)([^a-zA-Z0-9_]|$)")
+    keyword = "enum"
+    regexp = re.compile(r"enum(?![a-zA-Z0-9_])")
 
 
 class If(Token):
     value: None
-    result_group = "match"
-    regexp = re.compile(r"(?P<match>if)([^a-zA-Z0-9_]|$)")
+    keyword = "if"
+    regexp = re.compile(r"if(?![a-zA-Z0-9_])")
 
 
 class Else(Token):
     value: None
-    result_group = "match"
-    regexp = re.compile(r"(?P<match>else)([^a-zA-Z0-9_]|$)")
+    keyword = "else"
+    regexp = re.compile(r"else(?![a-zA-Z0-9_])")
 
 
 class While(Token):
     value: None
-    result_group = "match"
-    regexp = re.compile(r"(?P<match>while)([^a-zA-Z0-9_]|$)")
+    keyword = "while"
+    regexp = re.compile(r"while(?![a-zA-Z0-9_])")
 
 
 class Int(Token):
     value: None
-    result_group = "match"
-    regexp = re.compile(r"(?P<match>int)([^a-zA-Z0-9_]|$)")
+    keyword = "int"
+    regexp = re.compile(r"int(?![a-zA-Z0-9_])")
 
 
 class Char(Token):
     value: None
-    result_group = "match"
-    regexp = re.compile(r"(?P<match>char)([^a-zA-Z0-9_]|$)")
+    keyword = "char"
+    regexp = re.compile(r"char(?![a-zA-Z0-9_])")
 
 
 class Void(Token):
     value: None
-    result_group = "match"
-    regexp = re.compile(r"(?P<match>void)([^a-zA-Z0-9_]|$)")
+    keyword = "void"
+    regexp = re.compile(r"void(?![a-zA-Z0-9_])")
 
 
 class Float(Token):
     value: None
-    result_group = "match"
-    regexp = re.compile(r"(?P<match>float)([^a-zA-Z0-9_]|$)")
+    keyword = "float"
+    regexp = re.compile(r"float(?![a-zA-Z0-9_])")
 
 
 class Return(Token):
     value: None
-    result_group = "match"
-    regexp = re.compile(r"(?P<match>return)([^a-zA-Z0-9_]|$)")
+    keyword = "return"
+    regexp = re.compile(r"return(?![a-zA-Z0-9_])")
 
 
 class Sizeof(Token):
     value: None
-    result_group = "match"
-    regexp = re.compile(r"(?P<match>sizeof)([^a-zA-Z0-9_]|$)")
+    keyword = "sizeof"
+    regexp = re.compile(r"sizeof(?![a-zA-Z0-9_])")
 
 
 class Tilde(Token):
@@ -265,73 +285,246 @@ class Id(Token):
     regexp = re.compile(r"[a-zA-Z_][a-zA-Z0-9_]*")
     has_value = True
 
-    def __init__(self, string: str):
-        self.value = string
-
-
-def match_comments(string: str, pos: int) -> Optional[re.Match[str]]:
-    regexp_comments_double_slash = re.compile(r"//[\s\S]*?(\n|$)")
-    regexp_comments_slash_star = re.compile(r"/\*[\s\S]*?\*/")
-    if string.startswith("//", pos):
-        match_obj = regexp_comments_double_slash.match(string, pos)
-        assert match_obj is not None, f"{logger.ERROR_BADGE} Unterminated comment"
-        return match_obj
-    elif string.startswith("/*", pos):
-        match_obj = regexp_comments_slash_star.match(string, pos)
-        assert match_obj is not None, f"{logger.ERROR_BADGE} Unterminated comment"
-        return match_obj
-    else:
-        return None
+    @classmethod
+    def parse_value(cls, string: str) -> str:
+        return string
+
+
+# 类型编码会写入二进制语法树，新的 token 类只能追加在末尾
+class Extern(Token):
+    value: None
+    keyword = "extern"
+    regexp = re.compile(r"extern(?![a-zA-Z0-9_])")
+
+
+# 词法分析时使用的所有 token 类，顺序即匹配优先级
+TOKEN_CLASSES: list[Type[Token]] = Token.token_classes()
+for _kind, _token_cls in enumerate(TOKEN_CLASSES):
+    _token_cls.kind = _kind
+KEYWORDS: dict[str, Type[Token]] = {cls.keyword: cls for cls in TOKEN_CLASSES if cls.keyword is not None}
+
 
+def build_master_regexp(token_classes: list[Type[Token]]) -> tuple["re.Pattern[str]", list[Optional[Type[Token]]]]:
+    """将各 token 类的正则按优先级合并为一个带命名分组的正则，返回该正则及分组序号到 token 类的映射"""
+    alternatives: list[str] = []
+    group_classes: list[Optional[Type[Token]]] = [None]
+    for token_cls in token_classes:
+        if token_cls.keyword is not None:
+            continue
+        alternatives.append(f"(?P<{token_cls.__name__}>{token_cls.regexp.pattern})")
+        group_classes.append(token_cls)
+    return re.compile("|".join(alternatives)), group_classes
 
-def match_whitespace(string: str, pos: int) -> Optional[re.Match[str]]:
-    regexp_whitespace = re.compile(r"[\s]+")
-    return regexp_whitespace.match(string, pos)
+
+MASTER_REGEXP, GROUP_CLASSES = build_master_regexp(TOKEN_CLASSES)
+# 单段空白或注释，词法分析时循环跳过
+REGEXP_TRIVIA = re.compile(r"[\s]+|//[^\n]*(?:\n|$)|/\*[\s\S]*?\*/")
+# 直接扫描文件内容（mmap 或分块读取的字节）时使用的字节版本
+MASTER_REGEXP_BYTES = re.compile(MASTER_REGEXP.pattern.encode())
+REGEXP_TRIVIA_BYTES = re.compile(REGEXP_TRIVIA.pattern.encode())
+KEYWORDS_BYTES: dict[bytes, Type[Token]] = {keyword.encode(): token_cls for keyword, token_cls in KEYWORDS.items()}
+# token 结束处距窗口末尾不足该长度时，无法确定 token 是否完整（如 'x' 或跨块的数字），需先读入更多数据
+MAX_LOOKAHEAD = 4
+DEFAULT_CHUNK_SIZE = 1 << 20
+
+
+# (token 类, 值, 起始偏移, 结束偏移)，token 类为 None 表示已到达结尾
+TokenTuple = tuple[Optional[Type[Token]], Any, int, int]
+END_OF_TOKENS: TokenTuple = (None, None, -1, -1)
+
+
+SourceText = Union[str, bytes, mmap.mmap]
 
 
 class Lexer:
     source_pointer: int = 0
+    trivia: Optional[list[tuple[int, int]]]
 
-    def __init__(self, source_code: str):
+    def __init__(self, source_code: SourceText, keep_trivia: bool = False, reader: Optional[BinaryIO] = None):
+        """source_code 为 str 时偏移以字符计；为 bytes/mmap 时以字节计。
+        给定 reader 时 source_code 只是已读入的开头部分，其余内容按块从 reader 中读取"""
         self.source_pointer = 0
         self.source_code = source_code
+        # 保留注释与空白的 [start, end) 区间，供格式化等工具使用
+        self.trivia = [] if keep_trivia else None
+        self.reader = reader
+        self.chunk_size = DEFAULT_CHUNK_SIZE
+        self.close_reader = False  # reader 由 Lexer 自行打开时，读完后将其关闭
+        self._scanner: Optional[Iterator[tuple[Type[Token], int, int, str]]] = None
+
+    @classmethod
+    def from_file(
+        cls,
+        file: Union[str, "os.PathLike[str]", BinaryIO],
+        keep_trivia: bool = False,
+        chunk_size: Optional[int] = None,
+    ) -> "Lexer":
+        """从文件路径或二进制文件对象中词法分析，不将整个文件解码为 str。
+        默认通过 mmap 映射文件，无法映射或指定了 chunk_size 时按块读取"""
+        f: BinaryIO = file if hasattr(file, "read") else open(file, "rb")  # type: ignore
+        if chunk_size is None:
+            try:
+                source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+                # 管道、内存中的文件对象与空文件无法映射
+                pass
+            else:
+                if f is not file:
+                    f.close()
+                return cls(source, keep_trivia)
+        lexer = cls(b"", keep_trivia, reader=f)
+        lexer.chunk_size = chunk_size or DEFAULT_CHUNK_SIZE
+        lexer.close_reader = f is not file
+        return lexer
 
     def __iter__(self):
         return self
 
     def __next__(self) -> Token:
-        if self.source_pointer < len(self.source_code):
-            # 匹配并跳过注释
-            if match_obj := match_comments(self.source_code, self.source_pointer):
-                comments = match_obj.group(0)
-                self.source_pointer += len(comments)
-                return self.__next__()
-
-            # 匹配并跳过空白字符
-            if match_obj := match_whitespace(self.source_code, self.source_pointer):
-                whitespace = match_obj.group(0)
-                self.source_pointer += len(whitespace)
-                return self.__next__()
-
-            # 匹配各种 token
-            for token_cls in Token.token_classes():
-                if match_obj := token_cls.match(self.source_code, self.source_pointer):
-                    match_str = match_obj.group(token_cls.result_group)
-                    self.source_pointer += len(match_str)
-                    if token_cls.has_value:
-                        return token_cls(match_str)
-                    else:
-                        return token_cls()
-
-            # 未预期的符号
-            else:
-                # i += 1
-                raise Exception(f"Unexpected symbol: {self.source_code[self.source_pointer]}")
-        else:
-            raise StopIteration
+        if self._scanner is None:
+            self._scanner = self.scan()
+        token_cls, _, _, match_str = next(self._scanner)
+        return token_cls(match_str)
+
+    def scan(self) -> Iterator[tuple[Type[Token], int, int, str]]:
+        """逐个产出 (token 类, 起始偏移, 结束偏移, 匹配文本)，不创建 Token 对象"""
+        text = self.source_code
+        is_str = isinstance(text, str)
+        block_comment_start = "/*" if is_str else b"/*"
+        match_trivia = (REGEXP_TRIVIA if is_str else REGEXP_TRIVIA_BYTES).match
+        match_token = (MASTER_REGEXP if is_str else MASTER_REGEXP_BYTES).match
+        keywords = KEYWORDS if is_str else KEYWORDS_BYTES
+        trivia = self.trivia
+        reader = self.reader
+        # 分块读取时 text 为当前窗口，base 为窗口起点在整个文件中的偏移
+        base = 0
+        eof = reader is None
+        length = len(text)
+        pos = self.source_pointer
+        while True:
+            # 循环跳过注释与空白字符
+            while True:
+                match_obj = match_trivia(text, pos)
+                # 注释或空白延伸到窗口末尾，或者剩余内容可能是未读完的注释开头时，先读入下一块
+                if not eof and (
+                    (match_obj is not None and match_obj.end() == length)
+                    or (match_obj is None and (length - pos < 2 or text[pos : pos + 2] == block_comment_start))
+                ):
+                    chunk = reader.read(self.chunk_size)  # type: ignore
+                    text = text[pos:] + chunk  # type: ignore
+                    base += pos
+                    pos = 0
+                    length = len(text)
+                    eof = not chunk
+                    continue
+                if match_obj is None:
+                    break
+                end = match_obj.end()
+                if trivia is not None:
+                    trivia.append((base + pos, base + end))
+                pos = end
+            assert text[pos : pos + 2] != block_comment_start, f"{logger.ERROR_BADGE} Unterminated comment"
+            self.source_pointer = base + pos
+            if pos >= length:
+                if self.close_reader:
+                    reader.close()  # type: ignore
+                return
+
+            # 一次匹配得到 token 类型，关键字通过查表从标识符中区分
+            match_obj = match_token(text, pos)
+            if not eof and length - (match_obj.end() if match_obj else pos) < MAX_LOOKAHEAD:
+                # token 可能在下一块中延续（如 "<" 与 "<="、跨块的标识符或数字），读入下一块后重新匹配
+                chunk = reader.read(self.chunk_size)  # type: ignore
+                text = text[pos:] + chunk  # type: ignore
+                base += pos
+                pos = 0
+                length = len(text)
+                eof = not chunk
+                continue
+            if match_obj is None:
+                # 未预期的符号
+                symbol = text[pos : pos + 1]
+                raise CompileError(f"Unexpected symbol: {symbol if is_str else symbol.decode(errors='replace')}")
+            token_cls = GROUP_CLASSES[match_obj.lastindex]  # type: ignore
+            match_str = match_obj.group()
+            end = match_obj.end()
+            if token_cls is Id:
+                token_cls = keywords.get(match_str, Id)
+            if not is_str:
+                match_str = match_str.decode()
+            self.source_pointer = base + end
+            yield token_cls, base + pos, base + end, match_str  # type: ignore
+            pos = end
+
+    def cursor(self) -> Iterator[TokenTuple]:
+        for token_cls, start, end, match_str in self.scan():
+            yield token_cls, token_cls.parse_value(match_str) if token_cls.has_value else None, start, end
 
     def tokenize(self):
         token_stream: list[Token] = []
         for token in self:
             token_stream.append(token)
         return token_stream
+
+
+class TokenBuffer:
+    """紧凑的 token 流：类型编码与起止偏移存于数组中，标识符与数值驻留在值表里，按需才构造 Token 对象"""
+
+    def __init__(self):
+        self.kinds = array("B")
+        self.starts = array("I")
+        self.ends = array("I")
+        self.value_ids = array("I")  # 指向 values 的下标，0 表示无值
+        self.values: list[Any] = [None]
+        self.value_index: dict[Any, int] = {}
+
+    @classmethod
+    def from_lexer(cls, lexer: Lexer) -> "TokenBuffer":
+        buffer = cls()
+        kinds_append = buffer.kinds.append
+        starts_append = buffer.starts.append
+        ends_append = buffer.ends.append
+        value_ids_append = buffer.value_ids.append
+        intern = buffer.intern
+        for token_cls, start, end, match_str in lexer.scan():
+            kinds_append(token_cls.kind)
+            starts_append(start)
+            ends_append(end)
+            value_ids_append(intern(token_cls.parse_value(match_str)) if token_cls.has_value else 0)
+        return buffer
+
+    @classmethod
+    def from_source(cls, source_code: str) -> "TokenBuffer":
+        return cls.from_lexer(Lexer(source_code))
+
+    def intern(self, value: Any) -> int:
+        value_id = self.value_index.get(value)
+        if value_id is None:
+            value_id = self.value_index[value] = len(self.values)
+            self.values.append(value)
+        return value_id
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
+    def __getitem__(self, index: int) -> Token:
+        return TOKEN_CLASSES[self.kinds[index]].from_value(self.values[self.value_ids[index]])
+
+    def __iter__(self) -> Iterator[Token]:
+        for index in range(len(self)):
+            yield self[index]
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+    def cursor(self, start: int = 0, stop: Optional[int] = None) -> Iterator[TokenTuple]:
+        """遍历下标在 [start, stop) 内的 token"""
+        values = self.values
+        for kind, value_id, token_start, token_end in zip(
+            self.kinds[start:stop], self.value_ids[start:stop], self.starts[start:stop], self.ends[start:stop]
+        ):
+            yield TOKEN_CLASSES[kind], values[value_id], token_start, token_end
+
+    def nbytes(self) -> int:
+        """token 流本身占用的字节数（不含值表）"""
+        return sum(a.itemsize * len(a) for a in (self.kinds, self.starts, self.ends, self.value_ids))
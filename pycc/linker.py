@@ -0,0 +1,102 @@
+from array import array
+from typing import Optional, Sequence
+
+from pycc.image import Image, SymbolRecord
+from pycc.symbols import IdClass, IdLevel
+from pycc.vm import InstructionSet, Relocation
+
+
+# 符号种类在报错中的名字
+KIND_NAMES = {IdClass.Sys.value: "builtin", IdClass.Func.value: "function", IdClass.Var.value: "variable"}
+
+
+class LinkError(Exception):
+    """链接失败，errors 中列出全部未定义与重复定义的符号"""
+
+    def __init__(self, errors: list[str]):
+        super().__init__("\n".join(errors))
+        self.errors = errors
+
+
+def link(units: Sequence[Image], names: Optional[Sequence[str]] = None) -> Image:
+    """合并各目标单元的代码段与数据段，解析外部引用，得到可直接载入的镜像。
+    结果中只保留内置与全局符号，names 为各单元的名字，用于报错"""
+    names = names if names is not None else [f"<unit {i}>" for i in range(len(units))]
+    instruction_sets = {unit.instruction_set for unit in units}
+    if len(instruction_sets) > 1:
+        raise LinkError(
+            [f"{names[i]} is {unit.instruction_set.name.lower()} machine code" for i, unit in enumerate(units)]
+        )
+    instruction_set = instruction_sets.pop() if instruction_sets else InstructionSet.STACK
+    text = array("q")
+    data = bytearray()
+    relocations = array("q")
+    # 全局符号名 -> (定义所在单元, 合并后的记录)
+    definitions: dict[str, tuple[int, SymbolRecord]] = {}
+    symbols: dict[str, SymbolRecord] = {}
+    errors: list[str] = []
+    # 各单元代码段在合并后的起始下标与数据段的起始偏移
+    text_starts: list[int] = []
+
+    for unit_id, unit in enumerate(units):
+        text_start = len(text)
+        data_start = len(data)
+        text_starts.append(text_start)
+        bases = {Relocation.TEXT.value: text_start * text.itemsize, Relocation.DATA.value: data_start}
+        unit_text = array("q", unit.text)
+        for item in unit.relocations:
+            unit_text[item >> 1] += bases[item & 1]
+            relocations.append(item + (text_start << 1))
+        text.extend(unit_text)
+        data += unit.data
+
+        for key, name, cls, data_type, level, value, relocation in unit.symbols:
+            if level is None or IdLevel(level) not in (IdLevel.BuiltIn, IdLevel.Global):
+                continue
+            record = (key, name, cls, data_type, level, value, relocation)
+            if relocation is not None:
+                record = (key, name, cls, data_type, level, value + bases[relocation], relocation)
+            if IdLevel(level) == IdLevel.BuiltIn:
+                symbols.setdefault(key, record)
+                continue
+            if relocation is None:
+                # 仅声明，由其他单元定义
+                symbols.setdefault(key, record)
+                continue
+            if name in definitions:
+                errors.append(
+                    f"duplicate symbol '{name}' defined in {names[definitions[name][0]]} and {names[unit_id]}"
+                )
+                continue
+            definitions[name] = (unit_id, record)
+            symbols[key] = record
+
+    for unit_id, unit in enumerate(units):
+        # 引用所在单元中的声明给出符号的种类，必须与定义一致
+        declared = {
+            name: cls
+            for _, name, cls, _, level, _, relocation in unit.symbols
+            if relocation is None and level is not None and IdLevel(level) == IdLevel.Global
+        }
+        for index, name in unit.externals:
+            if name not in definitions:
+                errors.append(f"undefined symbol '{name}' referenced in {names[unit_id]}")
+                continue
+            defined_in, (_, _, cls, _, _, value, relocation) = definitions[name]
+            if declared.get(name, cls) != cls:
+                errors.append(
+                    f"symbol '{name}' declared as a {KIND_NAMES[declared[name]]} in {names[unit_id]} "
+                    f"but defined as a {KIND_NAMES[cls]} in {names[defined_in]}"
+                )
+                continue
+            index += text_starts[unit_id]
+            text[index] = value
+            relocations.append(index << 1 | relocation)
+
+    if errors:
+        # 同一单元中多次引用同一符号只报告一次
+        raise LinkError(list(dict.fromkeys(errors)))
+    entry = None
+    if (main := definitions.get("main")) is not None and main[1][2] == IdClass.Func.value:
+        entry = main[1][5]
+    return Image(text.tobytes(), bytes(data), relocations, entry, list(symbols.values()), [], instruction_set)
@@ -0,0 +1,263 @@
+"""窥孔优化（-O1）。
+
+在与加载地址无关的镜像上改写指令序列：重定位表标出了代码段中所有保存代码段地址的位置，
+删除或改写指令后按新的下标重新计算跳转目标、函数地址与入口，外部引用随指令一起移动。
+各条规则反复应用直到不再有变化：
+
+- 跳转线程化：跳转到 JMP 的跳转直接跳到最终目标，JZ/JNZ 跳到同一条件跳转时同样穿过
+- 删除跳转到下一条指令的跳转
+- 删除 LEV/JMP 之后、下一个跳转目标之前不可达的指令
+- PUSH 后紧跟 ADJ 时压栈与出栈相互抵消
+- 删除读取局部或全局变量后原样存回同一位置的赋值（a = a;）
+"""
+from array import array
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from typing import Optional
+
+from pycc.image import Image, SymbolRecord
+from pycc.vm import Instruction, InstructionSet, Relocation
+
+SLOT_BYTES = array("q").itemsize
+
+# 带一个操作数的指令，与 libvm.hpp 中的 has_operand 一致
+OPERAND_OPCODES = frozenset(range(Instruction.LEA.value, Instruction.ADJ.value + 1)) | frozenset(
+    range(Instruction.LLI.value, Instruction.SLI.value + 1)
+)
+JUMP_OPCODES = frozenset({Instruction.JMP.value, Instruction.JZ.value, Instruction.JNZ.value})
+# 之后的指令只能通过跳转到达
+BARRIER_OPCODES = frozenset({Instruction.JMP.value, Instruction.LEV.value})
+# (取值, 存值) 指令对
+LOAD_STORE_OPCODES = {Instruction.LI.value: Instruction.SI.value, Instruction.LC.value: Instruction.SC.value}
+
+RULES = ("threaded jumps", "jumps to next", "unreachable", "push/adj", "self-assignments")
+
+
+@dataclass
+class Op:
+    index: int  # 优化前在代码段中的下标
+    opcode: int
+    operand: Optional[int] = None
+    relocation: Optional[int] = None  # 操作数的重定位类型
+    external: Optional[str] = None  # 操作数是链接时回填的外部符号
+
+    @property
+    def target(self) -> Optional[int]:
+        """跳转目标在优化前代码段中的下标"""
+        if self.opcode in JUMP_OPCODES and self.relocation == Relocation.TEXT.value:
+            return self.operand // SLOT_BYTES  # type: ignore
+        return None
+
+    @property
+    def size(self) -> int:
+        return 1 if self.operand is None else 2
+
+
+@dataclass
+class PeepholeReport:
+    """优化前后的指令数与各条规则的效果：threaded jumps 为改写目标的跳转数，其余为删除的指令数"""
+
+    num_ops_before: int = 0
+    num_ops_after: int = 0
+    rules: dict[str, int] = field(default_factory=lambda: dict.fromkeys(RULES, 0))
+
+    @property
+    def removed(self) -> int:
+        return self.num_ops_before - self.num_ops_after
+
+    def __str__(self) -> str:
+        rules = ", ".join(f"{name}: {count}" for name, count in self.rules.items())
+        return f"peephole removed {self.removed} of {self.num_ops_before} instructions ({rules})"
+
+
+def decode(image: Image) -> list[Op]:
+    text = array("q", image.text)
+    relocations = {item >> 1: item & 1 for item in image.relocations}
+    externals = dict(image.externals)
+    ops = []
+    index = 0
+    while index < len(text):
+        opcode = text[index]
+        if opcode in OPERAND_OPCODES:
+            if index + 1 >= len(text):
+                raise ValueError("truncated instruction at the end of the text segment")
+            operand = index + 1
+            ops.append(Op(index, opcode, text[operand], relocations.get(operand), externals.get(operand)))
+        else:
+            ops.append(Op(index, opcode))
+        index += ops[-1].size
+    return ops
+
+
+class Peephole:
+    def __init__(self, image: Image):
+        if image.instruction_set != InstructionSet.STACK:
+            raise ValueError("peephole optimizer works on stack machine code")
+        self.image = image
+        self.ops = decode(image)
+        self.report = PeepholeReport(num_ops_before=len(self.ops))
+
+    def run(self) -> Image:
+        changed = True
+        while changed:
+            changed = False
+            for rule in (
+                self.thread_jumps,
+                self.remove_jumps_to_next,
+                self.remove_unreachable,
+                self.cancel_push_adj,
+                self.remove_self_assignments,
+            ):
+                changed |= rule()
+        self.report.num_ops_after = len(self.ops)
+        return self.encode()
+
+    def count(self, rule: str, n: int) -> bool:
+        self.report.rules[rule] += n
+        return n > 0
+
+    def labels(self) -> set[int]:
+        """可以跳转到达的下标：跳转目标、函数入口与程序入口，已删除的指令换成其后第一条指令"""
+        labels = {target for op in self.ops if (target := op.target) is not None}
+        offsets = [value for *_, value, relocation in self.image.symbols if relocation == Relocation.TEXT.value]
+        if self.image.entry is not None:
+            offsets.append(self.image.entry)
+        indices = [op.index for op in self.ops]
+        for offset in offsets:
+            i = bisect_left(indices, offset // SLOT_BYTES)
+            if i < len(indices):
+                labels.add(indices[i])
+        return labels
+
+    def thread_jumps(self) -> bool:
+        by_index = {op.index: op for op in self.ops}
+        threaded = 0
+        for op in self.ops:
+            if (target := op.target) is None:
+                continue
+            visited = {op.index}
+            while (next_op := by_index.get(target)) is not None and target not in visited:
+                # 无条件跳转总可以穿过；条件跳转跳到相同的条件跳转时，条件必然仍然成立
+                if next_op.opcode != Instruction.JMP.value and next_op.opcode != op.opcode:
+                    break
+                if (next_target := next_op.target) is None:
+                    break
+                visited.add(target)
+                target = next_target
+            if target != op.target:
+                op.operand = target * SLOT_BYTES
+                threaded += 1
+        return self.count("threaded jumps", threaded)
+
+    def remove_jumps_to_next(self) -> bool:
+        ops = []
+        for i, op in enumerate(self.ops):
+            next_index = self.ops[i + 1].index if i + 1 < len(self.ops) else None
+            if op.target is not None and op.target == next_index:
+                continue
+            ops.append(op)
+        return self.replace(ops, "jumps to next")
+
+    def remove_unreachable(self) -> bool:
+        labels = self.labels()
+        ops = []
+        reachable = True
+        for op in self.ops:
+            if op.index in labels:
+                reachable = True
+            if reachable:
+                ops.append(op)
+            if op.opcode in BARRIER_OPCODES:
+                reachable = False
+        return self.replace(ops, "unreachable")
+
+    def cancel_push_adj(self) -> bool:
+        labels = self.labels()
+        ops: list[Op] = []
+        for op in self.ops:
+            if op.opcode == Instruction.ADJ.value and op.index not in labels:
+                if ops and ops[-1].opcode == Instruction.PUSH.value and op.operand > 0:  # type: ignore
+                    ops.pop()
+                    op.operand -= 1  # type: ignore
+                # PRTF 读取其后 ADJ 的操作数，不能删除
+                if op.operand == 0 and not (ops and ops[-1].opcode == Instruction.PRTF.value):
+                    continue
+            ops.append(op)
+        return self.replace(ops, "push/adj")
+
+    def remove_self_assignments(self) -> bool:
+        # LEA n; PUSH; LEA n; LI; SI 或 IMM g; PUSH; IMM g; LI; SI
+        labels = self.labels()
+        ops: list[Op] = []
+        for op in self.ops:
+            ops.append(op)
+            if len(ops) < 5:
+                continue
+            address, push, load_address, load, store = ops[-5:]
+            if (
+                (
+                    address.opcode == Instruction.LEA.value
+                    or (address.opcode == Instruction.IMM.value and address.relocation == Relocation.DATA.value)
+                )
+                and push.opcode == Instruction.PUSH.value
+                and (load_address.opcode, load_address.operand, load_address.relocation)
+                == (address.opcode, address.operand, address.relocation)
+                and address.external is None
+                and load_address.external is None
+                and LOAD_STORE_OPCODES.get(load.opcode) == store.opcode
+                and not any(item.index in labels for item in (push, load_address, load, store))
+            ):
+                del ops[-5:]
+        return self.replace(ops, "self-assignments")
+
+    def replace(self, ops: list[Op], rule: str) -> bool:
+        removed = len(self.ops) - len(ops)
+        if removed:
+            # 跳转到被删除指令的跳转改为跳到其后第一条保留的指令
+            indices = [op.index for op in ops]
+            for op in ops:
+                if (target := op.target) is not None and (i := bisect_left(indices, target)) < len(indices):
+                    op.operand = indices[i] * SLOT_BYTES
+        self.ops = ops
+        return self.count(rule, removed)
+
+    def encode(self) -> Image:
+        # 被删除的指令映射到其后第一条保留的指令
+        old_indices = [op.index for op in self.ops]
+        new_indices = []
+        num_slots = 0
+        for op in self.ops:
+            new_indices.append(num_slots)
+            num_slots += op.size
+
+        def remap(offset: int) -> int:
+            i = bisect_left(old_indices, offset // SLOT_BYTES)
+            return (new_indices[i] if i < len(new_indices) else num_slots) * SLOT_BYTES
+
+        text = array("q")
+        relocations = array("q")
+        externals = []
+        for op in self.ops:
+            text.append(op.opcode)
+            if op.operand is None:
+                continue
+            if op.relocation is not None:
+                relocations.append(len(text) << 1 | op.relocation)
+            if op.external is not None:
+                externals.append((len(text), op.external))
+            text.append(remap(op.operand) if op.relocation == Relocation.TEXT.value else op.operand)
+
+        symbols: list[SymbolRecord] = [
+            (key, name, cls, data_type, level, remap(value), relocation)
+            if relocation == Relocation.TEXT.value
+            else (key, name, cls, data_type, level, value, relocation)
+            for key, name, cls, data_type, level, value, relocation in self.image.symbols
+        ]
+        entry = None if self.image.entry is None else remap(self.image.entry)
+        return Image(text.tobytes(), self.image.data, relocations, entry, symbols, externals)
+
+
+def peephole(image: Image) -> tuple[Image, PeepholeReport]:
+    """对镜像做窥孔优化，返回优化后的镜像与报告"""
+    optimizer = Peephole(image)
+    return optimizer.run(), optimizer.report
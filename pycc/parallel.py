@@ -0,0 +1,201 @@
+"""单个编译单元内按函数并行编译。
+
+先在 token 流上按花括号配平切分出各个顶层声明；把所有函数体替换为 ';' 后串行解析一遍，
+得到全局变量的数据段布局与全局符号快照；各函数在进程池中分别编译为目标单元，
+此前声明的全局符号都作为外部符号引用；最后与全局声明单元按源码顺序链接。
+链接后的代码段、数据段、重定位项与入口和串行编译完全一致。
+
+函数的目标单元只取决于函数自身的 token 与它引用的全局符号的签名，
+给出缓存时按两者的哈希复用未修改的函数，只重新编译改动过的函数再重新链接。
+"""
+import hashlib
+import json
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+from typing import NamedTuple, Optional, Sequence
+
+from pycc.cache import CompileCache
+from pycc.image import Image
+from pycc.lexer import Extern, Id, Lcurbrak, Rcurbrak, Semi, TokenBuffer, TokenTuple
+from pycc.linker import link
+from pycc.parser import Parser
+from pycc.symbols import IdClass, IdLevel, IdType, Symbol
+
+SLOT_BYTES_PER_TOKEN = 4 * 8
+
+# 全局符号快照：(name, cls, data_type)
+GlobalDeclaration = tuple[str, int, Optional[int]]
+
+
+class TopLevelItem(NamedTuple):
+    start: int  # 起始 token 下标
+    stop: int
+    body: Optional[int]  # 函数体 '{' 的 token 下标，不是函数定义时为 None
+
+
+def split_top_level(tokens: TokenBuffer) -> list[TopLevelItem]:
+    """按花括号配平切分顶层声明：深度为 0 的 ';' 或配平的 '}' 结束一个声明"""
+    kinds = tokens.kinds
+    lcurbrak, rcurbrak, semi = Lcurbrak.kind, Rcurbrak.kind, Semi.kind
+    items = []
+    index = 0
+    num_tokens = len(kinds)
+    while index < num_tokens:
+        start = index
+        body = None
+        depth = 0
+        while index < num_tokens:
+            kind = kinds[index]
+            index += 1
+            if kind == lcurbrak:
+                if depth == 0:
+                    body = index - 1
+                depth += 1
+            elif kind == rcurbrak:
+                depth -= 1
+                if depth == 0:
+                    break
+            elif kind == semi and depth == 0:
+                break
+        items.append(TopLevelItem(start, index, body))
+    return items
+
+
+def declared_name(tokens: TokenBuffer, item: TopLevelItem) -> Optional[str]:
+    """顶层声明的名字，即可选的 extern 与类型之后的标识符"""
+    index = item.start + (2 if tokens.kinds[item.start] == Extern.kind else 1)
+    if index >= item.stop or tokens.kinds[index] != Id.kind:
+        return None
+    return tokens.values[tokens.value_ids[index]]
+
+
+def compile_declarations(tokens: TokenBuffer, items: Sequence[TopLevelItem]) -> Parser:
+    """串行解析去掉函数体的全部顶层声明，函数定义视为原型"""
+
+    def cursor(item: TopLevelItem) -> chain[TokenTuple]:
+        if item.body is None:
+            return chain(tokens.cursor(item.start, item.stop))
+        end = tokens.starts[item.body]
+        return chain(tokens.cursor(item.start, item.body), [(Semi, None, end, end)])
+
+    parser = Parser(chain.from_iterable(cursor(item) for item in items), build_ast=False)
+    parser.start()
+    return parser
+
+
+_snapshot: list[GlobalDeclaration] = []
+
+
+def _set_snapshot(snapshot: list[GlobalDeclaration]):
+    global _snapshot
+    _snapshot = snapshot
+
+
+def compile_function(
+    function_tokens: list[TokenTuple], num_declarations: int, superinstructions: bool = False
+) -> Image:
+    """编译一个函数定义，快照中前 num_declarations 个全局符号均作为外部符号引用"""
+    # 每个 token 至多生成 4 个代码段槽位，按函数大小分配虚拟机内存
+    poolsize = SLOT_BYTES_PER_TOKEN * (len(function_tokens) + 8)
+    parser = Parser(function_tokens, build_ast=False, poolsize=poolsize, superinstructions=superinstructions)
+    for name, cls, data_type in _snapshot[:num_declarations]:
+        parser.symbols.set_symbol(
+            Symbol(
+                name=name,
+                cls=IdClass(cls),
+                data_type=None if data_type is None else IdType(data_type),
+                level=IdLevel.Global,
+                value=None,
+            )
+        )
+    parser.start()
+    return Image.from_parser(parser)
+
+
+def function_key(tokens: TokenBuffer, item: TopLevelItem, snapshot: Sequence[GlobalDeclaration]) -> bytes:
+    """函数的缓存键：token 类型与值序列，以及函数中出现的标识符对应的全局符号签名。
+    不含 token 的位置，函数在文件中移动或前面的代码改动不会使缓存失效"""
+    value_ids = tokens.value_ids[item.start : item.stop]
+    # 值表下标取决于整个文件，按在函数中首次出现的顺序重新编号
+    numbering = {value_id: i for i, value_id in enumerate(dict.fromkeys(value_ids))}
+    values = [tokens.values[value_id] for value_id in numbering]
+    digest = hashlib.sha256(tokens.kinds[item.start : item.stop].tobytes())
+    digest.update(array("I", map(numbering.__getitem__, value_ids)).tobytes())
+    digest.update(repr(values).encode())
+    names = set(values)
+    signatures = sorted(declaration for declaration in snapshot if declaration[0] in names)
+    digest.update(json.dumps(signatures).encode())
+    return b"function\0" + digest.digest()
+
+
+def unit_signature(tokens: TokenBuffer) -> bytes:
+    """编译单元的顶层声明名字序列，只改动函数体时不变，用于判断缓存中是否已有这个单元的函数条目"""
+    names = [declared_name(tokens, item) or "" for item in split_top_level(tokens)]
+    return b"unit\0" + "\0".join(names).encode()
+
+
+def compile_functions_parallel(
+    tokens: TokenBuffer,
+    workers: Optional[int] = None,
+    cache: Optional[CompileCache] = None,
+    superinstructions: bool = False,
+) -> Image:
+    """按函数并行编译一个编译单元，workers 为 1 时在当前进程中依次编译，
+    给出 cache 时只编译缓存中没有的函数"""
+    items = split_top_level(tokens)
+    declarations = compile_declarations(tokens, items)
+    header = Image.from_parser(declarations)
+
+    # 全局符号按声明顺序排列，每个函数只能看到在它之前（含自身）声明的符号
+    snapshot: list[GlobalDeclaration] = []
+    positions: dict[str, int] = {}
+    for symbol in declarations.symbols.values():
+        if symbol.level is not None and IdLevel(symbol.level) == IdLevel.Global:
+            positions[symbol.name] = len(snapshot)
+            snapshot.append(
+                (symbol.name, symbol.cls.value, None if symbol.data_type is None else symbol.data_type.value)
+            )
+    tasks: list[tuple[TopLevelItem, int]] = []
+    num_declarations = 0
+    for item in items:
+        name = declared_name(tokens, item)
+        if name is not None and name in positions:
+            num_declarations = max(num_declarations, positions[name] + 1)
+        if item.body is not None:
+            tasks.append((item, num_declarations))
+
+    units: list[Optional[Image]] = [None] * len(tasks)
+    keys: list[Optional[str]] = [None] * len(tasks)
+    if cache is not None:
+        for i, (item, num_declarations) in enumerate(tasks):
+            key = function_key(tokens, item, snapshot[:num_declarations])
+            keys[i] = key = cache.key(key, "superinstructions" if superinstructions else "")
+            if (path := cache.get(key)) is not None:
+                try:
+                    units[i] = Image.from_bytes(path.read_bytes())
+                except (OSError, ValueError):
+                    cache.discard(key)
+    misses = [i for i, unit in enumerate(units) if unit is None]
+    # 只为需要编译的函数构造 token 列表
+    jobs = [(list(tokens.cursor(tasks[i][0].start, tasks[i][0].stop)), tasks[i][1], superinstructions) for i in misses]
+
+    if workers == 1 or len(misses) <= 1:
+        _set_snapshot(snapshot)
+        compiled = [compile_function(*job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(workers, initializer=_set_snapshot, initargs=(snapshot,)) as executor:
+            compiled = list(
+                executor.map(
+                    compile_function,
+                    *zip(*jobs),
+                    chunksize=max(1, len(misses) // 32),
+                )
+            )
+    for i, unit in zip(misses, compiled):
+        units[i] = unit
+        if cache is not None:
+            cache.put(keys[i], unit, evict=False)  # type: ignore
+    if cache is not None and misses:
+        cache.evict()
+    return link([header, *units])  # type: ignore
@@ -1,5 +1,6 @@
-import json
-from typing import Optional, Type, Union
+from array import array
+from operator import add, and_, mul, or_, sub, xor
+from typing import Any, Callable, ClassVar, Iterable, Iterator, Optional, Type, Union
 
 from pycc.lexer import (
     Add,
@@ -7,8 +8,10 @@ from pycc.lexer import (
     Char,
     Chr,
     Comma,
+    CompileError,
     Div,
     Else,
+    Extern,
     Float,
     Id,
     If,
@@ -25,6 +28,9 @@ from pycc.lexer import (
     Semi,
     Sub,
     Token,
+    TokenBuffer,
+    TokenTuple,
+    END_OF_TOKENS,
     Void,
     While,
     Lan,
@@ -40,61 +46,116 @@ from pycc.lexer import (
     Le,
 )
 from pycc.symbols import IdLevel, IdType, Symbol, SymbolTable, IdClass
+from pycc.tree import NULL_NODE, Node, NodeKind, TerminalNode
 from pycc.utils import logger
-from pycc.vm import Instruction, VirtualMachine, send_integer_to_pointer
-
-AST = Union[dict[str, "AST"], str]
-
-
-class Node:
-    def __init__(self, name: str):
-        self.name = name
-        self.children: list["Node"] = []
-        self.is_terminal = False
-
-    def add_node(self, node: "Node"):
-        self.children.append(node)
-
-    def to_ast(self) -> AST:
-        if not self.children:
-            return "<empty>"
-        ast: AST = {}
-        for child in self.children:
-            ast[child.name] = child.to_ast()
-        return ast
-
-    def dump(self, file: str):
-        with open(file, "w", encoding="utf-8") as f:
-            json.dump(self.to_ast(), f, indent=2)
-
-
-class TerminalNode(Node):
-    def __init__(self, name: str):
-        super().__init__(name)
-        self.is_terminal = True
-
-    def to_ast(self) -> AST:
-        return self.name
+from pycc.vm import Instruction, Relocation, VirtualMachine, send_integer_to_pointer
+
+# 二元运算符 -> (优先级, 指令)，优先级越大结合越紧密，同级运算符左结合
+BINARY_OPERATORS: dict[Type[Token], tuple[int, Instruction]] = {
+    Lor: (1, Instruction.JNZ),
+    Lan: (2, Instruction.JZ),
+    Or: (3, Instruction.OR),
+    Xor: (4, Instruction.XOR),
+    And: (5, Instruction.AND),
+    Eq: (6, Instruction.EQ),
+    Ne: (6, Instruction.NE),
+    Lt: (7, Instruction.LT),
+    Gt: (7, Instruction.GT),
+    Le: (7, Instruction.LE),
+    Ge: (7, Instruction.GE),
+    Add: (8, Instruction.ADD),
+    Sub: (8, Instruction.SUB),
+    Mul: (9, Instruction.MUL),
+    Div: (9, Instruction.DIV),
+    Mod: (9, Instruction.MOD),
+}
+# 虚拟机各段只预留地址空间，按需提交物理页，生成代码时预留得大一些也几乎没有开销
+DEFAULT_POOLSIZE = 16 * 1024 * 1024
+
+# || 与 && 通过条件跳转实现短路求值
+SHORT_CIRCUIT_INSTRUCTIONS = (Instruction.JNZ, Instruction.JZ)
+
+INT64_MIN = -(1 << 63)
+
+
+def wrap_int64(value: int) -> int:
+    """按虚拟机中 int64 的补码回绕"""
+    return (value - INT64_MIN) % (1 << 64) + INT64_MIN
+
+
+def fold_constant(instruction: Instruction, lhs: int, rhs: int) -> Optional[int]:
+    """在编译期计算二元运算，结果与虚拟机执行时一致；
+    除数为 0 与 INT64_MIN / -1 在运行时才会出错，不折叠"""
+    if instruction in (Instruction.DIV, Instruction.MOD):
+        if rhs == 0 or (lhs == INT64_MIN and rhs == -1):
+            return None
+        # C 的整数除法向零取整，余数与被除数同号
+        quotient = abs(lhs) // abs(rhs) * (1 if (lhs < 0) == (rhs < 0) else -1)
+        return quotient if instruction == Instruction.DIV else lhs - rhs * quotient
+    return wrap_int64(CONSTANT_OPERATIONS[instruction](lhs, rhs))
+
+
+CONSTANT_OPERATIONS: dict[Instruction, Callable[[int, int], int]] = {
+    Instruction.OR: or_,
+    Instruction.XOR: xor,
+    Instruction.AND: and_,
+    Instruction.EQ: lambda lhs, rhs: int(lhs == rhs),
+    Instruction.NE: lambda lhs, rhs: int(lhs != rhs),
+    Instruction.LT: lambda lhs, rhs: int(lhs < rhs),
+    Instruction.GT: lambda lhs, rhs: int(lhs > rhs),
+    Instruction.LE: lambda lhs, rhs: int(lhs <= rhs),
+    Instruction.GE: lambda lhs, rhs: int(lhs >= rhs),
+    Instruction.ADD: add,
+    Instruction.SUB: sub,
+    Instruction.MUL: mul,
+}
 
 
 class Parser:
-    source_code: str
-    lexer: Lexer
-    current_token: Optional[Token]
+    source_code: Optional[str]
+    tokens: Iterator[TokenTuple]
+    current_kind: Optional[Type[Token]]
+    current_value: Any
+    current_start: int = 0
+    current_end: int = 0
     current_level: int
+    # 最近解析的表达式在编译期的常量值，不是常量时为 None
+    constant: Optional[int] = None
     debug: bool
-
-    def __init__(self, source_code: str, debug: bool = False):
-        self.source_code = source_code
-        self.lexer = Lexer(source_code)
-        self.current_token = self.next_token()
+    build_ast: bool
+
+    def __init__(
+        self,
+        source: Union[str, Lexer, TokenBuffer, Iterable[TokenTuple]],
+        debug: bool = False,
+        build_ast: bool = True,
+        poolsize: int = DEFAULT_POOLSIZE,
+        superinstructions: bool = False,
+    ):
+        """build_ast 为 False 时只生成代码，不构建语法树，start() 返回 None；
+        poolsize 为虚拟机各段的字节数，代码段写满时 add_op 抛出 OverflowError；
+        superinstructions 为 True 时读写局部变量、读取全局变量与加减常量使用融合指令"""
+        # 从源码或 Lexer 中流式读取 token，或在已有的 TokenBuffer 上移动游标，
+        # 也可以直接给出 token 元组序列
+        self.source_code = source if isinstance(source, str) else None
+        if isinstance(source, str):
+            source = Lexer(source)
+        self.tokens = source.cursor() if isinstance(source, (Lexer, TokenBuffer)) else iter(source)
+        self.next_token()
         self.symbols = SymbolTable()
         self.current_symbol = Symbol()
         self.base_type = IdType.Int
         self.preset_builtins()
         self.symbols.enter_scope()
         self.debug = debug
-        self.vm = VirtualMachine(256 * 1024)
+        self.build_ast = build_ast
+        self.superinstructions = superinstructions
+        self.vm = VirtualMachine(poolsize)
+        # 代码段中保存段内地址的位置，每项为 (下标 << 1) | Relocation
+        self.relocations = array("q")
+        # 引用尚未定义的函数或外部变量的位置：(代码段下标, 符号名)，
+        # start() 结束时回填本单元内的定义，其余留给链接时解析
+        self.externals: list[tuple[int, str]] = []
         self.func_bp_index = 0
         self.func_num_params = 0
         self.func_num_local_vars = 0
@@ -115,337 +176,229 @@ class Parser:
             )
             self.symbols.set_symbol(symbol)
 
+    def new_node(self, kind: NodeKind) -> Node:
+        return Node(kind, self.current_start) if self.build_ast else NULL_NODE
+
+    def add_address(self, address: Union[Instruction, int], relocation: Relocation):
+        """写入代码段或数据段内的地址（或之后回填地址的占位符），并记录重定位项"""
+        self.relocations.append(self.vm.num_ops << 1 | relocation.value)
+        self.vm.add_op(address)
+
+    def add_symbol_address(self, symbol: Symbol, relocation: Relocation):
+        """写入函数或全局变量的地址，未定义的符号先写入 0 并记录为外部引用"""
+        if symbol.value is None:
+            self.externals.append((self.vm.num_ops, symbol.name))
+            self.vm.add_op(0)
+        else:
+            self.add_address(symbol.value, relocation)
+
+    def rollback(self, num_ops: int):
+        """丢弃代码段下标 num_ops 之后生成的代码及其重定位项与外部引用"""
+        self.vm.truncate(num_ops)
+        while self.relocations and self.relocations[-1] >> 1 >= num_ops:
+            self.relocations.pop()
+        while self.externals and self.externals[-1][0] >= num_ops:
+            self.externals.pop()
+
+    def emit_constant(self, value: int):
+        self.vm.add_op(Instruction.IMM)
+        self.vm.add_op(value)
+        self.constant = value
+
+    def resolve_externals(self):
+        """回填本单元内已定义的符号，未解析的外部引用保留在 externals 中"""
+        unresolved = []
+        for index, name in self.externals:
+            symbol = self.symbols.get_symbol(name)
+            if symbol.value is None:
+                unresolved.append((index, name))
+                continue
+            relocation = Relocation.TEXT if symbol.cls == IdClass.Func else Relocation.DATA
+            send_integer_to_pointer(self.vm.text_base + index * 8, symbol.value)
+            self.relocations.append(index << 1 | relocation.value)
+        self.externals = unresolved
+
+    def declare_global(self, symbol: Symbol) -> Symbol:
+        """声明或定义全局符号，已声明（值为 None）的同类符号在定义时补上地址"""
+        declared = self.symbols.get(self.symbols.calc_key(symbol.name, self.symbols.scope_id))
+        if declared is None:
+            return self.symbols.set_symbol(symbol)
+        if declared.cls != symbol.cls:
+            raise CompileError(f"name {symbol.name} redeclared as a different kind of symbol")
+        if symbol.value is not None:
+            if declared.value is not None:
+                raise CompileError(f"name {symbol.name} already exists")
+            declared.value = symbol.value
+        return declared
+
     def reset_func_recorders(self):
         self.func_bp_index = 0
         self.func_num_params = 0
         self.func_num_local_vars = 0
 
     def expr(self):
-        node = Node("expr")
+        node = self.new_node(NodeKind.expr)
         if self.debug:
             logger.debug("expr:", self.current_token)
-        node.add_node(self.lor_expr())
-        return node
-
-    def lor_expr(self):
-        node = Node("lor_expr")
-        if self.debug:
-            logger.debug("lor_expr:", self.current_token)
-        node.add_node(self.land_expr())
-        node.add_node(self.lor_expr_tail())
-        return node
-
-    def lor_expr_tail(self):
-        node = Node("lor_expr_tail")
-        if self.debug:
-            logger.debug("lor_expr_tail:", self.current_token)
-        if isinstance(self.current_token, Lor):
-            node.add_node(self.match(Lor))
-            self.vm.add_op(Instruction.JNZ)
-            self.vm.add_op(Instruction.PLAC)
-            addr = self.vm.get_op_pointer(-1)
-            node.add_node(self.land_expr())
-            send_integer_to_pointer(addr, self.vm.get_op_pointer(0))
-            node.add_node(self.lor_expr_tail())
-        return node
-
-    def land_expr(self):
-        node = Node("land_expr")
-        if self.debug:
-            logger.debug("land_expr:", self.current_token)
-        node.add_node(self.or_expr())
-        node.add_node(self.land_expr_tail())
-        return node
-
-    def land_expr_tail(self):
-        node = Node("land_expr_tail")
-        if self.debug:
-            logger.debug("land_expr_tail:", self.current_token)
-        if isinstance(self.current_token, Lan):
-            node.add_node(self.match(Lan))
-            self.vm.add_op(Instruction.JZ)
-            self.vm.add_op(Instruction.PLAC)
-            addr = self.vm.get_op_pointer(-1)
-            node.add_node(self.or_expr())
-            send_integer_to_pointer(addr, self.vm.get_op_pointer(0))
-            node.add_node(self.land_expr_tail())
-        return node
-
-    def or_expr(self):
-        node = Node("or_expr")
-        if self.debug:
-            logger.debug("or_expr:", self.current_token)
-        node.add_node(self.xor_expr())
-        node.add_node(self.or_expr_tail())
-        return node
-
-    def or_expr_tail(self):
-        node = Node("or_expr_tail")
-        if self.debug:
-            logger.debug("or_expr_tail:", self.current_token)
-        if isinstance(self.current_token, Or):
-            node.add_node(self.match(Or))
-            self.vm.add_op(Instruction.PUSH)
-            node.add_node(self.xor_expr())
-            self.vm.add_op(Instruction.OR)
-            node.add_node(self.or_expr_tail())
-        return node
-
-    def xor_expr(self):
-        node = Node("xor_expr")
-        if self.debug:
-            logger.debug("xor_expr:", self.current_token)
-        node.add_node(self.and_expr())
-        node.add_node(self.xor_expr_tail())
-        return node
-
-    def xor_expr_tail(self):
-        node = Node("xor_expr_tail")
-        if self.debug:
-            logger.debug("xor_expr_tail:", self.current_token)
-        if isinstance(self.current_token, Xor):
-            node.add_node(self.match(Xor))
-            self.vm.add_op(Instruction.PUSH)
-            node.add_node(self.and_expr())
-            self.vm.add_op(Instruction.XOR)
-            node.add_node(self.xor_expr_tail())
-        return node
-
-    def and_expr(self):
-        node = Node("and_expr")
-        if self.debug:
-            logger.debug("and_expr:", self.current_token)
-        node.add_node(self.equal_expr())
-        node.add_node(self.and_expr_tail())
-        return node
-
-    def and_expr_tail(self):
-        node = Node("and_expr_tail")
-        if self.debug:
-            logger.debug("and_expr_tail:", self.current_token)
-        if isinstance(self.current_token, And):
-            node.add_node(self.match(And))
-            self.vm.add_op(Instruction.PUSH)
-            node.add_node(self.equal_expr())
-            self.vm.add_op(Instruction.AND)
-            node.add_node(self.and_expr_tail())
-        return node
-
-    def equal_expr(self):
-        node = Node("equal_expr")
-        if self.debug:
-            logger.debug("equal_expr:", self.current_token)
-        node.add_node(self.compare_expr())
-        node.add_node(self.equal_expr_tail())
+        node.add_node(self.binary_expr(0))
         return node
 
-    def equal_expr_tail(self):
-        node = Node("equal_expr_tail")
+    def binary_expr(self, min_precedence: int) -> Node:
+        """按优先级爬升解析二元表达式，只处理优先级不低于 min_precedence 的运算符。
+        两侧均为常量时丢弃已生成的代码，折叠为一条 IMM"""
         if self.debug:
-            logger.debug("equal_expr_tail:", self.current_token)
-        if isinstance(self.current_token, Eq):
-            node.add_node(self.match(Eq))
-            self.vm.add_op(Instruction.PUSH)
-            node.add_node(self.compare_expr())
-            self.vm.add_op(Instruction.EQ)
-            node.add_node(self.equal_expr_tail())
-        elif isinstance(self.current_token, Ne):
-            node.add_node(self.match(Ne))
-            self.vm.add_op(Instruction.PUSH)
-            node.add_node(self.compare_expr())
-            self.vm.add_op(Instruction.NE)
-            node.add_node(self.equal_expr_tail())
-        return node
-
-    def compare_expr(self):
-        node = Node("compare_expr")
-        if self.debug:
-            logger.debug("compare_expr:", self.current_token)
-        node.add_node(self.sum_expr())
-        node.add_node(self.compare_expr_tail())
-        return node
-
-    def compare_expr_tail(self):
-        node = Node("compare_expr_tail")
-        if self.debug:
-            logger.debug("compare_expr_tail:", self.current_token)
-        if isinstance(self.current_token, Lt):
-            node.add_node(self.match(Lt))
-            self.vm.add_op(Instruction.PUSH)
-            node.add_node(self.sum_expr())
-            self.vm.add_op(Instruction.LT)
-            node.add_node(self.compare_expr_tail())
-        elif isinstance(self.current_token, Gt):
-            node.add_node(self.match(Gt))
-            self.vm.add_op(Instruction.PUSH)
-            node.add_node(self.sum_expr())
-            self.vm.add_op(Instruction.GT)
-            node.add_node(self.compare_expr_tail())
-        elif isinstance(self.current_token, Le):
-            node.add_node(self.match(Le))
-            self.vm.add_op(Instruction.PUSH)
-            node.add_node(self.sum_expr())
-            self.vm.add_op(Instruction.LE)
-            node.add_node(self.compare_expr_tail())
-        elif isinstance(self.current_token, Ge):
-            node.add_node(self.match(Ge))
-            self.vm.add_op(Instruction.PUSH)
-            node.add_node(self.sum_expr())
-            self.vm.add_op(Instruction.GE)
-            node.add_node(self.compare_expr_tail())
-        return node
+            logger.debug(f"binary_expr({min_precedence}):", self.current_token)
+        start = self.vm.num_ops
+        lhs = self.factor()
+        constant = self.constant
+        while True:
+            operator = BINARY_OPERATORS.get(self.current_kind)  # type: ignore
+            if operator is None or operator[0] < min_precedence:
+                break
+            precedence, instruction = operator
+            node = self.new_node(NodeKind.binary_expr)
+            node.start = lhs.start
+            node.add_node(lhs)
+            node.add_node(self.match(self.current_kind))  # type: ignore
+            if instruction in SHORT_CIRCUIT_INSTRUCTIONS and constant is not None:
+                # 左值为常量时在编译期决定是否短路，右值仍需解析
+                self.rollback(start)
+                node.add_node(self.binary_expr(precedence + 1))
+                if (constant != 0) == (instruction == Instruction.JNZ):
+                    self.rollback(start)
+                    self.emit_constant(constant)
+                constant = self.constant
+            elif instruction in SHORT_CIRCUIT_INSTRUCTIONS:
+                # 短路求值：左值已能确定结果时跳过右值
+                self.vm.add_op(instruction)
+                self.add_address(Instruction.PLAC, Relocation.TEXT)
+                addr = self.vm.get_op_pointer(-1)
+                node.add_node(self.binary_expr(precedence + 1))
+                send_integer_to_pointer(addr, self.vm.get_op_pointer(0))
+                constant = None
+            else:
+                push = self.vm.num_ops
+                self.vm.add_op(Instruction.PUSH)
+                node.add_node(self.binary_expr(precedence + 1))
+                rhs = self.constant
+                constant = None if constant is None or rhs is None else fold_constant(instruction, constant, rhs)
+                if constant is not None:
+                    self.rollback(start)
+                    self.emit_constant(constant)
+                elif self.superinstructions and rhs is not None and instruction in (Instruction.ADD, Instruction.SUB):
+                    # PUSH; IMM c; ADD -> ADDI c
+                    self.rollback(push)
+                    self.vm.add_op(Instruction.ADDI)
+                    self.vm.add_op(rhs if instruction == Instruction.ADD else wrap_int64(-rhs))
+                else:
+                    self.vm.add_op(instruction)
+            lhs = node
+        self.constant = constant
+        return lhs
 
-    def sum_expr(self):
-        node = Node("sum_expr")
+    def factor(self):
+        node = self.new_node(NodeKind.factor)
         if self.debug:
-            logger.debug("sum_expr:", self.current_token)
-        node.add_node(self.term())
-        node.add_node(self.sum_expr_tail())
+            logger.debug("factor:", self.current_token)
+        handler = self.factor_handlers.get(self.current_kind)  # type: ignore
+        if handler is None:
+            raise CompileError(f"Unexpected symbol: {self.current_token}")
+        self.constant = None
+        handler(self, node)
         return node
 
-    def sum_expr_tail(self):
-        """term + sum_expr_tail1 - sum_expr_tail2 + sum_expr_tail3"""
-        node = Node("sum_expr_tail")
-        if self.debug:
-            logger.debug("sum_expr_tail:", self.current_token)
-        if isinstance(self.current_token, Add):
-            node.add_node(self.match(Add))
-            self.vm.add_op(Instruction.PUSH)
-            node.add_node(self.term())
-            self.vm.add_op(Instruction.ADD)
-            node.add_node(self.sum_expr_tail())
-        elif isinstance(self.current_token, Sub):
-            node.add_node(self.match(Sub))
-            self.vm.add_op(Instruction.PUSH)
-            node.add_node(self.term())
-            self.vm.add_op(Instruction.SUB)
-            node.add_node(self.sum_expr_tail())
-        return node
+    def id_factor(self, node: Node):
+        symbol = self.symbols.get_symbol(self.current_value)
+        node.add_node(self.match(Id))
+        if symbol.cls == IdClass.Var:
+            if IdLevel(symbol.level) == IdLevel.Global and self.superinstructions:
+                self.vm.add_op(Instruction.LGI)
+                self.add_symbol_address(symbol, Relocation.DATA)
+            elif IdLevel(symbol.level) == IdLevel.Global:
+                # 取全局变量
+                self.vm.add_op(Instruction.IMM)
+                self.add_symbol_address(symbol, Relocation.DATA)
+                self.vm.add_op(Instruction.LI)
+            elif self.superinstructions:
+                self.vm.add_op(Instruction.LLI)
+                self.vm.add_op(self.func_bp_index - symbol.value)
+            else:
+                # 取局部变量
+                self.vm.add_op(Instruction.LEA)
+                self.vm.add_op(self.func_bp_index - symbol.value)
+                self.vm.add_op(Instruction.LI)
+        elif symbol.cls == IdClass.Func or symbol.cls == IdClass.Sys:
+            assert self.current_kind is Lparbrak
+            # 函数调用
+            node.add_node(self.match(Lparbrak))
+            num_args = 0
+            while not self.current_kind is Rparbrak:
+                node.add_node(self.expr())
+                self.vm.add_op(Instruction.PUSH)
+                num_args += 1
+                if not self.current_kind is Comma:
+                    break
+                node.add_node(self.match(Comma))
+            node.add_node(self.match(Rparbrak))
+            if symbol.cls == IdClass.Func:
+                # 用户函数
+                self.vm.add_op(Instruction.CALL)
+                self.add_symbol_address(symbol, Relocation.TEXT)
+            else:
+                # 系统函数
+                self.vm.add_op(symbol.value)
+            if num_args > 0:
+                self.vm.add_op(Instruction.ADJ)
+                self.vm.add_op(num_args)
+        # 实参表达式可能是常量，调用结果不是
+        self.constant = None
 
-    def term(self):
-        node = Node("term")
-        if self.debug:
-            logger.debug("term:", self.current_token)
-        node.add_node(self.factor())
-        node.add_node(self.term_tail())
-        return node
+    def num_factor(self, node: Node):
+        self.emit_constant(self.current_value)
+        node.add_node(self.match(Num))
 
-    def term_tail(self):
-        """factor * term_tail1 / term_tail2 * term_tail3"""
-        node = Node("term_tail")
-        if self.debug:
-            logger.debug("term_tail:", self.current_token)
-        if isinstance(self.current_token, Mul):
-            node.add_node(self.match(Mul))
-            self.vm.add_op(Instruction.PUSH)
-            node.add_node(self.factor())
-            self.vm.add_op(Instruction.MUL)
-            node.add_node(self.term_tail())
-        elif isinstance(self.current_token, Div):
-            node.add_node(self.match(Div))
-            self.vm.add_op(Instruction.PUSH)
-            node.add_node(self.factor())
-            self.vm.add_op(Instruction.DIV)
-            node.add_node(self.term_tail())
-        elif isinstance(self.current_token, Mod):
-            node.add_node(self.match(Mod))
-            self.vm.add_op(Instruction.PUSH)
-            node.add_node(self.factor())
-            self.vm.add_op(Instruction.MOD)
-            node.add_node(self.term_tail())
-        return node
+    def chr_factor(self, node: Node):
+        self.emit_constant(ord(self.current_value))
+        node.add_node(self.match(Chr))
 
-    def factor(self):
-        node = Node("factor")
-        if self.debug:
-            logger.debug("factor:", self.current_token)
-        if isinstance(self.current_token, Id):
-            symbol = self.symbols.get_symbol(self.current_token.value)
-            node.add_node(self.match(Id))
-            if symbol.cls == IdClass.Var:
-                if IdLevel(symbol.level) == IdLevel.Global:
-                    # 取全局变量
-                    self.vm.add_op(Instruction.IMM)
-                    self.vm.add_op(symbol.value)
-                    self.vm.add_op(Instruction.LI)
-                else:
-                    # 取局部变量
-                    self.vm.add_op(Instruction.LEA)
-                    self.vm.add_op(self.func_bp_index - symbol.value)
-                    self.vm.add_op(Instruction.LI)
-            elif symbol.cls == IdClass.Func or symbol.cls == IdClass.Sys:
-                assert isinstance(self.current_token, Lparbrak)
-                # 函数调用
-                node.add_node(self.match(Lparbrak))
-                num_args = 0
-                while not isinstance(self.current_token, Rparbrak):
-                    node.add_node(self.expr())
-                    self.vm.add_op(Instruction.PUSH)
-                    num_args += 1
-                    if not isinstance(self.current_token, Comma):
-                        break
-                    node.add_node(self.match(Comma))
-                node.add_node(self.match(Rparbrak))
-                if symbol.cls == IdClass.Func:
-                    # 用户函数
-                    self.vm.add_op(Instruction.CALL)
-                    self.vm.add_op(symbol.value)
-                else:
-                    # 系统函数
-                    self.vm.add_op(symbol.value)
-                if num_args > 0:
-                    self.vm.add_op(Instruction.ADJ)
-                    self.vm.add_op(num_args)
-        elif isinstance(self.current_token, Num):
-            self.vm.add_op(Instruction.IMM)
-            self.vm.add_op(self.current_token.value)
-            node.add_node(self.match(Num))
-        elif isinstance(self.current_token, Chr):
-            self.vm.add_op(Instruction.IMM)
-            self.vm.add_op(ord(self.current_token.value))
-            node.add_node(self.match(Chr))
-        elif isinstance(self.current_token, Lparbrak):
-            node.add_node(self.match(Lparbrak))
-            node.add_node(self.expr())
-            node.add_node(self.match(Rparbrak))
-        else:
-            raise Exception(f"Unexpected symbol: {self.current_token}")
-        return node
+    def paren_factor(self, node: Node):
+        node.add_node(self.match(Lparbrak))
+        node.add_node(self.expr())
+        node.add_node(self.match(Rparbrak))
 
     def type(self):
-        node = Node("type")
+        node = self.new_node(NodeKind.type)
         if self.debug:
             logger.debug("type:", self.current_token)
-        if isinstance(self.current_token, Int):
+        if self.current_kind is Int:
             node.add_node(self.match(Int))
             self.base_type = IdType.Int
-        elif isinstance(self.current_token, Float):
+        elif self.current_kind is Float:
             node.add_node(self.match(Float))
             self.base_type = IdType.Float
-        elif isinstance(self.current_token, Char):
+        elif self.current_kind is Char:
             node.add_node(self.match(Char))
             self.base_type = IdType.Char
-        elif isinstance(self.current_token, Void):
+        elif self.current_kind is Void:
             node.add_node(self.match(Void))
             self.base_type = IdType.Void
         else:
-            raise Exception(f"Unexpected symbol: {self.current_token}")
+            raise CompileError(f"Unexpected symbol: {self.current_token}")
         return node
 
     def declare(self):
         # 局部变量声明
-        node = Node("declare")
+        node = self.new_node(NodeKind.declare)
         if self.debug:
             logger.debug("declare:", self.current_token)
         node.add_node(self.type())
-        id_token = self.current_token
-        assert isinstance(id_token, Id)
+        id_name = self.current_value
         node.add_node(self.match(Id))
         assert IdLevel(self.symbols.level) == IdLevel.Local
         self.func_num_local_vars += 1
 
         symbol = Symbol(
-            name=id_token.value,
+            name=id_name,
             cls=IdClass.Var,
             data_type=self.base_type,
             level=IdLevel(self.symbols.level),
@@ -456,130 +409,156 @@ class Parser:
         return node
 
     def stmt(self):
-        node = Node("stmt")
+        node = self.new_node(NodeKind.stmt)
         if self.debug:
             logger.debug("stmt:", self.current_token)
-        if isinstance(self.current_token, Id):
-            id_name = self.current_token.value
-            symbol = self.symbols.get_symbol(id_name)
-            if IdLevel(symbol.level) == IdLevel.Global:
-                self.vm.add_op(Instruction.IMM)
-                self.vm.add_op(symbol.value)
-            else:
-                self.vm.add_op(Instruction.LEA)
-                self.vm.add_op(self.func_bp_index - symbol.value)
-            self.vm.add_op(Instruction.PUSH)
+        handler = self.stmt_handlers.get(self.current_kind)  # type: ignore
+        if handler is not None:
+            handler(self, node)
+        return node
+
+    def assign_stmt(self, node: Node):
+        id_name = self.current_value
+        symbol = self.symbols.get_symbol(id_name)
+        if IdLevel(symbol.level) != IdLevel.Global and self.superinstructions:
+            # 先求值再由 SLI 直接存入局部变量，不需要压栈地址
             node.add_node(self.match(Id))
             node.add_node(self.match(Assign))
             node.add_node(self.expr())
             node.add_node(self.match(Semi))
-
-            self.vm.add_op(Instruction.SI)
-        elif isinstance(self.current_token, (Int, Float, Char, Void)):
-            node.add_node(self.declare())
-            node.add_node(self.match(Semi))
-        elif isinstance(self.current_token, Return):
-            node.add_node(self.match(Return))
-            node.add_node(self.expr())
-            node.add_node(self.match(Semi))
-            self.vm.add_op(Instruction.LEV)
-        elif isinstance(self.current_token, If):
-            node.add_node(self.match(If))
-            node.add_node(self.match(Lparbrak))
-            node.add_node(self.expr())
-            node.add_node(self.match(Rparbrak))
-            self.vm.add_op(Instruction.JZ)
-            self.vm.add_op(Instruction.PLAC)  # placeholder for jump address
+            self.vm.add_op(Instruction.SLI)
+            self.vm.add_op(self.func_bp_index - symbol.value)
+            return
+        if IdLevel(symbol.level) == IdLevel.Global:
+            self.vm.add_op(Instruction.IMM)
+            self.add_symbol_address(symbol, Relocation.DATA)
+        else:
+            self.vm.add_op(Instruction.LEA)
+            self.vm.add_op(self.func_bp_index - symbol.value)
+        self.vm.add_op(Instruction.PUSH)
+        node.add_node(self.match(Id))
+        node.add_node(self.match(Assign))
+        node.add_node(self.expr())
+        node.add_node(self.match(Semi))
+
+        self.vm.add_op(Instruction.SI)
+
+    def declare_stmt(self, node: Node):
+        node.add_node(self.declare())
+        node.add_node(self.match(Semi))
+
+    def return_stmt(self, node: Node):
+        node.add_node(self.match(Return))
+        node.add_node(self.expr())
+        node.add_node(self.match(Semi))
+        self.vm.add_op(Instruction.LEV)
+
+    def if_stmt(self, node: Node):
+        node.add_node(self.match(If))
+        node.add_node(self.match(Lparbrak))
+        node.add_node(self.expr())
+        node.add_node(self.match(Rparbrak))
+        self.vm.add_op(Instruction.JZ)
+        self.add_address(Instruction.PLAC, Relocation.TEXT)  # placeholder for jump address
+        jump_address = self.vm.get_op_pointer(-1)
+        node.add_node(self.stmt())
+        if self.current_kind is Else:
+            node.add_node(self.match(Else))
+            jump_to = self.vm.get_op_pointer(2)
+            send_integer_to_pointer(jump_address, jump_to)
+            self.vm.add_op(Instruction.JMP)
+            self.add_address(Instruction.PLAC, Relocation.TEXT)
             jump_address = self.vm.get_op_pointer(-1)
             node.add_node(self.stmt())
-            if isinstance(self.current_token, Else):
-                node.add_node(self.match(Else))
-                jump_to = self.vm.get_op_pointer(2)
-                send_integer_to_pointer(jump_address, jump_to)
-                self.vm.add_op(Instruction.JMP)
-                self.vm.add_op(Instruction.PLAC)
-                jump_address = self.vm.get_op_pointer(-1)
-                node.add_node(self.stmt())
-            jump_to = self.vm.get_op_pointer(0)
-            send_integer_to_pointer(jump_address, jump_to)
-        elif isinstance(self.current_token, While):
-            node.add_node(self.match(While))
+        jump_to = self.vm.get_op_pointer(0)
+        send_integer_to_pointer(jump_address, jump_to)
 
-            loop_start = self.vm.get_op_pointer(0)
+    def while_stmt(self, node: Node):
+        node.add_node(self.match(While))
 
-            node.add_node(self.match(Lparbrak))
-            node.add_node(self.expr())
-            node.add_node(self.match(Rparbrak))
+        loop_start = self.vm.get_op_pointer(0)
 
-            self.vm.add_op(Instruction.JZ)
-            self.vm.add_op(Instruction.PLAC)
-            loop_end = self.vm.get_op_pointer(-1)
+        node.add_node(self.match(Lparbrak))
+        node.add_node(self.expr())
+        node.add_node(self.match(Rparbrak))
 
-            node.add_node(self.stmt())
+        self.vm.add_op(Instruction.JZ)
+        self.add_address(Instruction.PLAC, Relocation.TEXT)
+        loop_end = self.vm.get_op_pointer(-1)
 
-            self.vm.add_op(Instruction.JMP)
-            self.vm.add_op(loop_start)
-            send_integer_to_pointer(loop_end, self.vm.get_op_pointer(0))
-        elif isinstance(self.current_token, Lcurbrak):
-            node.add_node(self.match(Lcurbrak))
-            node.add_node(self.stmts())
-            node.add_node(self.match(Rcurbrak))
-        return node
+        node.add_node(self.stmt())
+
+        self.vm.add_op(Instruction.JMP)
+        self.add_address(loop_start, Relocation.TEXT)
+        send_integer_to_pointer(loop_end, self.vm.get_op_pointer(0))
+
+    def block_stmt(self, node: Node):
+        node.add_node(self.match(Lcurbrak))
+        node.add_node(self.stmts())
+        node.add_node(self.match(Rcurbrak))
 
     def else_branch(self):
-        node = Node("else_branch")
+        node = self.new_node(NodeKind.else_branch)
         if self.debug:
             logger.debug("else_branch:", self.current_token)
-        if isinstance(self.current_token, Else):
+        if self.current_kind is Else:
             node.add_node(self.match(Else))
             node.add_node(self.stmt())
         return node
 
     def stmts(self):
-        node = Node("stmts")
+        node = self.new_node(NodeKind.stmts)
         if self.debug:
             logger.debug("stmts:", self.current_token)
-        if isinstance(self.current_token, (Id, Num, Chr, Lparbrak, Int, Float, Char, Void, Return, If, While)):
+        while self.current_kind in self.stmt_handlers:
             node.add_node(self.stmt())
-            node.add_node(self.stmts())
+        if self.current_kind in (Num, Chr, Lparbrak):
+            # 不支持表达式语句
+            raise CompileError(f"Unexpected symbol: {self.current_token}")
         return node
 
-    def start(self):
-        node = Node("start")
+    def start(self) -> Optional[Node]:
+        node = self.new_node(NodeKind.start)
         if self.debug:
             logger.debug("start:", self.current_token)
-        if isinstance(self.current_token, (Int, Float, Char, Void)):
+        while self.current_kind in (Int, Float, Char, Void, Extern):
             node.add_node(self.start_tail())
-            node.add_node(self.start())
-        return node
+        self.resolve_externals()
+        return node if self.build_ast else None
 
     def start_tail(self):
-        node = Node("start_tail")
+        node = self.new_node(NodeKind.start_tail)
         if self.debug:
             logger.debug("start_tail:", self.current_token)
+        # extern 声明的符号在其他单元中定义，链接时解析
+        is_extern = self.current_kind is Extern
+        if is_extern:
+            node.add_node(self.match(Extern))
         node.add_node(self.type())
-        id_token = self.current_token
+        id_name = self.current_value
         node.add_node(self.match(Id))
-        assert isinstance(id_token, Id)
-        if isinstance(self.current_token, Lparbrak):
-            # 函数声明
-            func_ptr = self.vm.get_op_pointer(offset=0)
-            symbol = Symbol(
-                name=id_token.value,
-                cls=IdClass.Func,
-                data_type=self.base_type,
-                level=IdLevel(self.symbols.level),
-                value=func_ptr,
+        if self.current_kind is Lparbrak:
+            # 函数声明，有函数体时才是定义
+            symbol = self.declare_global(
+                Symbol(
+                    name=id_name,
+                    cls=IdClass.Func,
+                    data_type=self.base_type,
+                    level=IdLevel(self.symbols.level),
+                    value=None,
+                )
             )
-            self.symbols.set_symbol(symbol)
             self.symbols.enter_scope()
             self.reset_func_recorders()
             node.add_node(self.match(Lparbrak))
             node.add_node(self.func_params())
             node.add_node(self.match(Rparbrak))
-            if isinstance(self.current_token, Lcurbrak):
+            if self.current_kind is Lcurbrak:
+                if symbol.value is not None:
+                    raise CompileError(f"name {id_name} already exists")
+                symbol.value = self.vm.get_op_pointer(offset=0)
                 node.add_node(self.match(Lcurbrak))
-                while isinstance(self.current_token, (Int, Char, Void, Float)):
+                while self.current_kind in (Int, Char, Void, Float):
                     self.declare()
                     self.match(Semi)
                 self.vm.add_op(Instruction.ENT)
@@ -587,13 +566,15 @@ class Parser:
                 node.add_node(self.stmts())
                 node.add_node(self.match(Rcurbrak))
                 self.vm.add_op(Instruction.LEV)
+            else:
+                node.add_node(self.match(Semi))
             self.symbols.leave_scope()
         else:
             # 全局变量声明
             assert IdLevel(self.symbols.level) == IdLevel.Global
-            data_ptr = self.vm.put_int_onto_data(0)
+            data_ptr = None if is_extern else self.vm.put_int_onto_data(0)
             symbol = Symbol(
-                name=id_token.value,
+                name=id_name,
                 cls=IdClass.Var,
                 data_type=self.base_type,
                 level=IdLevel(self.symbols.level),
@@ -601,20 +582,19 @@ class Parser:
             )
 
             node.add_node(self.match(Semi))
-            self.symbols.set_symbol(symbol)
+            self.declare_global(symbol)
         return node
 
     def func_params(self):
-        node = Node("func_params")
+        node = self.new_node(NodeKind.func_params)
         if self.debug:
             logger.debug("func_params:", self.current_token)
-        while isinstance(self.current_token, (Int, Float, Char, Void)):
+        while self.current_kind in (Int, Float, Char, Void):
             node.add_node(self.type())
-            id_token = self.current_token
+            id_name = self.current_value
             node.add_node(self.match(Id))
-            assert isinstance(id_token, Id)
             symbol = Symbol(
-                name=id_token.value,
+                name=id_name,
                 cls=IdClass.Var,
                 data_type=self.base_type,
                 level=IdLevel(self.symbols.level),
@@ -623,23 +603,53 @@ class Parser:
             self.func_num_params += 1
             self.func_bp_index = self.func_num_params + 1
             self.symbols.set_symbol(symbol)
-            if not isinstance(self.current_token, Comma):
+            if not self.current_kind is Comma:
                 break
             node.add_node(self.match(Comma))
         return node
 
+    # 按当前 token 类型分派到对应的产生式
+    stmt_handlers: ClassVar[dict[Type[Token], Callable[["Parser", Node], None]]] = {
+        Id: assign_stmt,
+        Int: declare_stmt,
+        Float: declare_stmt,
+        Char: declare_stmt,
+        Void: declare_stmt,
+        Return: return_stmt,
+        If: if_stmt,
+        While: while_stmt,
+        Lcurbrak: block_stmt,
+    }
+    factor_handlers: ClassVar[dict[Type[Token], Callable[["Parser", Node], None]]] = {
+        Id: id_factor,
+        Num: num_factor,
+        Chr: chr_factor,
+        Lparbrak: paren_factor,
+    }
+
     def match(self, token_cls: Type[Token]):
-        if isinstance(self.current_token, token_cls):
-            node = TerminalNode(str(self.current_token))
+        if self.current_kind is token_cls:
+            if self.build_ast:
+                node = TerminalNode(token_cls.kind, self.current_value, self.current_start, self.current_end)
+            else:
+                node = NULL_NODE
             if self.debug:
                 logger.debug(f"match {self.current_token} -> {token_cls.__name__}")
-            self.current_token = self.next_token()
+            self.next_token()
             return node
         else:
-            raise Exception(f"{self.current_token} does not match {token_cls.__name__}")
+            raise CompileError(f"{self.current_token} does not match {token_cls.__name__}")
 
-    def next_token(self) -> Optional[Token]:
-        try:
-            return self.lexer.__next__()
-        except StopIteration:
+    @property
+    def current_token(self) -> Optional[Token]:
+        # 仅在调试与报错时按需构造 Token 对象
+        if self.current_kind is None:
             return None
+        return self.current_kind.from_value(self.current_value)
+
+    def next_token(self):
+        last_end = self.current_end
+        self.current_kind, self.current_value, self.current_start, self.current_end = next(self.tokens, END_OF_TOKENS)
+        if self.current_kind is None:
+            # 到达结尾后的空产生式位于最后一个 token 之后
+            self.current_start = self.current_end = last_end
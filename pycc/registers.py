@@ -0,0 +1,410 @@
+"""寄存器虚拟机的代码生成（--vm register）。
+
+把栈式虚拟机的镜像翻译为寄存器虚拟机的镜像：16 个通用寄存器，三地址指令。
+栈式代码中的表达式栈在编译期模拟，第 i 个压栈的值固定放在 r[i]，
+ax 的值放在 r[当前栈深]，因此函数的返回值与栈深为 0 时的 ax 都在 r0 中。
+局部变量地址与立即数延迟到使用时生成，LEA k; LI 与 IMM g; LI 合并为 LDL/LDG，
+存值时地址为局部或全局变量则直接 STL/STG，加减立即数合并为 ADDI。
+
+调用函数时表达式栈中实参之下仍在寄存器里的值先压栈保存，随后依次压入实参，
+返回后把 r0 中的返回值移到调用结果所在的寄存器，再弹出保存的值。
+跳转与跳转目标处的表达式栈与 ax（跳转目标处仍会被读取时）都放回各自固定的寄存器，
+各个跳转目标处的栈深与 ax 是否仍会被读取由对栈式代码的数据流分析得到。
+常量条件的跳转在翻译时决定，总是跳转时其后直到下一个跳转目标的指令都不可达。
+
+表达式栈深到寄存器放不下的函数整体改为溢出到虚拟机栈：表达式栈中的值都用 PUSH 压栈，
+ax 固定放在 r0，弹出的左操作数 POP 到 r1，调用时实参已按顺序在栈上。
+"""
+from array import array
+from bisect import bisect_left
+from dataclasses import dataclass
+from typing import NamedTuple, Optional
+
+from pycc.flow import BINARY_OPCODES, SYSTEM_OPCODES, StackFlow
+from pycc.image import Image, SymbolRecord
+from pycc.optimizer import SLOT_BYTES, Op
+from pycc.parser import wrap_int64
+from pycc.vm import NUM_REGISTERS, Instruction, InstructionSet, RegisterInstruction, Relocation
+
+# 栈式二元运算指令 -> 寄存器三地址指令
+BINARY_INSTRUCTIONS = {
+    Instruction[name].value: RegisterInstruction[name]
+    for name in "OR XOR AND EQ NE LT GT LE GE SHL SHR ADD SUB MUL DIV MOD".split()
+}
+
+
+class Value(NamedTuple):
+    """表达式栈中的值或 ax：reg 为寄存器 r[value]，lea 为地址 bp + value，imm 为立即数或地址"""
+
+    kind: str
+    value: int
+    relocation: Optional[int] = None
+    external: Optional[str] = None
+
+
+@dataclass
+class RegisterOp:
+    word: int  # 操作码与寄存器字段
+    operand: Optional[int] = None
+    relocation: Optional[int] = None
+    external: Optional[str] = None
+    target: Optional[int] = None  # 跳转目标在栈式代码段中的下标
+
+    @property
+    def size(self) -> int:
+        return 1 if self.operand is None else 2
+
+
+# 溢出模式下 ax 与弹出的左操作数所在的寄存器
+SPILL_AX = 0
+SPILL_OPERAND = 1
+
+
+def register(index: int) -> int:
+    # 栈深超过寄存器数的函数在溢出模式下翻译，这里只检查内部一致性
+    assert index < NUM_REGISTERS, f"expression stack depth {index} exceeds the register file"
+    return index
+
+
+class RegisterTranslator:
+    def __init__(self, image: Image):
+        if image.instruction_set != InstructionSet.STACK:
+            raise ValueError("image is not stack machine code")
+        self.image = image
+        flow = StackFlow(image)
+        self.ops = flow.ops
+        self.positions = flow.positions
+        self.depths = flow.depths
+        self.live = flow.live
+        self.labels = flow.labels
+        self.num_args = flow.num_args
+        # 各函数入口的下标，以及从函数入口开始的函数中表达式栈的最大深度
+        entries = [position for position, op in enumerate(self.ops) if op.opcode == Instruction.ENT.value]
+        self.max_depths = {
+            start: max((self.depths.get(position, 0) for position in range(start, stop)), default=0)
+            for start, stop in zip(entries, [*entries[1:], len(self.ops)])
+        }
+        self.spill = False  # 当前函数的表达式栈是否溢出到虚拟机栈
+        self.out: list[RegisterOp] = []
+        self.starts: list[tuple[int, int]] = []  # (栈式指令下标, 翻译结果在 out 中的起始位置)
+        self.entries: Optional[list[Value]] = None  # 表达式栈，为 None 时不可达
+        self.ax: Optional[Value] = None
+
+    def emit(
+        self,
+        instruction: RegisterInstruction,
+        a: int = 0,
+        b: int = 0,
+        c: int = 0,
+        operand: Optional[int] = None,
+        relocation: Optional[int] = None,
+        external: Optional[str] = None,
+        target: Optional[int] = None,
+    ):
+        word = instruction.value | a << 8 | b << 16 | c << 24
+        self.out.append(RegisterOp(word, operand, relocation, external, target))
+
+    def slot(self, depth: int) -> int:
+        """栈深为 depth 时 ax 所在的寄存器"""
+        return SPILL_AX if self.spill else register(depth)
+
+    def operand(self, index: int) -> int:
+        """弹出表达式栈中第 index 个值时载入的寄存器"""
+        return SPILL_OPERAND if self.spill else register(index)
+
+    def materialize(self, value: Value, r: int) -> int:
+        """返回保存 value 的寄存器，延迟生成的地址与立即数载入 r，已溢出到栈上的值弹出到 r"""
+        if value.kind == "reg":
+            return value.value
+        if value.kind == "stack":
+            self.emit(RegisterInstruction.POP, r)
+        elif value.kind == "lea":
+            self.emit(RegisterInstruction.LEA, register(r), operand=value.value)
+        else:
+            self.emit(
+                RegisterInstruction.LI,
+                register(r),
+                operand=value.value,
+                relocation=value.relocation,
+                external=value.external,
+            )
+        return r
+
+    def accumulator(self) -> Value:
+        if self.ax is None:
+            raise ValueError("ax is read before it is set")
+        return self.ax
+
+    def canonicalize(self, position: int):
+        """把表达式栈与仍会被读取的 ax 放回跳转目标 position 处约定的寄存器"""
+        entries = self.entries
+        assert entries is not None
+        depth = len(entries)
+        if depth != self.depths[position]:
+            raise ValueError(f"inconsistent stack depth at {self.ops[position].index}")
+        if self.live[position]:
+            ax = self.accumulator()
+            r = self.slot(depth)
+            if ax.kind == "reg" and ax.value != r:
+                self.emit(RegisterInstruction.MOV, r, ax.value)
+            elif ax.kind != "reg":
+                self.materialize(ax, r)
+            self.ax = Value("reg", r)
+        for j, entry in enumerate(entries):
+            if entry.kind in ("lea", "imm"):
+                self.materialize(entry, j)
+                entries[j] = Value("reg", j)
+
+    def run(self) -> Image:
+        consumed = set()
+        for position, op in enumerate(self.ops):
+            if position in consumed:
+                continue
+            if position not in self.depths:
+                # 不可达的指令不翻译
+                self.entries = None
+                continue
+            if position in self.max_depths:
+                self.spill = self.max_depths[position] >= NUM_REGISTERS
+            if position in self.labels:
+                if self.entries is not None:
+                    self.canonicalize(position)
+                depth = self.depths[position]
+                if self.spill:
+                    self.entries = [Value("stack", 0)] * depth
+                else:
+                    self.entries = [Value("reg", j) for j in range(depth)]
+                self.ax = Value("reg", self.slot(depth)) if self.live[position] else None
+            elif self.entries is None:
+                # 总是跳转的常量条件之后，直到下一个跳转目标都不可达
+                continue
+            self.starts.append((op.index, len(self.out)))
+            if op.opcode in (Instruction.CALL.value, *SYSTEM_OPCODES):
+                # 调用之后的 ADJ 弹出实参
+                num_args = self.num_args(position)
+                if num_args is not None:
+                    consumed.add(position + 1)
+                self.call(op, num_args or 0)
+            else:
+                self.translate(op, position)
+        return self.encode()
+
+    def call(self, op: Op, num_args: int):
+        entries = self.entries
+        assert entries is not None
+        depth = len(entries)
+        base = depth - num_args
+        if base < 0:
+            raise ValueError(f"stack underflow at {op.index}")
+        # 被调用的函数会改写全部寄存器
+        saved = [j for j in range(base) if entries[j].kind == "reg"]
+        for j in saved:
+            self.emit(RegisterInstruction.PUSH, j)
+        for entry in entries[base:]:
+            if entry.kind == "stack":
+                # 溢出模式下实参已按顺序在栈上
+                continue
+            r = self.materialize(entry, self.slot(depth)) if entry.kind != "reg" else entry.value
+            self.emit(RegisterInstruction.PUSH, r)
+        if op.opcode == Instruction.CALL.value:
+            self.emit(RegisterInstruction.CALL, operand=op.operand, relocation=op.relocation, external=op.external)
+        else:
+            self.emit(RegisterInstruction.SYS, op.opcode, num_args)
+        if num_args:
+            self.emit(RegisterInstruction.ADJ, operand=num_args)
+        del entries[base:]
+        r = self.slot(base)
+        if r != 0:
+            self.emit(RegisterInstruction.MOV, r, 0)
+        for j in reversed(saved):
+            self.emit(RegisterInstruction.POP, j)
+        self.ax = Value("reg", r)
+
+    def translate(self, op: Op, position: int):
+        entries = self.entries
+        assert entries is not None
+        depth = len(entries)
+        opcode = op.opcode
+        if opcode == Instruction.LEA.value:
+            self.ax = Value("lea", op.operand)  # type: ignore
+        elif opcode == Instruction.IMM.value:
+            self.ax = Value("imm", op.operand, op.relocation, op.external)  # type: ignore
+        elif opcode in (Instruction.LI.value, Instruction.LLI.value, Instruction.LGI.value):
+            r = self.slot(depth)
+            address = self.accumulator() if opcode == Instruction.LI.value else None
+            if opcode == Instruction.LLI.value or (address is not None and address.kind == "lea"):
+                offset = op.operand if address is None else address.value
+                self.emit(RegisterInstruction.LDL, r, operand=offset)
+            elif opcode == Instruction.LGI.value:
+                self.emit(
+                    RegisterInstruction.LDG, r, operand=op.operand, relocation=op.relocation, external=op.external
+                )
+            elif address is not None and address.kind == "imm":
+                self.emit(
+                    RegisterInstruction.LDG,
+                    r,
+                    operand=address.value,
+                    relocation=address.relocation,
+                    external=address.external,
+                )
+            else:
+                self.emit(RegisterInstruction.LD, r, address.value)  # type: ignore
+            self.ax = Value("reg", r)
+        elif opcode == Instruction.LC.value:
+            r = self.slot(depth)
+            self.emit(RegisterInstruction.LDC, r, self.materialize(self.accumulator(), r))
+            self.ax = Value("reg", r)
+        elif opcode == Instruction.PUSH.value:
+            ax = self.accumulator()
+            r = self.slot(depth)
+            if self.spill:
+                r = self.materialize(ax, r)
+                self.emit(RegisterInstruction.PUSH, r)
+                self.ax = Value("reg", r)
+                entries.append(Value("stack", 0))
+                return
+            if ax.kind == "reg" and ax.value != r:
+                self.emit(RegisterInstruction.MOV, r, ax.value)
+                ax = self.ax = Value("reg", r)
+            entries.append(ax)
+        elif opcode in (Instruction.SI.value, Instruction.SC.value):
+            address = entries.pop()
+            value = self.materialize(self.accumulator(), self.slot(depth))
+            self.ax = Value("reg", value)
+            if opcode == Instruction.SC.value:
+                if not self.spill and value < depth - 1:
+                    # STC 把截断后的值写回寄存器，不能改写表达式栈中的值
+                    self.emit(RegisterInstruction.MOV, depth, value)
+                    value = depth
+                    self.ax = Value("reg", value)
+                self.emit(RegisterInstruction.STC, self.materialize(address, self.operand(depth - 1)), value)
+            elif address.kind == "lea":
+                self.emit(RegisterInstruction.STL, value, operand=address.value)
+            elif address.kind == "imm":
+                self.emit(
+                    RegisterInstruction.STG,
+                    value,
+                    operand=address.value,
+                    relocation=address.relocation,
+                    external=address.external,
+                )
+            else:
+                self.emit(RegisterInstruction.ST, self.materialize(address, self.operand(depth - 1)), value)
+        elif opcode == Instruction.SLI.value:
+            value = self.materialize(self.accumulator(), self.slot(depth))
+            self.emit(RegisterInstruction.STL, value, operand=op.operand)
+            self.ax = Value("reg", value)
+        elif opcode == Instruction.ADDI.value:
+            r = self.slot(depth)
+            self.emit(
+                RegisterInstruction.ADDI,
+                r,
+                self.materialize(self.accumulator(), r),
+                operand=op.operand,
+                relocation=op.relocation,
+                external=op.external,
+            )
+            self.ax = Value("reg", r)
+        elif opcode in BINARY_OPCODES:
+            lhs = entries.pop()
+            rhs = self.accumulator()
+            r = self.slot(depth - 1)
+            if (
+                opcode in (Instruction.ADD.value, Instruction.SUB.value)
+                and rhs.kind == "imm"
+                and rhs.relocation is None
+                and rhs.external is None
+            ):
+                constant = rhs.value if opcode == Instruction.ADD.value else wrap_int64(-rhs.value)
+                self.emit(RegisterInstruction.ADDI, r, self.materialize(lhs, self.operand(depth - 1)), operand=constant)
+            else:
+                rhs_register = self.materialize(rhs, self.slot(depth))
+                lhs_register = self.materialize(lhs, self.operand(depth - 1))
+                self.emit(BINARY_INSTRUCTIONS[opcode], r, lhs_register, rhs_register)
+            self.ax = Value("reg", r)
+        elif opcode == Instruction.ADJ.value:
+            # 不是调用之后的 ADJ：被弹出的值只有溢出模式下才真正压栈
+            if num_spilled := sum(entry.kind == "stack" for entry in entries[depth - op.operand :]):  # type: ignore
+                self.emit(RegisterInstruction.ADJ, operand=num_spilled)
+            del entries[depth - op.operand :]  # type: ignore
+        elif opcode == Instruction.ENT.value:
+            self.emit(RegisterInstruction.ENT, operand=op.operand)
+            self.entries = []
+            self.ax = None
+        elif opcode == Instruction.LEV.value:
+            if (ax := self.ax) is not None and not (ax.kind == "reg" and ax.value == 0):
+                if ax.kind == "reg":
+                    self.emit(RegisterInstruction.MOV, 0, ax.value)
+                else:
+                    self.materialize(ax, 0)
+            self.emit(RegisterInstruction.LEV)
+            self.entries = None
+        elif opcode == Instruction.JMP.value:
+            self.jump(RegisterInstruction.JMP, op)
+        elif opcode in (Instruction.JZ.value, Instruction.JNZ.value):
+            ax = self.accumulator()
+            if ax.kind == "imm" and ax.relocation is None and ax.external is None:
+                # 条件为常量时在翻译时决定是否跳转
+                if (ax.value == 0) == (opcode == Instruction.JZ.value):
+                    self.jump(RegisterInstruction.JMP, op)
+                return
+            instruction = RegisterInstruction.JZ if opcode == Instruction.JZ.value else RegisterInstruction.JNZ
+            self.jump(instruction, op)
+        else:
+            raise ValueError(f"cannot translate {Instruction(opcode).name} at {op.index}")
+
+    def jump(self, instruction: RegisterInstruction, op: Op):
+        self.canonicalize(self.positions[op.target])  # type: ignore
+        condition = 0
+        if instruction != RegisterInstruction.JMP:
+            condition = self.materialize(self.accumulator(), self.slot(len(self.entries)))  # type: ignore
+            self.ax = Value("reg", condition)
+        self.emit(instruction, condition, operand=0, relocation=Relocation.TEXT.value, target=op.target)
+        if instruction == RegisterInstruction.JMP:
+            self.entries = None
+
+    def encode(self) -> Image:
+        slots = []
+        num_slots = 0
+        for item in self.out:
+            slots.append(num_slots)
+            num_slots += item.size
+        old_indices = [index for index, _ in self.starts]
+        # 栈式指令在寄存器代码段中的字节偏移，不可达的指令映射到其后第一条翻译过的指令
+        new_offsets = [(slots[start] if start < len(slots) else num_slots) * SLOT_BYTES for _, start in self.starts]
+
+        def remap(offset: int) -> int:
+            i = bisect_left(old_indices, offset // SLOT_BYTES)
+            return new_offsets[i] if i < len(new_offsets) else num_slots * SLOT_BYTES
+
+        text = array("q")
+        relocations = array("q")
+        externals = []
+        for item in self.out:
+            text.append(item.word)
+            if item.operand is None:
+                continue
+            if item.relocation is not None:
+                relocations.append(len(text) << 1 | item.relocation)
+            if item.external is not None:
+                externals.append((len(text), item.external))
+            if item.target is not None:
+                text.append(remap(item.target * SLOT_BYTES))
+            elif item.relocation == Relocation.TEXT.value and item.external is None:
+                text.append(remap(item.operand))
+            else:
+                text.append(item.operand)
+
+        symbols: list[SymbolRecord] = [
+            (key, name, cls, data_type, level, remap(value), relocation)
+            if relocation == Relocation.TEXT.value
+            else (key, name, cls, data_type, level, value, relocation)
+            for key, name, cls, data_type, level, value, relocation in self.image.symbols
+        ]
+        entry = None if self.image.entry is None else remap(self.image.entry)
+        return Image(text.tobytes(), self.image.data, relocations, entry, symbols, externals, InstructionSet.REGISTER)
+
+
+def to_registers(image: Image) -> Image:
+    """把栈式虚拟机的镜像翻译为寄存器虚拟机的镜像"""
+    return RegisterTranslator(image).run()
@@ -2,6 +2,8 @@ from enum import Enum
 from dataclasses import dataclass
 from typing import Type, Any, Optional
 
+from pycc.lexer import CompileError
+
 
 class IdType(Enum):
     Void = 0
@@ -60,7 +62,7 @@ class SymbolTable(dict[str, Symbol]):
 
     def set_symbol(self, symbol: Symbol) -> Symbol:
         if self.get(self.calc_key(symbol.name, self.scope_id)):
-            raise Exception(f"name {symbol.name} already exists")
+            raise CompileError(f"name {symbol.name} already exists")
         self[self.calc_key(symbol.name, self.scope_id)] = symbol
         return symbol
 
@@ -68,7 +70,7 @@ class SymbolTable(dict[str, Symbol]):
         for scope_id in reversed(self.scope_stack + [self.scope_id]):
             if (symbol := self.get(self.calc_key(name, scope_id))) is not None:
                 return symbol
-        raise Exception(f"name {name} is not defined")
+        raise CompileError(f"name {name} is not defined")
 
     @staticmethod
     def calc_key(name: str, level: int) -> str:
@@ -0,0 +1,130 @@
+import argparse
+import os
+import struct
+import sys
+from typing import Any, Iterator, NamedTuple, Optional, Union
+
+from pycc.vm import Instruction, InstructionSet, RegisterInstruction
+
+# 执行轨迹文件：文件头之后是按执行顺序排列的记录，整数均为本机字节序，
+# 每条记录的布局与 libvm.hpp 中的 TraceRecordCpp 一致
+TRACE_MAGIC = b"PYCT"
+TRACE_VERSION = 1
+TRACE_HEADER = struct.Struct("=4sIIIq")
+TRACE_RECORD = struct.Struct("=6q")
+TRACE_SUFFIX = ".pyct"
+DEFAULT_TRACE_SIZE = 1 << 20
+PathLike = Union[str, "os.PathLike[str]"]
+
+
+class TraceRecord(NamedTuple):
+    """执行一条指令之前的状态，pc 为指令在代码段中的下标，sp 为栈中已使用的槽数"""
+
+    cycle: int
+    pc: int
+    op: int
+    operand: int
+    ax: int
+    sp: int
+
+
+def trace_bytes(trace: Any) -> bytes:
+    """VirtualMachine.trace 或任意按 TRACE_RECORD 排列的缓冲区"""
+    buffer = memoryview(trace).tobytes()
+    if len(buffer) % TRACE_RECORD.size:
+        raise ValueError("trace buffer is not made of whole records")
+    return buffer
+
+
+def trace_records(trace: Any) -> Iterator[TraceRecord]:
+    for fields in TRACE_RECORD.iter_unpack(trace_bytes(trace)):
+        yield TraceRecord(*fields)
+
+
+def save_trace(path: PathLike, trace: Any, instruction_set: InstructionSet) -> int:
+    """写出执行轨迹文件，返回记录数"""
+    buffer = trace_bytes(trace)
+    num_records = len(buffer) // TRACE_RECORD.size
+    with open(path, "wb") as f:
+        f.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, instruction_set.value, 0, num_records))
+        f.write(buffer)
+    return num_records
+
+
+def load_trace(path: PathLike) -> tuple[InstructionSet, bytes]:
+    with open(path, "rb") as f:
+        buffer = f.read()
+    if len(buffer) < TRACE_HEADER.size:
+        raise ValueError("truncated trace")
+    magic, version, instruction_set, _, num_records = TRACE_HEADER.unpack_from(buffer)
+    if magic != TRACE_MAGIC or version != TRACE_VERSION:
+        raise ValueError("not a pycc trace or unsupported version")
+    records = buffer[TRACE_HEADER.size :]
+    if len(records) != num_records * TRACE_RECORD.size:
+        raise ValueError("truncated trace")
+    return InstructionSet(instruction_set), records
+
+
+# 寄存器虚拟机中带操作数的指令，与 libvm.hpp 中的 register_has_operand 一致
+REGISTER_OPERANDS = frozenset(
+    instruction.value
+    for instruction in (
+        RegisterInstruction.LI,
+        RegisterInstruction.LEA,
+        RegisterInstruction.LDL,
+        RegisterInstruction.STL,
+        RegisterInstruction.LDG,
+        RegisterInstruction.STG,
+        RegisterInstruction.ADDI,
+        RegisterInstruction.JMP,
+        RegisterInstruction.JZ,
+        RegisterInstruction.JNZ,
+        RegisterInstruction.CALL,
+        RegisterInstruction.ENT,
+        RegisterInstruction.ADJ,
+    )
+)
+
+
+def format_op(op: int, operand: int, instruction_set: InstructionSet) -> str:
+    """与虚拟机调试输出相同的指令格式，未知操作码显示为 ???"""
+    if instruction_set == InstructionSet.REGISTER:
+        try:
+            instruction = RegisterInstruction(op & 0xFF)
+        except ValueError:
+            return f"???  {op}"
+        text = f"{instruction.name:<4} {(op >> 8) & 0xFF}, {(op >> 16) & 0xFF}, {(op >> 24) & 0xFF}"
+        return f"{text} ; {operand}" if instruction.value in REGISTER_OPERANDS else text
+    try:
+        instruction = Instruction(op)
+    except ValueError:
+        return f"???  {op}"
+    if instruction.value <= Instruction.ADJ.value or instruction.value >= Instruction.LLI.value:
+        return f"{instruction.name:<4} {operand}"
+    return instruction.name
+
+
+def render_trace(trace: Any, instruction_set: InstructionSet, last: Optional[int] = None) -> Iterator[str]:
+    """逐行渲染执行轨迹，last 不为 None 时只渲染最后 last 条记录"""
+    buffer = trace_bytes(trace)
+    if last is not None:
+        buffer = buffer[len(buffer) - min(last, len(buffer) // TRACE_RECORD.size) * TRACE_RECORD.size :]
+    accumulator = "r0" if instruction_set == InstructionSet.REGISTER else "ax"
+    for record in trace_records(buffer):
+        op = format_op(record.op, record.operand, instruction_set)
+        yield f"{record.cycle}> {record.pc:>6}  {op:<24} {accumulator} = {record.ax}, sp = {record.sp}"
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser("pycc.trace", description="Render an execution trace written by pycc --trace.")
+    parser.add_argument("trace", type=str, help=f"Path to a {TRACE_SUFFIX} trace file.")
+    parser.add_argument("--last", type=int, default=None, help="Only render the last N instructions.")
+    args = parser.parse_args()
+    instruction_set, records = load_trace(args.trace)
+    for line in render_trace(records, instruction_set, args.last):
+        sys.stdout.write(line + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,218 @@
+import json
+import struct
+from enum import IntEnum
+from typing import Any, BinaryIO, Iterator, Union
+
+from pycc.lexer import TOKEN_CLASSES
+
+AST = Union[dict[str, Any], list[Any], str, int]
+
+
+class NodeKind(IntEnum):
+    # 只允许在末尾追加，编号会写入二进制格式
+    terminal = 0
+    expr = 1
+    lor_expr = 2
+    lor_expr_tail = 3
+    land_expr = 4
+    land_expr_tail = 5
+    or_expr = 6
+    or_expr_tail = 7
+    xor_expr = 8
+    xor_expr_tail = 9
+    and_expr = 10
+    and_expr_tail = 11
+    equal_expr = 12
+    equal_expr_tail = 13
+    compare_expr = 14
+    compare_expr_tail = 15
+    sum_expr = 16
+    sum_expr_tail = 17
+    term = 18
+    term_tail = 19
+    factor = 20
+    type = 21
+    declare = 22
+    stmt = 23
+    else_branch = 24
+    stmts = 25
+    start = 26
+    start_tail = 27
+    func_params = 28
+    binary_expr = 29
+
+
+class Node:
+    """语法树节点，以整数记录节点类型，并记录对应源码的 [start, end) 区间"""
+
+    __slots__ = ("kind", "children", "start", "end")
+    is_terminal = False
+
+    def __init__(self, kind: int, start: int = 0):
+        self.kind = kind
+        self.children: list["Node"] = []
+        self.start = start
+        self.end = start
+
+    @property
+    def name(self) -> str:
+        return NodeKind(self.kind).name
+
+    def add_node(self, node: "Node"):
+        self.children.append(node)
+        # 空产生式不扩展父节点的区间
+        if node.end > node.start:
+            self.end = node.end
+
+    def to_ast(self) -> AST:
+        """语法树的 JSON 视图，子节点按顺序保存在列表中"""
+        return {
+            "kind": self.name,
+            "span": [self.start, self.end],
+            "children": [child.to_ast() for child in self.children],
+        }
+
+    def iter_json(self) -> Iterator[str]:
+        """逐段产出与 to_ast() 等价的 JSON 文本，不在内存中构建整棵树的视图"""
+        stack: list[tuple[Node, int]] = [(self, 0)]
+        while stack:
+            node, index = stack.pop()
+            if index == 0:
+                if node.is_terminal:
+                    yield json.dumps(node.to_ast(), ensure_ascii=False)
+                    continue
+                yield f'{{"kind": "{node.name}", "span": [{node.start}, {node.end}], "children": ['
+            if index < len(node.children):
+                if index > 0:
+                    yield ", "
+                stack.append((node, index + 1))
+                stack.append((node.children[index], 0))
+            else:
+                yield "]}"
+
+    def dump(self, file: str):
+        with open(file, "w", encoding="utf-8") as f:
+            for chunk in self.iter_json():
+                f.write(chunk)
+
+    def dump_binary(self, file: str):
+        with open(file, "wb") as f:
+            write_binary(self, f)
+
+    @staticmethod
+    def load_binary(file: str) -> "Node":
+        with open(file, "rb") as f:
+            return read_binary(f)
+
+    def __repr__(self) -> str:
+        return f"<{self.name} [{self.start}, {self.end}) {len(self.children)} children>"
+
+
+class TerminalNode(Node):
+    __slots__ = ("token_kind", "value")
+    is_terminal = True
+
+    def __init__(self, token_kind: int, value: Any = None, start: int = 0, end: int = 0):
+        super().__init__(NodeKind.terminal, start)
+        self.end = end
+        self.token_kind = token_kind
+        self.value = value
+
+    @property
+    def name(self) -> str:
+        return str(TOKEN_CLASSES[self.token_kind].from_value(self.value))
+
+    def to_ast(self) -> AST:
+        ast: dict[str, Any] = {"token": TOKEN_CLASSES[self.token_kind].__name__, "span": [self.start, self.end]}
+        if self.value is not None:
+            ast["value"] = self.value
+        return ast
+
+    def __repr__(self) -> str:
+        return f"<{self.name} [{self.start}, {self.end})>"
+
+
+class NullNode(Node):
+    """不构建语法树时所有产生式共用的空节点，不记录子节点"""
+
+    __slots__ = ()
+
+    def __init__(self):
+        super().__init__(NodeKind.terminal)
+
+    def add_node(self, node: "Node"):
+        pass
+
+
+NULL_NODE = NullNode()
+
+# 二进制格式：文件头后按先序排列各节点
+# 非终结符：tag(0) kind start end 子节点数
+# 终结符：tag(1) token_kind start end，之后是值：无值(0) / int64(1) / 长度 + UTF-8 字符串(2)
+BINARY_MAGIC = b"PYAST\x01"
+NODE_HEADER = struct.Struct("<BBIII")
+TERMINAL_HEADER = struct.Struct("<BBIIB")
+INT_VALUE = struct.Struct("<q")
+INT64_MIN, INT64_MAX = -(1 << 63), (1 << 63) - 1
+STR_LENGTH = struct.Struct("<I")
+VALUE_NONE, VALUE_INT, VALUE_STR = 0, 1, 2
+
+
+def write_binary(root: Node, f: BinaryIO):
+    f.write(BINARY_MAGIC)
+    stack: list[Node] = [root]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, TerminalNode):
+            value = node.value
+            if value is None:
+                f.write(TERMINAL_HEADER.pack(1, node.token_kind, node.start, node.end, VALUE_NONE))
+            elif isinstance(value, int):
+                if not INT64_MIN <= value <= INT64_MAX:
+                    raise ValueError(f"integer literal {value} at offset {node.start} does not fit in int64")
+                f.write(TERMINAL_HEADER.pack(1, node.token_kind, node.start, node.end, VALUE_INT))
+                f.write(INT_VALUE.pack(value))
+            else:
+                encoded = value.encode()
+                f.write(TERMINAL_HEADER.pack(1, node.token_kind, node.start, node.end, VALUE_STR))
+                f.write(STR_LENGTH.pack(len(encoded)))
+                f.write(encoded)
+            continue
+        f.write(NODE_HEADER.pack(0, node.kind, node.start, node.end, len(node.children)))
+        stack.extend(reversed(node.children))
+
+
+def read_binary(f: BinaryIO) -> Node:
+    assert f.read(len(BINARY_MAGIC)) == BINARY_MAGIC, "not a pycc binary AST"
+    root = None
+    # (父节点, 尚未读取的子节点数)
+    stack: list[list[Any]] = []
+    while root is None or stack:
+        tag = f.read(1)[0]
+        if tag == 1:
+            _, token_kind, start, end, value_tag = TERMINAL_HEADER.unpack(
+                bytes([tag]) + f.read(TERMINAL_HEADER.size - 1)
+            )
+            value: Any = None
+            if value_tag == VALUE_INT:
+                (value,) = INT_VALUE.unpack(f.read(INT_VALUE.size))
+            elif value_tag == VALUE_STR:
+                (length,) = STR_LENGTH.unpack(f.read(STR_LENGTH.size))
+                value = f.read(length).decode()
+            node: Node = TerminalNode(token_kind, value, start, end)
+            num_children = 0
+        else:
+            _, kind, start, end, num_children = NODE_HEADER.unpack(bytes([tag]) + f.read(NODE_HEADER.size - 1))
+            node = Node(kind, start)
+            node.end = end
+        if root is None:
+            root = node
+        else:
+            parent = stack[-1]
+            parent[0].children.append(node)
+            parent[1] -= 1
+            if parent[1] == 0:
+                stack.pop()
+        if num_children > 0:
+            stack.append([node, num_children])
+    return root
@@ -0,0 +1,24 @@
+import sys
+from typing import Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss() -> Optional[int]:
+    """当前进程的峰值常驻内存（字节），平台不支持时返回 None"""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 以字节为单位，Linux 以 KiB 为单位
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def format_bytes(num_bytes: float) -> str:
+    for unit in ["B", "KiB", "MiB"]:
+        if num_bytes < 1024:
+            return f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} GiB"
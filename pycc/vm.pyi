@@ -1,6 +1,10 @@
-from typing import Union
+from typing import Any, Optional, Union
 from enum import Enum
 
+IMAGE_VERSION: int
+NUM_REGISTERS: int
+DEFAULT_STACK_SIZE: int
+
 class Instruction(Enum):
     LEA: int
     IMM: int
@@ -42,6 +46,59 @@ class Instruction(Enum):
     MCMP: int
     EXIT: int
     PLAC: int
+    LLI: int
+    LGI: int
+    ADDI: int
+    SLI: int
+
+class RegisterInstruction(Enum):
+    MOV: int
+    LI: int
+    LEA: int
+    LD: int
+    LDC: int
+    ST: int
+    STC: int
+    LDL: int
+    STL: int
+    LDG: int
+    STG: int
+    OR: int
+    XOR: int
+    AND: int
+    EQ: int
+    NE: int
+    LT: int
+    GT: int
+    LE: int
+    GE: int
+    SHL: int
+    SHR: int
+    ADD: int
+    SUB: int
+    MUL: int
+    DIV: int
+    MOD: int
+    ADDI: int
+    JMP: int
+    JZ: int
+    JNZ: int
+    CALL: int
+    ENT: int
+    ADJ: int
+    LEV: int
+    PUSH: int
+    POP: int
+    SYS: int
+    EXIT: int
+
+class InstructionSet(Enum):
+    STACK: int
+    REGISTER: int
+
+class Relocation(Enum):
+    TEXT: int
+    DATA: int
 
 class VMStatus(Enum):
     INIT: int
@@ -51,19 +108,33 @@ class VMStatus(Enum):
 
 class VirtualMachine:
     poolsize: int
+    stack_size: int
     pc: int
     bp: int
     sp: int
     ax: int
     cycle: int
     status: VMStatus
-    def __init__(self, poolsize: int) -> None: ...
+    text_base: int
+    data_base: int
+    num_ops: int
+    data_size: int
+    instruction_set: InstructionSet
+    registers: list[int]
+    trace: memoryview
+    def __init__(self, poolsize: int, instruction_set: InstructionSet = ..., stack_size: int = ...) -> None: ...
     def reset(self) -> None: ...
     def add_op(self, op: Union[Instruction, int, str]) -> None: ...
+    def truncate(self, num_ops: int) -> None: ...
+    def dump_text(self) -> bytes: ...
+    def dump_data(self) -> bytes: ...
+    def load(self, text: bytes, data: bytes, relocations: Any) -> None: ...
+    def load_image(self, path: Any) -> Optional[int]: ...
     def put_int_onto_data(self, value: int) -> int: ...
     def step(self, debug: bool) -> VMStatus: ...
     def run(self, debug: bool) -> int: ...
     def run_all_ops(self, debug: bool) -> int: ...
+    def set_trace(self, capacity: int) -> None: ...
     def pc_offset(self) -> int: ...
     def get_op_pointer(self, offset: int = ...) -> int: ...
     def set_pc(self, pc: int) -> None: ...
@@ -0,0 +1,133 @@
+"""多个测试模块共用的示例程序"""
+
+sum_program = """
+int main() {
+  int a;
+  int i;
+
+  i = 0;
+  a = 0;
+  while (i < 10) {
+    a = a + i;
+    i = i + 1;
+  }
+  return a;
+}
+"""
+
+fibonacci_program = """
+int fibonacci(int i) {
+  if (i <= 1) {
+    return 1;
+  }
+  return fibonacci(i - 1) + fibonacci(i - 2);
+}
+
+int main() {
+  return fibonacci(10);
+}
+"""
+
+globals_program = """
+int total;
+int step;
+int add(int x) {
+  total = total + x;
+  return total;
+}
+int main() {
+  int i;
+  int result;
+  step = 3;
+  i = 0;
+  while (i < 5) {
+    result = add(step);
+    i = i + 1;
+  }
+  return result;
+}
+"""
+
+main_unit = """
+extern int counter;
+int twice(int x);
+int bump(int n);
+int main() {
+  int r;
+  r = twice(20) + bump(2);
+  return r + counter;
+}
+"""
+
+library_unit = """
+int counter;
+int twice(int x) {
+  return x + x;
+}
+int bump(int n) {
+  counter = counter + n;
+  return counter;
+}
+"""
+
+forward_program = """
+int odd(int n);
+int even(int n) {
+  if (n == 0) {
+    return 1;
+  }
+  return odd(n - 1);
+}
+int odd(int n) {
+  if (n == 0) {
+    return 0;
+  }
+  return even(n - 1);
+}
+int main() {
+  return even(10) * 10 + odd(7);
+}
+"""
+
+nested_program = """
+int g;
+int main() {
+  int i;
+  int j;
+  int s;
+  i = 0;
+  s = 0;
+  while (i < 6) {
+    j = 0;
+    while (j < 6) {
+      if (j < 3) {
+        if (i < 2) {
+          s = s + 1;
+        } else {
+          s = s + 2;
+        }
+      } else {
+        s = s + 3;
+      }
+      j = j + 1;
+    }
+    s = s;
+    g = g;
+    i = i + 1;
+  }
+  if (s > 0) return s; else return 0;
+}
+"""
+
+short_circuit_program = """
+int pick(int a, int b) {
+  return a * 10 + b;
+}
+int main() {
+  int a;
+  int b;
+  a = 0;
+  b = 3;
+  return 100 + (a || b) * pick(b && a, a || 7) + (b && 5);
+}
+"""
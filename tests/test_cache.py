@@ -0,0 +1,71 @@
+import os
+from pathlib import Path
+
+import pytest
+import pycc
+from pycc.cache import CompileCache
+from pycc.lexer import Lexer
+from tests.programs import fibonacci_program, globals_program, sum_program
+
+
+def test_cache_hit_skips_lexer(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    cache = CompileCache(tmp_path)
+    assert pycc.compile(globals_program, cache=cache).run() == 15
+    assert cache.get(cache.key(globals_program.encode())) is not None
+
+    def failing_scan(self: Lexer):
+        raise AssertionError("cache hit should not lex")
+
+    monkeypatch.setattr(Lexer, "scan", failing_scan)
+    assert pycc.compile(globals_program, cache=cache).run() == 15
+    program = pycc.compile(globals_program, stages=["symbols"], cache=cache)
+    assert program.vm is None and program.symbols is not None
+
+
+def test_cache_key_depends_on_source(tmp_path: Path):
+    cache = CompileCache(tmp_path)
+    pycc.compile(sum_program, cache=cache)
+    assert cache.get(cache.key(fibonacci_program.encode())) is None
+    pycc.compile(fibonacci_program, cache=cache)
+    assert cache.key(sum_program.encode()) != cache.key(fibonacci_program.encode())
+    assert cache.get(cache.key(fibonacci_program.encode())) is not None
+
+
+def test_cache_lru_eviction(tmp_path: Path):
+    cache = CompileCache(tmp_path)
+    sources = [sum_program, fibonacci_program, globals_program]
+    for i, source_code in enumerate(sources):
+        pycc.compile(source_code, cache=cache)
+        os.utime(cache.path(cache.key(source_code.encode())), (i, i))
+    # 命中使条目变为最近使用
+    assert cache.get(cache.key(sum_program.encode())) is not None
+
+    cache.max_size = cache.size() - 1
+    cache.evict()
+    assert cache.get(cache.key(fibonacci_program.encode())) is None
+    assert cache.get(cache.key(sum_program.encode())) is not None
+    assert cache.get(cache.key(globals_program.encode())) is not None
+
+
+def test_corrupt_entry_is_discarded(tmp_path: Path):
+    cache = CompileCache(tmp_path)
+    key = cache.key(sum_program.encode())
+    tmp_path.joinpath(cache.path(key).name).write_bytes(b"garbage")
+    assert pycc.compile(sum_program, cache=cache).run() == 45
+    assert cache.get(key) is not None
+
+
+def test_cached_path_is_not_read_into_memory(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    path = tmp_path / "sum.c"
+    path.write_text(sum_program)
+    cache = CompileCache(tmp_path / "cache")
+    # 按块计算的摘要与整段源码的摘要相同
+    assert cache.key_file(path, "O1") == cache.key(sum_program.encode(), "O1")
+
+    def failing_read(source):
+        raise AssertionError("path sources should be hashed and lexed from the file")
+
+    monkeypatch.setattr(pycc.compiler, "read_source", failing_read)
+    assert pycc.compile(path, cache=cache).run() == 45
+    assert cache.get(cache.key(sum_program.encode())) is not None
+    assert pycc.compile(path, cache=cache).run() == 45
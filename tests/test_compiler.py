@@ -0,0 +1,45 @@
+from pathlib import Path
+
+import pytest
+import pycc
+from pycc.lexer import Lexer
+from tests.programs import sum_program
+
+
+def test_compile_and_run():
+    program = pycc.compile(sum_program)
+    assert program.tokens is None
+    assert program.ast is None
+    assert program.symbols is None
+    assert program.run() == 45
+
+
+def test_tokens_only():
+    program = pycc.compile(sum_program, stages=["tokens"])
+    assert program.tokens is not None
+    assert program.vm is None
+
+
+def test_compile_file(tmp_path: Path):
+    path = tmp_path / "sum.c"
+    path.write_text(sum_program)
+    program = pycc.compile(path, stages=["symbols", "code"])
+    assert program.symbols is not None
+    assert [symbol.value for symbol in program.symbols.values() if symbol.name == "main"] == [program.entry]
+    assert program.run() == 45
+
+
+def test_lex_once(monkeypatch: pytest.MonkeyPatch):
+    num_scans = 0
+    scan = Lexer.scan
+
+    def counting_scan(self: Lexer):
+        nonlocal num_scans
+        num_scans += 1
+        return scan(self)
+
+    monkeypatch.setattr(Lexer, "scan", counting_scan)
+    program = pycc.compile(sum_program, stages=["tokens", "ast", "symbols", "code"])
+    assert program.tokens is not None and program.ast is not None
+    assert num_scans == 1
+    assert program.run() == 45
@@ -0,0 +1,68 @@
+from pathlib import Path
+
+import pytest
+import pycc
+from pycc.image import IMAGE_HEADER, Image
+from pycc.parser import Parser
+from pycc.vm import VirtualMachine
+from tests.programs import fibonacci_program, globals_program, sum_program
+
+
+def compile_image(source_code: str) -> Image:
+    parser = Parser(source_code)
+    parser.start()
+    return Image.from_parser(parser)
+
+
+@pytest.mark.parametrize("source_code, expected", [(sum_program, 45), (fibonacci_program, 89), (globals_program, 15)])
+def test_image_roundtrip(source_code: str, expected: int):
+    image = Image.from_bytes(compile_image(source_code).to_bytes())
+    vm = VirtualMachine(256 * 1024)
+    entry, symbols = image.load(vm)
+    assert [symbol.value for symbol in symbols.values() if symbol.name == "main"] == [entry]
+    vm.setup_main(entry)
+    assert vm.run(False) == expected
+
+
+@pytest.mark.parametrize("source_code, expected", [(sum_program, 45), (fibonacci_program, 89), (globals_program, 15)])
+def test_load_image_file(tmp_path: Path, source_code: str, expected: int):
+    path = tmp_path / "program.pyco"
+    pycc.compile(source_code, stages=["image"]).image.save(path)  # type: ignore
+    program = pycc.load(path, stages=["symbols", "code", "image"])
+    assert program.run() == expected
+    assert program.image is not None and program.image.entry is not None
+    assert program.entry == program.vm.text_base + program.image.entry  # type: ignore
+    # 虚拟机的段大小取决于镜像本身
+    assert program.vm.poolsize == program.image.poolsize  # type: ignore
+    # 同一镜像可以载入到任意位置的虚拟机中
+    assert pycc.load(path).run() == expected
+
+
+def test_image_sections_are_aligned():
+    buffer = compile_image(globals_program).to_bytes()
+    _, _, _, *sections = IMAGE_HEADER.unpack_from(buffer)
+    offsets = sections[0::2]
+    assert all(offset % 8 == 0 for offset in offsets)
+
+
+@pytest.mark.parametrize("size", [0, 4, IMAGE_HEADER.size, -16])
+def test_load_truncated_image(tmp_path: Path, size: int):
+    buffer = compile_image(globals_program).to_bytes()
+    path = tmp_path / "program.pyco"
+    path.write_bytes(buffer[:size])
+    with pytest.raises(ValueError):
+        VirtualMachine(256 * 1024).load_image(path)
+    with pytest.raises(ValueError):
+        Image.from_bytes(buffer[:size])
+
+
+def test_load_bad_magic(tmp_path: Path):
+    path = tmp_path / "program.pyco"
+    path.write_bytes(b"ELF!" + compile_image(sum_program).to_bytes()[4:])
+    with pytest.raises(ValueError):
+        VirtualMachine(256 * 1024).load_image(path)
+
+
+def test_load_missing_image(tmp_path: Path):
+    with pytest.raises(OSError):
+        VirtualMachine(256 * 1024).load_image(tmp_path / "missing.pyco")
@@ -0,0 +1,434 @@
+from pathlib import Path
+
+import pytest
+import pycc
+from pycc.ir import (
+    DEFAULT_PASSES,
+    PASSES,
+    CopyPropagation,
+    Quad,
+    Var,
+    build_module,
+    find_loops,
+    hoist_invariants,
+    lower_module,
+    reduce_strength,
+    rotate_loops,
+    run_passes,
+)
+from pycc.registers import to_registers
+from pycc.vm import Instruction, InstructionSet
+from tests.programs import (
+    fibonacci_program,
+    forward_program,
+    globals_program,
+    library_unit,
+    main_unit,
+    nested_program,
+    short_circuit_program,
+    sum_program,
+)
+
+propagation_program = """
+int g;
+int twice(int x) {
+  return x + x;
+}
+int main() {
+  int a;
+  int b;
+  int c;
+  int d;
+  a = 6;
+  b = a;
+  c = b * 7;
+  d = 100;
+  d = c - 2;
+  g = d;
+  if (a > 5) {
+    c = c + 1;
+  } else {
+    c = 0;
+  }
+  b = twice(b);
+  while (a > 0) {
+    a = a - 1;
+    b = b + g;
+  }
+  return b + c;
+}
+"""
+
+loop_program = """
+int main() {
+  int i;
+  int j;
+  int s;
+  s = 0;
+  i = 0;
+  while (i < 20) {
+    j = 0;
+    while (j < 10) {
+      s = s + i * 3 + j * 5;
+      j = j + 1;
+    }
+    i = i + 2;
+  }
+  return s;
+}
+"""
+
+helper_program = """
+int g;
+int square(int x) {
+  return x * x;
+}
+int clamp(int v, int lo, int hi) {
+  if (v < lo) {
+    return lo;
+  }
+  if (v > hi) {
+    return hi;
+  }
+  return v;
+}
+int fibonacci(int n) {
+  if (n < 2) {
+    return n;
+  }
+  return fibonacci(n - 1) + fibonacci(n - 2);
+}
+int main() {
+  int i;
+  int s;
+  g = 2;
+  i = 0;
+  s = 0;
+  while (i < 10) {
+    s = s + clamp(square(i) - 10, 0, 40) + g;
+    i = i + 1;
+  }
+  return s + fibonacci(6);
+}
+"""
+
+tail_program = """
+int sum(int n, int acc) {
+  if (n == 0) {
+    return acc;
+  }
+  return sum(n - 1, (acc + n) % 1000);
+}
+int gcd(int a, int b) {
+  if (b == 0) {
+    return a;
+  }
+  return gcd(b, a % b);
+}
+int main() {
+  return sum(100, 0) % 1000 + gcd(1071, 462);
+}
+"""
+
+programs = [
+    (sum_program, 45),
+    (fibonacci_program, 89),
+    (globals_program, 15),
+    (forward_program, 11),
+    (nested_program, 84),
+    (short_circuit_program, 126),
+    (propagation_program, 295),
+    (loop_program, 4950),
+    (helper_program, 194),
+    (tail_program, 71),
+]
+
+
+def quads(image, name: str) -> list[Quad]:
+    function = next(function for function in build_module(image).functions if function.name == name)
+    return [quad for block in function.blocks.values() for quad in block.quads]
+
+
+@pytest.mark.parametrize("source_code, expected", programs)
+@pytest.mark.parametrize("passes", [(), *((name,) for name in PASSES), DEFAULT_PASSES])
+@pytest.mark.parametrize("superinstructions", [False, True])
+def test_passes_keep_results(source_code: str, expected: int, passes: tuple[str, ...], superinstructions: bool):
+    image = pycc.compile(source_code, stages=["image"], optimize=2 if superinstructions else 0).image
+    optimized, report = run_passes(image, passes, superinstructions)  # type: ignore
+    assert list(report.changes) == list(passes)
+    assert pycc.from_image(optimized).run() == expected
+
+
+@pytest.mark.parametrize("source_code, expected", programs)
+def test_lowering_roundtrip(source_code: str, expected: int):
+    # 不运行任何遍时降级的代码执行的指令不多于语法分析生成的代码（顺序执行的跳转被省去）
+    stack = pycc.compile(source_code)
+    assert stack.run() == expected
+    image = pycc.compile(source_code, stages=["image"]).image
+    program = pycc.from_image(lower_module(build_module(image)))  # type: ignore
+    assert program.run() == expected
+    assert program.vm.cycle <= stack.vm.cycle  # type: ignore
+
+
+@pytest.mark.parametrize("source_code, expected", programs)
+@pytest.mark.parametrize("instruction_set", list(InstructionSet))
+def test_o3(source_code: str, expected: int, instruction_set: InstructionSet):
+    o2 = pycc.compile(source_code, optimize=2, instruction_set=instruction_set)
+    assert o2.run() == expected
+    o3 = pycc.compile(source_code, optimize=3, instruction_set=instruction_set)
+    assert o3.run() == expected
+    assert o3.passes is not None and list(o3.passes.changes) == list(DEFAULT_PASSES)
+    assert "copy-propagation" in str(o3.passes)
+    assert o3.vm.cycle <= o2.vm.cycle  # type: ignore
+
+
+def test_build_module():
+    image = pycc.compile(short_circuit_program, stages=["image"]).image
+    module = build_module(image)  # type: ignore
+    assert [function.name for function in module.functions] == ["pick", "main"]
+    pick, main = module.functions
+    assert len(pick.blocks) == 1 and pick.num_locals == 0 and main.num_locals == 2
+    # 短路求值拆分出基本块，表达式中间的 || 与 && 之前已算出的操作数留在栈上
+    assert len(main.blocks) > 1
+    kinds = [quad.kind for block in main.blocks.values() for quad in block.quads]
+    assert "push" in kinds and "call" in kinds
+    assert "pop" in str(main)
+    with pytest.raises(ValueError):
+        build_module(to_registers(image))  # type: ignore
+
+
+def test_copy_propagation():
+    image = pycc.compile(propagation_program, stages=["image"]).image
+    optimized, report = run_passes(image, ["copy-propagation"])  # type: ignore
+    assert report.changes["copy-propagation"] > 0
+    main = quads(optimized, "main")
+    opcodes = [Instruction(quad.opcode) for quad in main if quad.kind == "binary"]
+    # c = b * 7 在编译期算出，if (a > 5) 的条件已知，只剩下循环条件中的比较
+    assert Instruction.MUL not in opcodes
+    assert opcodes.count(Instruction.GT) == 1
+    # 调用之后不再假定全局变量的值，循环中仍读取 g
+    assert any(quad.kind == "load" and not quad.var.local for quad in main)  # type: ignore
+
+
+def test_copy_propagation_chain(monkeypatch: pytest.MonkeyPatch):
+    sweeps = []
+    propagate_facts = CopyPropagation.propagate_facts
+
+    def counting_propagate_facts(self: CopyPropagation):
+        sweeps.append(self)
+        propagate_facts(self)
+
+    monkeypatch.setattr(CopyPropagation, "propagate_facts", counting_propagate_facts)
+    counts = []
+    for length in (5, 500):
+        body = "  a = a + 1;\n" * length
+        source_code = f"int main() {{\n  int a;\n  a = 0;\n{body}  return a;\n}}\n"
+        image = pycc.compile(source_code, stages=["image"]).image
+        sweeps.clear()
+        optimized, _ = run_passes(image, ["copy-propagation"])  # type: ignore
+        counts.append(len(sweeps))
+        assert pycc.from_image(optimized).run() == length
+        assert not any(quad.kind == "load" for quad in quads(optimized, "main"))
+    # 常量赋值链在同一遍数据流分析中传播到底，遍数与链长无关
+    assert counts[0] == counts[1]
+
+
+def test_dead_stores_and_unreachable_blocks():
+    image = pycc.compile(propagation_program, stages=["image"]).image
+    before = quads(image, "main")
+    optimized, report = run_passes(image, DEFAULT_PASSES)  # type: ignore
+    after = quads(optimized, "main")
+    assert report.changes["dead-stores"] > 0
+    # else 分支在条件折叠后不可达
+    assert report.changes["unreachable-blocks"] == 1
+    stores = [quad for quad in after if quad.kind == "store"]
+    assert len(stores) < len([quad for quad in before if quad.kind == "store"])
+    # d 只被赋值而不被读取
+    assert all(quad.var.offset != -4 for quad in stores)  # type: ignore
+    # 对全局变量的赋值在函数返回后仍可见，不能删除
+    assert any(not quad.var.local for quad in stores)  # type: ignore
+
+
+def test_pass_report():
+    image = pycc.compile(propagation_program, stages=["image"]).image
+    _, report = run_passes(image, ["dead-stores", "copy-propagation"])  # type: ignore
+    assert list(report.timings) == ["build", "dead-stores", "copy-propagation", "lower"]
+    assert all(seconds >= 0 for seconds in report.timings.values())
+    assert str(report).startswith("IR passes (build: ")
+    with pytest.raises(ValueError):
+        run_passes(image, ["no-such-pass"])  # type: ignore
+
+
+def test_selected_passes_and_cache(tmp_path: Path):
+    cache = pycc.CompileCache(tmp_path)
+    program = pycc.compile(propagation_program, optimize=1, passes=["dead-stores"], cache=cache)
+    assert program.passes is not None and list(program.passes.changes) == ["dead-stores"]
+    assert program.run() == 295
+    # 不同的遍分别缓存，命中缓存时没有报告
+    assert pycc.compile(propagation_program, optimize=3, cache=cache).passes is not None
+    cached = pycc.compile(propagation_program, optimize=3, cache=cache)
+    assert cached.passes is None and cached.run() == 295
+    # 显式给出空的遍时 -O3 与 -O2 相同
+    assert pycc.compile(propagation_program, optimize=3, passes=[]).passes is None
+
+
+def test_o3_build_and_parallel():
+    program = pycc.build([main_unit, library_unit], optimize=3)
+    assert program.passes is not None and program.run() == 44
+    assert pycc.compile(propagation_program, optimize=3, workers=2).run() == 295
+
+
+def test_loop_passes():
+    image = pycc.compile(loop_program, stages=["image"]).image
+    main = build_module(image).functions[-1]  # type: ignore
+    assert rotate_loops(main) == 2
+    assert hoist_invariants(main) > 0
+    assert reduce_strength(main) > 0
+    inner, outer = find_loops(main)
+    assert inner.blocks < outer.blocks and main.num_locals == 5
+
+    def loop_quads(loop) -> list[Quad]:
+        return [quad for block_id in loop.blocks for quad in main.blocks[block_id].quads]
+
+    # 内层循环中的 i * 3 外提，j * 5 削弱为加法
+    assert all(quad.opcode != Instruction.MUL.value for quad in loop_quads(inner))
+    # i 只用于乘积与比较且循环后不再读取，外层循环中不再读写 i
+    assert all(quad.var != Var(True, -1) for quad in loop_quads(outer))
+    # 旋转后的循环在回边上判断条件，不再跳回循环头
+    assert all(main.blocks[latch].terminator.kind == "branch" for latch in inner.latches + outer.latches)
+
+
+def test_loop_passes_guards():
+    passes = ["loop-rotation", "licm", "strength-reduction", "dead-stores"]
+    # 循环结束后仍读取 i 时不能消除 i，乘积不多于赋值时不削弱
+    live_after = """
+int main() {
+  int i;
+  int s;
+  s = 0;
+  i = 10;
+  while (i > 0) {
+    s = s + i * 6;
+    i = i - 1;
+  }
+  return s + i;
+}
+"""
+    image = pycc.compile(live_after, stages=["image"]).image
+    optimized, report = run_passes(image, passes)  # type: ignore
+    assert report.changes["strength-reduction"] == 0
+    assert pycc.from_image(optimized).run() == 330
+    # 循环体不执行时外提的除法也不能执行
+    division = """
+int main() {
+  int i;
+  int s;
+  int d;
+  i = 5;
+  s = 1;
+  d = 0;
+  while (i < 3) {
+    s = s + 10 / d;
+    i = i + 1;
+  }
+  return s;
+}
+"""
+    image = pycc.compile(division, stages=["image"]).image
+    optimized, report = run_passes(image, passes)  # type: ignore
+    assert report.changes["licm"] == 0
+    assert pycc.from_image(optimized).run() == 1
+
+
+overflow_programs = [
+    """
+int main() {
+  int i;
+  int s;
+  i = 3;
+  s = 0;
+  while (i > 0) {
+    s = s + (i * 1000000000 > 2000000000);
+    i = i - 1;
+  }
+  return s;
+}
+""",
+    """
+int main() {
+  int i;
+  int s;
+  i = 0;
+  s = 0;
+  while (i < 3) {
+    s = s + (i * 1000000000) / 1000000000 + (i * 1000000000) / 1000000000;
+    i = i + 1;
+  }
+  return s;
+}
+""",
+]
+
+
+@pytest.mark.parametrize("source_code", overflow_programs)
+def test_strength_reduction_int_range(source_code: str):
+    # 乘积按 int64 计算，超出 int 范围时不能改为读取 int 局部变量
+    expected = pycc.compile(source_code).run()
+    assert pycc.compile(source_code, optimize=3).run() == expected
+    for optimize in (0, 2):
+        assert pycc.compile(source_code, optimize=optimize, passes=["strength-reduction"]).run() == expected
+    # 范围能证明在 int 之内时仍然削弱
+    small = source_code.replace("1000000000", "1000")
+    image = pycc.compile(small, stages=["image"]).image
+    optimized, report = run_passes(image, ["strength-reduction"])  # type: ignore
+    assert report.changes["strength-reduction"] > 0
+    assert pycc.from_image(optimized).run() == pycc.compile(small).run()
+
+
+def test_inline():
+    image = pycc.compile(helper_program, stages=["image"]).image
+    _, report = run_passes(image, ["inline"])  # type: ignore
+    # square 与 clamp 各内联一次，递归的 fibonacci 不内联
+    assert report.changes["inline"] == 2
+    optimized, _ = run_passes(image, ["inline", "copy-propagation", "dead-stores"])  # type: ignore
+    main = quads(optimized, "main")
+    calls = [quad for quad in main if quad.kind == "call"]
+    assert len(calls) == 1
+    program = pycc.from_image(optimized)
+    assert program.run() == 194
+    # 省去了调用与返回的开销
+    stack = pycc.compile(helper_program)
+    assert stack.run() == 194
+    assert program.vm.cycle < stack.vm.cycle  # type: ignore
+    # 上限为 0 时不内联
+    _, report = run_passes(image, ["inline"], inline_threshold=0)  # type: ignore
+    assert report.changes["inline"] == 0
+    program = pycc.compile(helper_program, optimize=3, inline_threshold=0)
+    assert program.passes is not None and program.passes.changes["inline"] == 0
+    assert program.run() == 194
+
+
+def test_inline_threshold_cache(tmp_path: Path):
+    cache = pycc.CompileCache(tmp_path)
+    assert pycc.compile(helper_program, optimize=3, cache=cache).passes.changes["inline"] == 2  # type: ignore
+    # 上限不同时分别缓存
+    program = pycc.compile(helper_program, optimize=3, inline_threshold=0, cache=cache)
+    assert program.passes is not None and program.passes.changes["inline"] == 0
+    assert pycc.compile(helper_program, optimize=3, inline_threshold=0, cache=cache).passes is None
+
+
+def test_tail_calls():
+    image = pycc.compile(tail_program, stages=["image"]).image
+    optimized, report = run_passes(image, ["tail-calls"])  # type: ignore
+    assert report.changes["tail-calls"] == 2
+    assert not any(quad.kind == "call" for quad in quads(optimized, "sum") + quads(optimized, "gcd"))
+    assert pycc.from_image(optimized).run() == 71
+    # 递归改为循环后不再是递归函数，可以内联
+    _, report = run_passes(image, ["tail-calls", "inline"])  # type: ignore
+    assert report.changes["inline"] == 2
+
+
+def test_deep_tail_recursion():
+    # 每层递归的栈帧占 4 个槽位，不消除尾调用时远超栈的大小
+    program = pycc.compile(tail_program.replace("sum(100, 0)", "sum(200000, 0)"), optimize=3)
+    assert program.run() == 21
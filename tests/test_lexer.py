@@ -0,0 +1,116 @@
+import io
+from pathlib import Path
+
+import pytest
+from pycc.lexer import (
+    Add,
+    Assign,
+    Chr,
+    Id,
+    If,
+    Int,
+    Le,
+    Lexer,
+    Lor,
+    Lt,
+    Num,
+    Return,
+    Semi,
+    Token,
+    TokenBuffer,
+    Sub,
+)
+
+
+@pytest.mark.parametrize(
+    "source_code, expected",
+    [
+        ("int a;", [Int(), Id("a"), Semi()]),
+        ("ifx if", [Id("ifx"), If()]),
+        ("a<<=b", [Id("a"), Lt(), Le(), Id("b")]),
+        ("x++ || 'c'", [Id("x"), Add(), Add(), Lor(), Chr("'c'")]),
+        ("return 0\n", [Return(), Num("0")]),
+        ("a = 12 - 1_ // comment\n/* block\n */", [Id("a"), Assign(), Num("12"), Sub(), Num("1"), Id("_")]),
+    ],
+)
+def test_tokenize(source_code: str, expected: list[Token]):
+    assert Lexer(source_code).tokenize() == expected
+
+
+@pytest.mark.parametrize(
+    "source_code",
+    [
+        "int x = 12",
+        "a @ b",
+    ],
+)
+def test_unexpected_symbol(source_code: str):
+    with pytest.raises(Exception, match="Unexpected symbol"):
+        Lexer(source_code).tokenize()
+
+
+def test_unterminated_comment():
+    with pytest.raises(AssertionError):
+        Lexer("int a; /* ...").tokenize()
+
+
+def test_master_regexp_matches_token_classes():
+    source_code = "while (i <= 10) { a = a + i * 2 / 3 % 4; i = i - 1; } return a != 0 && b == 1 | c ^ d & e;"
+    pos = 0
+    for token in Lexer(source_code).tokenize():
+        while source_code[pos] == " ":
+            pos += 1
+        # 第一个能匹配的 token 类即为主正则给出的类型
+        token_cls = next(cls for cls in Token.token_classes() if cls.match(source_code, pos))
+        assert token.__class__ is token_cls
+        pos = token_cls.match(source_code, pos).end()  # type: ignore
+
+
+def test_long_trivia_run():
+    # 大量连续的注释与空行不应触发递归深度限制
+    source_code = "int a;\n" + "// comment\n" * 20000 + "\n" * 20000 + "/* block */" * 20000 + "int b;"
+    assert Lexer(source_code).tokenize() == [Int(), Id("a"), Semi(), Int(), Id("b"), Semi()]
+
+
+def test_keep_trivia():
+    source_code = "int a; // c\n/* d */ a"
+    lexer = Lexer(source_code, keep_trivia=True)
+    lexer.tokenize()
+    assert lexer.trivia is not None
+    assert [source_code[start:end] for start, end in lexer.trivia] == [" ", " ", "// c\n", "/* d */", " "]
+
+
+def test_token_buffer():
+    source_code = "int a; a = a + 10; // c\nreturn 'x';"
+    buffer = TokenBuffer.from_source(source_code)
+    assert list(buffer) == Lexer(source_code).tokenize()
+    assert len(buffer) == 12
+    # 相同的标识符只驻留一份
+    assert buffer.values.count("a") == 1
+    assert [source_code[start:end] for start, end in zip(buffer.starts, buffer.ends)][:4] == ["int", "a", ";", "a"]
+    assert buffer[7] == Num("10")
+    assert buffer.nbytes() == 13 * len(buffer)
+
+
+chunk_boundary_program = "int a; /* block\n comment */ a = a <= 12345 || 'c'; // tail\nreturn a;"
+
+
+def test_from_file(tmp_path: Path):
+    path = tmp_path / "source.c"
+    path.write_text(chunk_boundary_program)
+    assert list(Lexer.from_file(path).cursor()) == list(Lexer(chunk_boundary_program).cursor())
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7])
+def test_from_file_chunked(chunk_size: int):
+    # 注释、多字符运算符与数字都可能被块边界截断
+    file = io.BytesIO(chunk_boundary_program.encode())
+    lexer = Lexer.from_file(file, keep_trivia=True, chunk_size=chunk_size)
+    expected = Lexer(chunk_boundary_program, keep_trivia=True)
+    assert list(lexer.cursor()) == list(expected.cursor())
+    assert lexer.trivia == expected.trivia
+
+
+def test_from_file_unterminated_comment():
+    with pytest.raises(AssertionError):
+        Lexer.from_file(io.BytesIO(b"int a; /* ..."), chunk_size=4).tokenize()
@@ -0,0 +1,83 @@
+from pathlib import Path
+
+import pytest
+import pycc
+from pycc.image import Image
+from tests.programs import forward_program, library_unit, main_unit
+
+
+def compile_unit(source_code: str) -> Image:
+    return pycc.compile(source_code, stages=["image"]).image  # type: ignore
+
+
+def test_forward_declaration():
+    # 同一单元中先声明后定义的函数在 start() 结束时回填
+    assert pycc.compile(forward_program).run() == 11
+
+
+def test_unit_has_externals():
+    unit = compile_unit(main_unit)
+    assert sorted({name for _, name in unit.externals}) == ["bump", "counter", "twice"]
+    assert compile_unit(library_unit).externals == []
+    with pytest.raises(pycc.LinkError, match="undefined symbol 'twice'"):
+        pycc.compile(main_unit)
+
+
+def test_link():
+    image = pycc.link([compile_unit(main_unit), compile_unit(library_unit)])
+    assert image.externals == []
+    assert pycc.from_image(image).run() == 44
+    # 单元顺序不影响结果
+    image = pycc.link([compile_unit(library_unit), compile_unit(main_unit)])
+    assert pycc.from_image(Image.from_bytes(image.to_bytes())).run() == 44
+
+
+def test_link_errors():
+    with pytest.raises(pycc.LinkError) as exc_info:
+        pycc.link([compile_unit(main_unit), compile_unit("int twice(int x) { return x; }")], ["a.c", "b.c"])
+    assert exc_info.value.errors == [
+        "undefined symbol 'bump' referenced in a.c",
+        "undefined symbol 'counter' referenced in a.c",
+    ]
+    with pytest.raises(pycc.LinkError) as exc_info:
+        pycc.link([compile_unit(library_unit), compile_unit(library_unit)], ["a.c", "b.c"])
+    assert exc_info.value.errors == [
+        "duplicate symbol 'counter' defined in a.c and b.c",
+        "duplicate symbol 'twice' defined in a.c and b.c",
+        "duplicate symbol 'bump' defined in a.c and b.c",
+    ]
+
+
+def test_link_kind_mismatch():
+    # 引用与定义的种类不同时不能互相解析
+    with pytest.raises(pycc.LinkError) as exc_info:
+        pycc.link(
+            [compile_unit("extern int g;\nint main() { return g; }"), compile_unit("int g() { return 1; }")],
+            ["a.c", "b.c"],
+        )
+    assert exc_info.value.errors == ["symbol 'g' declared as a variable in a.c but defined as a function in b.c"]
+    with pytest.raises(pycc.LinkError) as exc_info:
+        pycc.link(
+            [compile_unit("extern int g();\nint main() { return g(); }"), compile_unit("int g;")],
+            ["a.c", "b.c"],
+        )
+    assert exc_info.value.errors == ["symbol 'g' declared as a function in a.c but defined as a variable in b.c"]
+
+
+def test_load_unlinked_unit(tmp_path: Path):
+    path = tmp_path / "main.pyco"
+    compile_unit(main_unit).save(path)
+    with pytest.raises(ValueError):
+        pycc.load(path)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_build(tmp_path: Path, workers: int):
+    sources = [tmp_path / "main.c", tmp_path / "library.c"]
+    sources[0].write_text(main_unit)
+    sources[1].write_text(library_unit)
+    assert pycc.build(sources, workers=workers).run() == 44
+
+    # 目标单元可以与源文件一起链接
+    compile_unit(library_unit).save(tmp_path / "library.pyco")
+    assert pycc.build([sources[0], tmp_path / "library.pyco"], workers=workers).run() == 44
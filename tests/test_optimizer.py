@@ -0,0 +1,99 @@
+from array import array
+
+import pytest
+import pycc
+from pycc.optimizer import SLOT_BYTES, decode, peephole
+from pycc.vm import Instruction
+from tests.programs import (
+    fibonacci_program,
+    forward_program,
+    globals_program,
+    library_unit,
+    main_unit,
+    nested_program,
+    sum_program,
+)
+
+
+@pytest.mark.parametrize(
+    "source_code, expected",
+    [
+        (sum_program, 45),
+        (fibonacci_program, 89),
+        (globals_program, 15),
+        (forward_program, 11),
+        (nested_program, 84),
+    ],
+)
+def test_optimized_program(source_code: str, expected: int):
+    program = pycc.compile(source_code, optimize=1)
+    assert program.run() == expected
+    report = program.optimization
+    assert report is not None and report.removed > 0
+    assert report.num_ops_after == len(decode(pycc.compile(source_code, stages=["image"], optimize=1).image))
+
+
+def test_peephole_rules():
+    image = pycc.compile(nested_program, stages=["image"]).image
+    optimized, report = peephole(image)
+    # s = s; 与 g = g; 各 5 条指令，两个分支的 return 之后的 LEV 与 JMP 不可达
+    assert report.rules["self-assignments"] == 10
+    assert report.rules["unreachable"] == 2
+    # 内层 if 的 else 末尾跳到外层 if 的 else 跳转
+    assert report.rules["threaded jumps"] >= 1
+    assert len(optimized.text) < len(image.text)
+    # 再次优化没有可做的
+    assert peephole(optimized)[1].removed == 0
+
+    unoptimized = pycc.compile(nested_program)
+    unoptimized.run()
+    program = pycc.compile(nested_program, optimize=1)
+    program.run()
+    assert program.vm.cycle < unoptimized.vm.cycle
+
+
+def test_jump_targets_stay_consistent():
+    image, _ = peephole(pycc.compile(nested_program, stages=["image"]).image)
+    ops = decode(image)
+    starts = {op.index for op in ops}
+    relocated = {item >> 1 for item in image.relocations}
+    for op in ops:
+        if op.target is not None:
+            assert op.target in starts
+            assert op.index + 1 in relocated
+    text = array("q", image.text)
+    for *_, value, relocation in image.symbols:
+        if relocation == 0:
+            assert value // SLOT_BYTES in starts
+    assert text[image.entry // SLOT_BYTES] == Instruction.ENT.value
+
+
+def test_push_adj():
+    image = pycc.compile("int main() { return 1; }", stages=["image"]).image
+    text = array("q", image.text)
+    # main 开头插入 PUSH; ADJ 2
+    text[2:2] = array("q", [Instruction.PUSH.value, Instruction.ADJ.value, 2])
+    image.text = text.tobytes()
+    optimized, report = peephole(image)
+    assert report.rules["push/adj"] == 1
+    assert [op.opcode for op in decode(optimized)][:4] == [
+        Instruction.ENT.value,
+        Instruction.ADJ.value,
+        Instruction.IMM.value,
+        Instruction.LEV.value,
+    ]
+
+
+def test_optimize_units_with_externals():
+    # 带外部引用的目标单元优化后仍能正确链接
+    units = [pycc.compile(source, stages=["image"], optimize=1).image for source in (main_unit, library_unit)]
+    assert pycc.from_image(pycc.link(units)).run() == 44
+    assert pycc.build([main_unit, library_unit], optimize=1).run() == 44
+
+
+def test_cache_key_includes_optimization(tmp_path):
+    cache = pycc.CompileCache(tmp_path)
+    pycc.compile(sum_program, cache=cache)
+    program = pycc.compile(sum_program, cache=cache, optimize=1)
+    assert program.optimization is not None
+    assert pycc.compile(sum_program, cache=cache, optimize=1).run() == 45
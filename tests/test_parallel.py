@@ -0,0 +1,108 @@
+from pathlib import Path
+
+import pytest
+import pycc
+from pycc import parallel
+from pycc.cache import CompileCache
+from pycc.image import Image
+from pycc.lexer import TokenBuffer
+from pycc.parallel import compile_functions_parallel, split_top_level
+from pycc.parser import Parser
+
+from benchmarks.sources import generate_expressions, generate_program
+from tests.programs import fibonacci_program, forward_program, globals_program, sum_program
+
+programs = [
+    sum_program,
+    fibonacci_program,
+    globals_program,
+    forward_program,
+    generate_program(num_funcs=10),
+    generate_expressions(num_stmts=50),
+]
+
+
+def test_split_top_level():
+    tokens = TokenBuffer.from_source(globals_program)
+    items = split_top_level(tokens)
+    assert [item.body is not None for item in items] == [False, False, True, True]
+    assert items[-1].stop == len(tokens)
+    assert all(prev.stop == item.start for prev, item in zip(items, items[1:]))
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+@pytest.mark.parametrize("source_code", programs)
+def test_parallel_matches_serial(source_code: str, workers: int):
+    parser = Parser(source_code, build_ast=False)
+    parser.start()
+    serial = Image.from_parser(parser)
+    parallel = compile_functions_parallel(TokenBuffer.from_source(source_code), workers)
+    assert parallel.text == serial.text
+    assert parallel.data == serial.data
+    assert parallel.entry == serial.entry
+    assert sorted(parallel.relocations) == sorted(serial.relocations)
+
+
+@pytest.mark.parametrize("source_code", programs)
+def test_parallel_superinstructions(source_code: str):
+    parser = Parser(source_code, build_ast=False, superinstructions=True)
+    parser.start()
+    parallel = compile_functions_parallel(TokenBuffer.from_source(source_code), 2, superinstructions=True)
+    assert parallel.text == Image.from_parser(parser).text
+
+
+def test_compile_with_workers():
+    assert pycc.compile(globals_program, workers=2).run() == 15
+    program = pycc.compile(forward_program, stages=["code", "image"], workers=2)
+    assert program.image is not None and program.run() == 11
+
+
+def test_parallel_reports_serial_errors():
+    source_code = "int f() { return 1; }\nint f() { return 2; }\nint main() { return f(); }\n"
+    with pytest.raises(pycc.CompileError, match="name f already exists"):
+        pycc.compile(source_code, workers=2)
+
+
+def test_parallel_internal_errors_propagate(monkeypatch: pytest.MonkeyPatch):
+    def failing_compile_function(*args):
+        raise RuntimeError("internal error")
+
+    monkeypatch.setattr(parallel, "compile_function", failing_compile_function)
+    # 只有源码错误才回退到串行编译，编译器自身的错误直接抛出
+    with pytest.raises(RuntimeError, match="internal error"):
+        pycc.compile(generate_program(num_funcs=2), workers=1)
+
+
+def test_incremental_recompile(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    cache = CompileCache(tmp_path)
+    source_code = generate_program(num_funcs=5)
+    compiled = []
+    compile_function = parallel.compile_function
+
+    def counting_compile_function(function_tokens, *args):
+        compiled.append(function_tokens[1][1])
+        return compile_function(function_tokens, *args)
+
+    monkeypatch.setattr(parallel, "compile_function", counting_compile_function)
+    # 冷缓存时串行编译
+    assert pycc.compile(source_code, cache=cache).run() == pycc.compile(source_code).run()
+    assert compiled == []
+    # 此前编译过的单元改动后按函数编译，缓存各个函数
+    source_code = source_code.replace("x = a + b * 2;", "x = a + b * 4;", 1)
+    pycc.compile(source_code, stages=["image"], cache=cache)
+    assert sorted(compiled) == sorted([*(f"func_{i}" for i in range(5)), "main"])
+
+    # 只改动一个函数，其余函数复用缓存
+    compiled.clear()
+    edited = source_code.replace("x = a + b * 4;", "x = a + b * 3;", 1)
+    serial = Parser(edited, build_ast=False)
+    serial.start()
+    program = pycc.compile(edited, stages=["image"], cache=cache)
+    assert compiled == ["func_0"]
+    assert program.image is not None and program.image.text == Image.from_parser(serial).text
+
+    # 改动函数引用的全局符号的签名时重新编译引用它的函数
+    compiled.clear()
+    edited = edited.replace("int counter;", "char counter;")
+    pycc.compile(edited, stages=["image"], cache=cache)
+    assert sorted(compiled) == sorted(f"func_{i}" for i in range(5))
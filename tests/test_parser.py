@@ -0,0 +1,143 @@
+from array import array
+
+import pytest
+from pycc.lexer import Lexer, TokenBuffer
+from pycc.image import Image
+from pycc.optimizer import decode
+from pycc.parser import Parser
+from pycc.vm import Instruction
+from tests.programs import fibonacci_program, globals_program, sum_program
+
+
+def run(parser: Parser) -> int:
+    parser.start()
+    parser.vm.setup_main(parser.symbols.get_symbol("main").value)
+    return parser.vm.run(False)
+
+
+@pytest.mark.parametrize(
+    "source_code, expected",
+    [
+        (sum_program, 45),
+        (fibonacci_program, 89),
+        (globals_program, 15),
+    ],
+)
+def test_run(source_code: str, expected: int):
+    assert run(Parser(source_code)) == expected
+    assert run(Parser(Lexer(source_code))) == expected
+    assert run(Parser(TokenBuffer.from_source(source_code))) == expected
+    assert run(Parser(source_code, build_ast=False)) == expected
+
+
+def test_without_ast():
+    parser = Parser(sum_program, build_ast=False)
+    assert parser.start() is None
+    assert Parser(sum_program).start() is not None
+
+
+@pytest.mark.parametrize(
+    "expression, expected",
+    [
+        ("1 + 2 * 3", 7),
+        ("10 - 4 - 3", 3),
+        ("100 / 10 / 5", 2),
+        ("7 % 4 * 3", 9),
+        ("(1 + 2) * 3", 9),
+        ("1 + 2 < 4 == 1", 1),
+        ("6 & 3 | 8 ^ 12", 6),
+        ("0 || 0 && 1", 0),
+        ("0 || 5", 5),
+        ("3 && 0 || 2", 2),
+        ("1 < 2 && 2 <= 2 && 3 > 2 && 3 >= 4", 0),
+        ("'a' + 1", 98),
+    ],
+)
+def test_expression(expression: str, expected: int):
+    assert run(Parser(f"int main() {{ return {expression}; }}")) == expected
+
+
+@pytest.mark.parametrize(
+    "expression, expected",
+    [
+        ("2 * 3 + 1", 7),
+        ("(0 - 7) / 2", -3),
+        ("(0 - 7) % 3", -1),
+        ("7 % (0 - 3)", 1),
+        ("(1 < 2) + (2 == 2) + (3 != 3)", 2),
+        ("0 && 1 / 0", 0),
+        ("4 || 1 / 0", 4),
+        ("0 || 3 && 2", 2),
+    ],
+)
+def test_constant_folding(expression: str, expected: int):
+    parser = Parser(f"int main() {{ return {expression}; }}")
+    assert run(parser) == expected
+    # ENT 0; IMM v; LEV; LEV
+    assert list(array("q", parser.vm.dump_text())) == [
+        Instruction.ENT.value,
+        0,
+        Instruction.IMM.value,
+        expected,
+        Instruction.LEV.value,
+        Instruction.LEV.value,
+    ]
+
+
+def test_constant_folding_keeps_runtime_operations():
+    # 除数为 0 留到运行时，非常量的一侧照常求值
+    parser = Parser("int g; int main() { return 1 / 0 + g; }")
+    parser.start()
+    text = array("q", parser.vm.dump_text())
+    assert Instruction.DIV.value in text and Instruction.ADD.value in text
+
+    parser = Parser("int g; int main() { g = 5; return 1 || g + 0 * 2; }")
+    assert run(parser) == 1
+    # 短路的右值被丢弃，只剩 g = 5 中对 g 的重定位项
+    assert len(parser.relocations) == 1
+
+    parser = Parser("int main() { int a; a = 4; return (a + 2 * 3) * (0 || a); }")
+    assert run(parser) == 40
+
+
+@pytest.mark.parametrize(
+    "source_code, expected",
+    [
+        (sum_program, 45),
+        (fibonacci_program, 89),
+        (globals_program, 15),
+    ],
+)
+def test_superinstructions(source_code: str, expected: int):
+    parser = Parser(source_code, superinstructions=True)
+    assert run(parser) == expected
+    opcodes = {op.opcode for op in decode(Image.from_parser(parser))}
+    assert Instruction.LLI.value in opcodes and Instruction.ADDI.value in opcodes
+    assert Instruction.LEA.value not in opcodes
+
+    unfused = Parser(source_code)
+    run(unfused)
+    assert parser.vm.cycle < unfused.vm.cycle
+
+
+def test_long_statement_lists():
+    # 语句列表与顶层声明不再递归，数万条语句不会超出递归深度
+    num_globals = 2000
+    num_stmts = 20000
+    globals_ = "".join(f"int g{i};\n" for i in range(num_globals))
+    body = "  a = a + 1;\n" * num_stmts
+    source_code = f"{globals_}int main() {{\n  int a;\n  a = 0;\n{body}  return a;\n}}\n"
+    parser = Parser(source_code, build_ast=False, poolsize=4 * 1024 * 1024)
+    assert run(parser) == num_stmts
+
+
+def test_text_segment_overflow():
+    body = "  a = a + 1;\n" * 1000
+    with pytest.raises(OverflowError):
+        Parser(f"int main() {{\n  int a;\n{body}  return a;\n}}\n", poolsize=8 * 1024).start()
+
+
+@pytest.mark.parametrize("source_code", ["int main() { 1; }", "int main() { (a); }", "int main() { return ; }"])
+def test_unexpected_symbol(source_code: str):
+    with pytest.raises(Exception, match="Unexpected symbol"):
+        Parser(source_code).start()
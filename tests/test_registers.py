@@ -0,0 +1,158 @@
+from array import array
+from pathlib import Path
+
+import pytest
+import pycc
+from pycc.image import Image
+from pycc.optimizer import peephole
+from pycc.registers import to_registers
+from pycc.vm import InstructionSet, RegisterInstruction, VirtualMachine
+from tests.programs import (
+    fibonacci_program,
+    forward_program,
+    globals_program,
+    library_unit,
+    main_unit,
+    nested_program,
+    short_circuit_program,
+    sum_program,
+)
+
+REGISTER = InstructionSet.REGISTER
+
+
+def word(instruction: RegisterInstruction, a: int = 0, b: int = 0, c: int = 0) -> int:
+    return instruction.value | a << 8 | b << 16 | c << 24
+
+
+def test_register_machine():
+    vm = VirtualMachine(256 * 1024, REGISTER)
+    assert vm.instruction_set is REGISTER
+    ptr = vm.put_int_onto_data(40)
+    # r1 = *ptr; r2 = 2; r0 = r1 + r2; 退出
+    for op in [
+        word(RegisterInstruction.LDG, 1),
+        ptr,
+        word(RegisterInstruction.LI, 2),
+        2,
+        word(RegisterInstruction.ADD, 0, 1, 2),
+        word(RegisterInstruction.EXIT),
+    ]:
+        vm.add_op(op)
+    assert vm.run(True) == 42
+    assert vm.registers[:3] == [42, 40, 2]
+
+
+@pytest.mark.parametrize(
+    "source_code, expected",
+    [
+        (sum_program, 45),
+        (fibonacci_program, 89),
+        (globals_program, 15),
+        (forward_program, 11),
+        (nested_program, 84),
+        (short_circuit_program, 126),
+    ],
+)
+@pytest.mark.parametrize("optimize", [0, 1, 2])
+def test_register_program(source_code: str, expected: int, optimize: int):
+    stack = pycc.compile(source_code, optimize=optimize)
+    assert stack.run() == expected
+    program = pycc.compile(source_code, optimize=optimize, instruction_set=REGISTER)
+    assert program.vm.instruction_set is REGISTER  # type: ignore
+    assert program.run() == expected
+    assert program.vm.cycle < stack.vm.cycle  # type: ignore
+
+
+def test_register_image(tmp_path: Path):
+    image = pycc.compile(fibonacci_program, stages=["image"], instruction_set=REGISTER).image
+    assert image is not None and image.instruction_set is REGISTER
+    assert Image.from_bytes(image.to_bytes()) == image
+    path = tmp_path / "fibonacci.pyco"
+    image.save(path)
+    assert pycc.load(path).run() == 89
+    # 寄存器代码不能在栈式虚拟机上运行，也不能再做窥孔优化或翻译
+    with pytest.raises(ValueError):
+        image.load(VirtualMachine(256 * 1024))
+    with pytest.raises(ValueError):
+        peephole(image)
+    with pytest.raises(ValueError):
+        to_registers(image)
+
+
+def test_register_function_addresses():
+    program = pycc.compile(forward_program, stages=["symbols", "code", "image"], instruction_set=REGISTER)
+    text = array("q", program.image.text)  # type: ignore
+    for symbol in program.symbols.values():  # type: ignore
+        if symbol.name in ("odd", "even", "main"):
+            offset = symbol.value - program.vm.text_base  # type: ignore
+            assert text[offset // text.itemsize] & 0xFF == RegisterInstruction.ENT.value
+
+
+def test_register_build():
+    assert pycc.build([main_unit, library_unit], instruction_set=REGISTER, optimize=1).run() == 44
+    # 寄存器代码的目标单元同样可以链接
+    units = [
+        to_registers(pycc.compile(source, stages=["image"]).image)  # type: ignore
+        for source in (main_unit, library_unit)
+    ]
+    assert pycc.from_image(pycc.link(units)).run() == 44
+    with pytest.raises(pycc.LinkError):
+        pycc.link([units[0], pycc.compile(library_unit, stages=["image"]).image])  # type: ignore
+
+
+def test_register_parallel_and_cache(tmp_path: Path):
+    cache = pycc.CompileCache(tmp_path)
+    assert pycc.compile(fibonacci_program, cache=cache, workers=1, instruction_set=REGISTER).run() == 89
+    # 栈式与寄存器的编译结果分别缓存
+    assert pycc.compile(fibonacci_program, cache=cache).vm.instruction_set is InstructionSet.STACK  # type: ignore
+    program = pycc.compile(fibonacci_program, cache=cache, instruction_set=REGISTER)
+    assert program.vm.instruction_set is REGISTER  # type: ignore
+    assert program.run() == 89
+
+
+def test_spill_to_stack():
+    expression = "a"
+    for _ in range(18):
+        expression = f"a + ({expression})"
+    source_code = f"""
+int twice(int x) {{ return x * 2; }}
+int main() {{
+  int a;
+  char c;
+  a = 1;
+  c = {expression};
+  return twice({expression}) + c - twice(a + (a + twice(a + ({expression})))) + 44;
+}}
+"""
+    assert pycc.compile(source_code).run() == 17
+    # 表达式栈深超过寄存器数的函数溢出到虚拟机栈
+    for optimize in (0, 1, 2):
+        assert pycc.compile(source_code, optimize=optimize, instruction_set=REGISTER).run() == 17
+    image = pycc.compile(source_code, stages=["image"], instruction_set=REGISTER).image
+    text = array("q", image.text)  # type: ignore
+    assert any(op & 0xFF == RegisterInstruction.POP.value for op in text)
+
+
+@pytest.mark.parametrize("optimize", [0, 1, 2])
+def test_constant_branch(optimize: int):
+    source_code = """
+int main() {
+  int a;
+  a = 1;
+  if (0) {
+    a = 2;
+  }
+  while (1) {
+    if (1) {
+      a = a + 10;
+    } else {
+      a = 0;
+    }
+    return a;
+  }
+  return 0;
+}
+"""
+    # 总是跳转的常量条件之后直到下一个跳转目标的代码不可达
+    assert pycc.compile(source_code, optimize=optimize, instruction_set=REGISTER).run() == 11
@@ -0,0 +1,77 @@
+import pytest
+
+import pycc
+from pycc.trace import TRACE_RECORD, load_trace, render_trace, save_trace, trace_records
+from pycc.vm import Instruction, InstructionSet, RegisterInstruction
+
+sum_program = """
+int main() {
+  int i;
+  int s;
+  i = 0;
+  s = 0;
+  while (i < 10) {
+    s = s + i;
+    i = i + 1;
+  }
+  return s;
+}
+"""
+
+
+@pytest.mark.parametrize("instruction_set", list(InstructionSet))
+def test_trace_ring_buffer(instruction_set: InstructionSet):
+    program = pycc.compile(sum_program, instruction_set=instruction_set)
+    vm = program.vm
+    assert len(vm.trace) == 0  # type: ignore
+
+    vm.set_trace(16)  # type: ignore
+    assert program.run() == 45
+    records = list(trace_records(vm.trace))  # type: ignore
+    # 只保留最后 16 条，按执行顺序排列，最后一条是 main 返回后的 EXIT
+    assert len(records) == 16
+    assert [record.cycle for record in records] == list(range(vm.cycle - 15, vm.cycle + 1))  # type: ignore
+    exit = Instruction.EXIT if instruction_set == InstructionSet.STACK else RegisterInstruction.EXIT
+    assert records[-1].op & 0xFF == exit.value and records[-1].ax == 45
+    assert len(memoryview(vm.trace).tobytes()) == 16 * TRACE_RECORD.size  # type: ignore
+
+
+def test_trace_matches_untraced_run():
+    untraced = pycc.compile(sum_program, optimize=2)
+    untraced.run()
+    traced = pycc.compile(sum_program, optimize=2)
+    traced.vm.set_trace(1 << 12)  # type: ignore
+    assert traced.run() == 45
+    records = list(trace_records(traced.vm.trace))  # type: ignore
+    assert len(records) == traced.vm.cycle == untraced.vm.cycle  # type: ignore
+    assert records[0].cycle == 1 and records[0].pc == 0 and records[0].op == Instruction.ENT.value
+
+
+def test_trace_file(tmp_path):
+    program = pycc.compile(sum_program)
+    program.vm.set_trace(1 << 12)  # type: ignore
+    program.run()
+    path = tmp_path / "sum.pyct"
+    assert save_trace(path, program.vm.trace, InstructionSet.STACK) == program.vm.cycle  # type: ignore
+
+    instruction_set, records = load_trace(path)
+    assert instruction_set == InstructionSet.STACK
+    lines = list(render_trace(records, instruction_set))
+    assert len(lines) == program.vm.cycle  # type: ignore
+    assert lines[0].startswith("1>") and "ENT" in lines[0]
+    assert list(render_trace(records, instruction_set, last=2))[-1].split()[2] == "EXIT"
+
+    path.write_bytes(path.read_bytes()[:-1])
+    with pytest.raises(ValueError):
+        load_trace(path)
+
+
+def test_trace_numpy():
+    numpy = pytest.importorskip("numpy")
+    program = pycc.compile(sum_program)
+    program.vm.set_trace(8)  # type: ignore
+    program.run()
+    records = numpy.asarray(program.vm.trace)  # type: ignore
+    assert records.dtype.names == ("cycle", "pc", "op", "operand", "ax", "sp")
+    assert records["cycle"][-1] == program.vm.cycle  # type: ignore
+    assert records["ax"][-1] == 45
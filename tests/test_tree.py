@@ -0,0 +1,66 @@
+import json
+from pathlib import Path
+
+import pytest
+from pycc.lexer import Num
+from pycc.parser import Parser
+from pycc.tree import Node, NodeKind, TerminalNode
+
+call_program = """
+int add(int a, int b) { return a + b; }
+int main() { return add(1, 'x'); }
+"""
+
+
+def find(node: Node, kind: NodeKind) -> list[Node]:
+    found: list[Node] = []
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if node.kind == kind:
+            found.append(node)
+        stack.extend(reversed(node.children))
+    return found
+
+
+def assert_same_tree(a: Node, b: Node):
+    assert (a.kind, a.start, a.end, len(a.children)) == (b.kind, b.start, b.end, len(b.children))
+    if isinstance(a, TerminalNode):
+        assert isinstance(b, TerminalNode)
+        assert (a.token_kind, a.value) == (b.token_kind, b.value)
+    for child_a, child_b in zip(a.children, b.children):
+        assert_same_tree(child_a, child_b)
+
+
+def test_spans():
+    ast = Parser(call_program).start()
+    assert ast is not None
+    assert call_program[ast.start : ast.end] == call_program.strip()
+    call = [node for node in find(ast, NodeKind.factor) if len(node.children) > 1][-1]
+    assert call_program[call.start : call.end] == "add(1, 'x')"
+
+
+def test_json_keeps_repeated_children(tmp_path: Path):
+    ast = Parser(call_program).start()
+    assert ast is not None
+    ast.dump(str(tmp_path / "ast.json"))
+    with open(tmp_path / "ast.json", encoding="utf-8") as f:
+        view = json.load(f)
+    assert view == ast.to_ast()
+    call = [node for node in find(ast, NodeKind.factor) if len(node.children) > 1][-1]
+    # 两个实参对应的 expr 都被保留
+    assert [child["kind"] for child in call.to_ast()["children"] if "kind" in child] == ["expr", "expr"]  # type: ignore
+
+
+def test_binary_roundtrip(tmp_path: Path):
+    ast = Parser(call_program).start()
+    assert ast is not None
+    ast.dump_binary(str(tmp_path / "ast.bin"))
+    assert_same_tree(Node.load_binary(str(tmp_path / "ast.bin")), ast)
+
+
+def test_binary_rejects_out_of_range_literal(tmp_path: Path):
+    root = Node(NodeKind.expr, 0)
+    root.add_node(TerminalNode(Num.kind, 1 << 64, 0, 20))
+    with pytest.raises(ValueError, match="does not fit in int64"):
+        root.dump_binary(str(tmp_path / "ast.bin"))
@@ -1,5 +1,5 @@
 import pytest
-from pycc.vm import VirtualMachine, Instruction, c_pointer_to_string, c_pointer_to_integer
+from pycc.vm import DEFAULT_STACK_SIZE, VirtualMachine, Instruction, c_pointer_to_string, c_pointer_to_integer
 
 
 poolsize = 256 * 1024
@@ -114,9 +114,11 @@ def test_registers():
     global poolsize
     a, b = 1, 2
     vm = VirtualMachine(poolsize)
+    # BP、SP 指向栈区末尾（不可读），PC 指向代码段起始处
+    stack_top = vm.sp
+    assert vm.bp == stack_top and vm.pc == vm.text_base
     assert c_pointer_to_integer(vm.pc) == 0
-    assert c_pointer_to_integer(vm.bp) == 0
-    assert c_pointer_to_integer(vm.sp) == 0
+    assert c_pointer_to_integer(stack_top - 8) == 0
 
     vm.add_op(Instruction.IMM)
     vm.add_op(a)
@@ -128,11 +130,14 @@ def test_registers():
     vm.add_op(Instruction.EXIT)
 
     result = vm.run(True)
+    assert c_pointer_to_integer(stack_top - 8) == a + b
 
     vm.reset()
+    assert vm.bp == vm.sp == stack_top and vm.pc == vm.text_base
+    assert vm.num_ops == 0 and vm.cycle == 0
+    # reset 清空用过的代码段与栈区
     assert c_pointer_to_integer(vm.pc) == 0
-    assert c_pointer_to_integer(vm.bp) == 0
-    assert c_pointer_to_integer(vm.sp) == 0
+    assert c_pointer_to_integer(stack_top - 8) == 0
     assert result == a + b
 
 
@@ -183,3 +188,68 @@ def test_global_add(a: int, b: int):
 
     result = vm.run(True)
     assert result == a + b
+
+
+@pytest.mark.parametrize(
+    "a, b, c",
+    [
+        (9999, -8888, 7),
+    ],
+)
+def test_superinstructions(a: int, b: int, c: int):
+    global poolsize
+    vm = VirtualMachine(poolsize)
+
+    ptr_a = vm.put_int_onto_data(a)
+    ptr_b = vm.put_int_onto_data(b)
+    # 局部变量 x = a + c; 返回 x + b
+    vm.add_op(Instruction.ENT)
+    vm.add_op(1)
+    vm.add_op(Instruction.LGI)
+    vm.add_op(ptr_a)
+    vm.add_op(Instruction.ADDI)
+    vm.add_op(c)
+    vm.add_op(Instruction.SLI)
+    vm.add_op(-1)
+    vm.add_op(Instruction.LGI)
+    vm.add_op(ptr_b)
+    vm.add_op(Instruction.PUSH)
+    vm.add_op(Instruction.LLI)
+    vm.add_op(-1)
+    vm.add_op(Instruction.ADD)
+    vm.add_op(Instruction.PUSH)
+    vm.add_op(Instruction.EXIT)
+
+    result = vm.run(True)
+    assert result == a + b + c
+
+
+def test_segments():
+    vm = VirtualMachine(4096, stack_size=1024)
+    assert vm.poolsize == 4096 and vm.stack_size == 1024
+    assert vm.sp - vm.bp == 0
+    assert VirtualMachine(poolsize).stack_size == DEFAULT_STACK_SIZE
+
+    ptr = vm.put_int_onto_data(42)
+    vm.add_op(Instruction.IMM)
+    vm.add_op(ptr)
+    vm.add_op(Instruction.LI)
+    vm.add_op(Instruction.PUSH)
+    vm.add_op(Instruction.EXIT)
+    assert vm.run(False) == 42
+
+    # 重复使用同一个虚拟机，reset 后数据段与代码段从头写入且已清零
+    vm.reset()
+    assert vm.data_size == 0 and c_pointer_to_integer(ptr) == 0
+    assert vm.put_int_onto_data(7) == ptr
+    vm.add_op(Instruction.IMM)
+    vm.add_op(ptr)
+    vm.add_op(Instruction.LI)
+    vm.add_op(Instruction.PUSH)
+    vm.add_op(Instruction.EXIT)
+    assert vm.run(False) == 7
+
+    with pytest.raises(ValueError):
+        VirtualMachine(-1)
+    with pytest.raises(ValueError):
+        VirtualMachine(poolsize, stack_size=0)